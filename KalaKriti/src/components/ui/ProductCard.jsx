@@ -117,7 +117,7 @@ const ProductCard = ({
           src={
             imageError
               ? imageService.getFallbackImage(product.category)
-              : imageService.getImageUrl(product.image || product.images?.[0])
+              : imageService.getThumbnailUrl(product.image || product.images?.[0])
           }
           alt={product.title || product.name}
           className="w-full h-full object-cover"
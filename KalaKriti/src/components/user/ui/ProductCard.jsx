@@ -1,5 +1,6 @@
 import React from "react";
 import "./ProductCard.css";
+import { imageService } from "../../../services/imageService";
 
 const ProductCard = ({
   product,
@@ -25,7 +26,10 @@ const ProductCard = ({
     <div className={`product-card ${className}`} onClick={handleClick}>
       <div className="product-image">
         <img
-          src={product.images?.[0] || "/uploads/placeholder.jpg"}
+          src={
+            imageService.getThumbnailUrl(product.images?.[0]) ||
+            "/uploads/placeholder.jpg"
+          }
           alt={product.title}
           loading="lazy"
           onError={(e) => {
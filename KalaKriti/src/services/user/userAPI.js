@@ -44,6 +44,28 @@ class UserAPIService {
     }
   }
 
+  // Sidebar filters: { category, tags: [], craftType, priceRange: [min, max], inStock, sortBy }
+  async filterProducts (filters = {}, page = 1, limit = 20) {
+    try {
+      const params = new URLSearchParams({ page, limit })
+      if (filters.category) params.append('category', filters.category)
+      if (filters.tags?.length) params.append('tags', filters.tags.join(','))
+      if (filters.craftType) params.append('craft_type', filters.craftType)
+      if (filters.priceRange) {
+        params.append('min_price', filters.priceRange[0])
+        params.append('max_price', filters.priceRange[1])
+      }
+      if (filters.inStock) params.append('in_stock', 'true')
+      if (filters.sortBy) params.append('sort_by', filters.sortBy)
+
+      const response = await fetch(`${API_BASE_URL}/products/filter?${params}`)
+      return await response.json()
+    } catch (error) {
+      console.error('Error filtering products:', error)
+      throw error
+    }
+  }
+
   async getProduct (productId) {
     try {
       const response = await fetch(`${API_BASE_URL}/products/${productId}`)
@@ -0,0 +1,185 @@
+# Unified account index for users and artisans. Each entry in the ``accounts``
+# collection carries the credentials and points at the ``users`` or
+# ``artisan_profiles`` document holding the rest of the profile.
+from datetime import datetime
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+PROFILE_ID_FIELDS = {"user": "user_id", "artisan": "artisan_id"}
+
+# The collection whose indexes exist; rebinding to another database creates them again
+_indexed_collection = None
+
+
+class AccountExistsError(Exception):
+    """Raised when the email or username is already registered."""
+
+    def __init__(self, field: str):
+        super().__init__(f"{field} already registered")
+        self.field = field
+
+
+def ensure_account_indexes(accounts_collection) -> None:
+    """Create the unique indexes once per bound collection."""
+    global _indexed_collection
+    if accounts_collection is None or accounts_collection is _indexed_collection:
+        return
+    accounts_collection.create_index("email", unique=True)
+    accounts_collection.create_index("username", unique=True)
+    _indexed_collection = accounts_collection
+
+
+def _profile_collection(user_type: str, users_collection, artisan_profiles_collection):
+    return artisan_profiles_collection if user_type == "artisan" else users_collection
+
+
+def create_account(accounts_collection, account_id: str, email: str, username: str,
+                   password_hash: str, user_type: str) -> dict:
+    """Insert the account entry, raising AccountExistsError on a duplicate."""
+    ensure_account_indexes(accounts_collection)
+    account = {
+        "account_id": account_id,
+        "email": email,
+        "username": username,
+        "password": password_hash,
+        "user_type": user_type,
+        "created_at": datetime.now().isoformat(),
+    }
+    try:
+        accounts_collection.insert_one(dict(account))
+    except DuplicateKeyError as e:
+        raise AccountExistsError(_duplicate_field(e))
+    return account
+
+
+def _duplicate_field(error: DuplicateKeyError) -> str:
+    key_pattern = (error.details or {}).get("keyPattern") or {}
+    return "username" if "username" in key_pattern or "username_1" in str(error) else "email"
+
+
+def change_identity(accounts_collection, account_id: str, email: Optional[str] = None,
+                    username: Optional[str] = None) -> Optional[dict]:
+    """Move an account to a new email and/or username, raising AccountExistsError if either is taken.
+
+    Profile updates claim the keys here first, so the unique indexes on
+    ``accounts`` stay the single source of truth for logins. Returns the
+    previous values; pass them to :func:`restore_identity` if the profile
+    write then fails.
+    """
+    changes = {field: value for field, value in (("email", email), ("username", username)) if value is not None}
+    if not changes or accounts_collection is None:
+        return None
+    ensure_account_indexes(accounts_collection)
+    try:
+        previous = accounts_collection.find_one_and_update(
+            {"account_id": account_id}, {"$set": changes}, projection={"_id": 0, **{f: 1 for f in changes}}
+        )
+    except DuplicateKeyError as e:
+        raise AccountExistsError(_duplicate_field(e))
+    if previous is None:
+        # Profile without an account entry: still refuse keys another account holds
+        for field, value in changes.items():
+            if accounts_collection.find_one({field: value}, {"_id": 1}) is not None:
+                raise AccountExistsError(field)
+    return previous
+
+
+def restore_identity(accounts_collection, account_id: str, previous: Optional[dict]) -> None:
+    """Undo :func:`change_identity` after the profile update it guarded failed."""
+    if accounts_collection is None or not previous:
+        return
+    accounts_collection.update_one({"account_id": account_id}, {"$set": previous})
+
+
+def _legacy_account(profile: dict, user_type: str) -> dict:
+    return {
+        "account_id": profile.get(PROFILE_ID_FIELDS[user_type]),
+        "email": profile["email"],
+        "username": profile.get("username"),
+        "password": profile["password"],
+        "user_type": user_type,
+        "created_at": profile.get("created_at") or datetime.now().isoformat(),
+    }
+
+
+def _backfill_legacy_account(accounts_collection, email: str,
+                             users_collection, artisan_profiles_collection) -> Optional[dict]:
+    """Copy a pre-index account (password stored on the profile) into the index."""
+    for user_type in ("user", "artisan"):
+        collection = _profile_collection(user_type, users_collection, artisan_profiles_collection)
+        if collection is None:
+            continue
+        profile = collection.find_one({"email": email}, {"_id": 0})
+        if profile and "password" in profile:
+            account = _legacy_account(profile, user_type)
+            try:
+                accounts_collection.insert_one(dict(account))
+            except DuplicateKeyError:
+                pass
+            return account
+    return None
+
+
+def backfill_legacy_accounts(accounts_collection, users_collection, artisan_profiles_collection,
+                             migrations_collection=None) -> int:
+    """Copy every pre-index account into the index, once per database.
+
+    Registration and profile updates only consult ``accounts``, so this must
+    run before serving; otherwise a sign-up could take the email or username
+    of a legacy user who has not logged in since the index was introduced.
+    """
+    if accounts_collection is None:
+        return 0
+    if migrations_collection is not None and migrations_collection.find_one({"name": "accounts_backfill"}):
+        return 0
+    ensure_account_indexes(accounts_collection)
+    copied = 0
+    for user_type in ("user", "artisan"):
+        collection = _profile_collection(user_type, users_collection, artisan_profiles_collection)
+        if collection is None:
+            continue
+        for profile in collection.find({"password": {"$exists": True}}, {"_id": 0}):
+            if not profile.get("email"):
+                continue
+            try:
+                accounts_collection.insert_one(_legacy_account(profile, user_type))
+                copied += 1
+            except DuplicateKeyError as e:
+                existing = accounts_collection.find_one({"account_id": profile.get(PROFILE_ID_FIELDS[user_type])})
+                if existing is None:
+                    print(f"⚠ Legacy {user_type} {profile['email']} clashes on {_duplicate_field(e)}, not indexed")
+    if migrations_collection is not None:
+        migrations_collection.update_one(
+            {"name": "accounts_backfill"},
+            {"$setOnInsert": {"name": "accounts_backfill", "done_at": datetime.now().isoformat(), "copied": copied}},
+            upsert=True,
+        )
+    return copied
+
+
+def find_account(accounts_collection, email: str,
+                 users_collection=None, artisan_profiles_collection=None) -> Optional[dict]:
+    """Look up an account by email with a single indexed read."""
+    ensure_account_indexes(accounts_collection)
+    account = accounts_collection.find_one({"email": email}, {"_id": 0})
+    if account is None:
+        account = _backfill_legacy_account(
+            accounts_collection, email, users_collection, artisan_profiles_collection
+        )
+    return account
+
+
+def touch_login(account: dict, users_collection, artisan_profiles_collection) -> Optional[dict]:
+    """Stamp last_login on the profile and return it in the same round-trip."""
+    user_type = account["user_type"]
+    collection = _profile_collection(user_type, users_collection, artisan_profiles_collection)
+    if collection is None:
+        return None
+    return collection.find_one_and_update(
+        {PROFILE_ID_FIELDS[user_type]: account["account_id"]},
+        {"$set": {"last_login": datetime.now().isoformat()}},
+        projection={"_id": 0, "password": 0},
+        return_document=ReturnDocument.AFTER,
+    )
@@ -0,0 +1,273 @@
+# Content-addressed storage for uploads and generated posters. Files are
+# named by their SHA-256 and sharded two levels deep
+# (uploads/blobs/ab/cd/abcd....png), so identical uploads are stored once and
+# no directory grows past a few hundred entries. Bytes go through an
+# object_storage backend (local disk or an S3-compatible bucket). The `blobs` collection keeps
+# a reference count per digest from products.images and profile images; a
+# background collector recounts references (the source of truth), then deletes
+# blobs that stayed unreferenced past a grace period, plus stray files that
+# never got a record.
+import asyncio
+import hashlib
+import mimetypes
+import os
+import pathlib
+import re
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import IO, List, Optional, Tuple
+
+from ingest import detect_image_type
+from object_storage import LocalStorage
+
+UPLOAD_DIR = pathlib.Path("uploads")
+BLOB_PREFIX = "blobs"
+COPY_CHUNK_SIZE = 1024 * 1024
+GC_INTERVAL_SECONDS = int(os.getenv("BLOB_GC_INTERVAL_SECONDS", "3600"))
+GC_GRACE_SECONDS = int(os.getenv("BLOB_GC_GRACE_SECONDS", str(24 * 3600)))
+
+# Matches blob URLs (/uploads/blobs/ab/cd/<digest>.png) and filesystem paths alike
+BLOB_REFERENCE = re.compile(r"blobs/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.[A-Za-z0-9]+")
+
+
+def blob_digests(values) -> set:
+    """Digests of every blob referenced by a string or (nested) list of strings."""
+    if values is None:
+        return set()
+    if isinstance(values, str):
+        return set(BLOB_REFERENCE.findall(values))
+    digests = set()
+    for value in values:
+        if isinstance(value, str):
+            digests.update(BLOB_REFERENCE.findall(value))
+    return digests
+
+
+def _image_ext(head: bytes) -> str:
+    image_type = detect_image_type(head)
+    if image_type is None:
+        raise ValueError("Uploaded data is not a PNG, JPEG, GIF, WebP or HEIC image")
+    return image_type[0]
+
+
+class BlobStore:
+    """Stores files under their content hash and tracks who references them.
+
+    ``reference_sources`` lists ``(collection, field, filter)`` triples the
+    collector scans to recount references; ``field`` may hold a string or a
+    list of strings.
+    """
+
+    def __init__(self, root: pathlib.Path = UPLOAD_DIR, collection=None,
+                 reference_sources: Optional[List[Tuple]] = None, storage=None,
+                 grace_seconds: int = GC_GRACE_SECONDS, interval_seconds: int = GC_INTERVAL_SECONDS):
+        self.root = pathlib.Path(root)
+        self.directory = self.root / BLOB_PREFIX
+        self.storage = storage or LocalStorage(self.root)
+        self.collection = collection
+        self.reference_sources = [s for s in (reference_sources or []) if s[0] is not None]
+        self.grace_seconds = grace_seconds
+        self.interval_seconds = interval_seconds
+        self._indexes_ready = False
+        self._task: Optional[asyncio.Task] = None
+
+    def _ensure_indexes(self) -> None:
+        if self._indexes_ready or self.collection is None:
+            return
+        self.collection.create_index("digest", unique=True)
+        self.collection.create_index([("refcount", 1), ("last_put_at", 1)])
+        self._indexes_ready = True
+
+    def relative_path(self, digest: str, ext: str) -> str:
+        return f"{BLOB_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}.{ext}"
+
+    # ---------- writes ----------
+    def put_file(self, src_path, ext: Optional[str] = None, digest: Optional[str] = None) -> dict:
+        """Move ``src_path`` into the store (or drop it if the content is already there).
+
+        ``ext`` defaults to the image type sniffed from the file itself.
+        """
+        src_path = pathlib.Path(src_path)
+        if ext is None:
+            with open(src_path, "rb") as f:
+                ext = _image_ext(f.read(16))
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(src_path, "rb") as f:
+                for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b""):
+                    sha.update(chunk)
+            digest = sha.hexdigest()
+        ext = ext.lower().lstrip(".")
+        relative = self.relative_path(digest, ext)
+        size = src_path.stat().st_size
+        if self.storage.exists(relative):
+            self.storage.discard_duplicate(relative, src_path)
+        else:
+            self.storage.put_file(relative, src_path, mimetypes.guess_type(relative)[0])
+        self._record(digest, ext, size)
+        return {"digest": digest, "path": relative, "url": f"/uploads/{relative}", "size": size}
+
+    def put_stream(self, stream: IO[bytes], ext: Optional[str] = None) -> dict:
+        """Copy a file object into the store, hashing as it goes; ``ext`` defaults to the sniffed type."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.directory / f".put_{uuid.uuid4().hex}.tmp"
+        sha = hashlib.sha256()
+        head = b""
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in iter(lambda: stream.read(COPY_CHUNK_SIZE), b""):
+                    if len(head) < 16:
+                        head += chunk[:16]
+                    sha.update(chunk)
+                    f.write(chunk)
+            return self.put_file(tmp_path, ext or _image_ext(head), sha.hexdigest())
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def _record(self, digest: str, ext: str, size: int) -> None:
+        if self.collection is None:
+            return
+        self._ensure_indexes()
+        now = datetime.now()
+        self.collection.update_one(
+            {"digest": digest},
+            {"$setOnInsert": {"digest": digest, "ext": ext, "size": size, "refcount": 0, "created_at": now},
+             "$set": {"last_put_at": now}},
+            upsert=True,
+        )
+
+    def local_path(self, ref: str) -> str:
+        """Local file for a blob URL or path (fetched through the storage cache); other refs pass through."""
+        match = BLOB_REFERENCE.search(ref or "")
+        if match is None:
+            return ref
+        return str(self.storage.local_path(match.group(0)))
+
+    # ---------- reference counts ----------
+    def swap_refs(self, old_values=None, new_values=None) -> None:
+        """Adjust refcounts for a document whose blob references changed from old to new."""
+        if self.collection is None:
+            return
+        old, new = blob_digests(old_values), blob_digests(new_values)
+        if new - old:
+            self.collection.update_many({"digest": {"$in": sorted(new - old)}}, {"$inc": {"refcount": 1}})
+        if old - new:
+            self.collection.update_many({"digest": {"$in": sorted(old - new)}}, {"$inc": {"refcount": -1}})
+
+    def retain(self, values) -> None:
+        self.swap_refs(None, values)
+
+    def release(self, values) -> None:
+        self.swap_refs(values, None)
+
+    # ---------- garbage collection ----------
+    def count_references(self) -> Counter:
+        """Recount blob references from every source collection."""
+        counts = Counter()
+        for collection, field, query in self.reference_sources:
+            for doc in collection.find({**(query or {}), field: {"$exists": True}}, {field: 1}):
+                counts.update(blob_digests(doc.get(field)))
+        return counts
+
+    def collect(self, dry_run: bool = False) -> dict:
+        """Reconcile refcounts, then delete blobs unreferenced for longer than the grace period."""
+        if self.collection is None:
+            return {"enabled": False}
+        self._ensure_indexes()
+        started = time.perf_counter()
+        cutoff = datetime.now() - timedelta(seconds=self.grace_seconds)
+        # Snapshot the counters before recounting, so a retain/release that
+        # lands during the scan changes the counter and the reconcile skips it
+        docs = list(self.collection.find({}, {"digest": 1, "ext": 1, "size": 1, "refcount": 1, "last_put_at": 1}))
+        counts = self.count_references()
+
+        corrected = 0
+        known = set()
+        doomed = []
+        for doc in docs:
+            digest = doc["digest"]
+            known.add(f"{digest}.{doc['ext']}")
+            actual = counts.get(digest, 0)
+            if doc.get("refcount") != actual:
+                corrected += 1
+                if not dry_run:
+                    self.collection.update_one({"digest": digest, "refcount": doc.get("refcount")},
+                                               {"$set": {"refcount": actual}})
+            if actual == 0 and doc.get("last_put_at", datetime.min) < cutoff:
+                doomed.append(doc)
+
+        freed = 0
+        deleted = 0
+        for doc in doomed:
+            if dry_run:
+                deleted += 1
+                freed += doc.get("size", 0)
+                continue
+            # Only delete if nobody re-referenced or re-uploaded it since the scan
+            removed = self.collection.find_one_and_delete(
+                {"digest": doc["digest"], "refcount": {"$lte": 0}, "last_put_at": {"$lt": cutoff}})
+            if removed is None:
+                continue
+            self.storage.delete(self.relative_path(doc["digest"], doc["ext"]))
+            deleted += 1
+            freed += doc.get("size", 0)
+
+        # Files that never got a record (crash between write and insert)
+        strays = 0
+        cutoff_ts = cutoff.timestamp()
+        for key, size, mtime in self.storage.list(BLOB_PREFIX + "/"):
+            name = key.rsplit("/", 1)[-1]
+            if name not in known and name.split(".", 1)[0] not in counts and mtime < cutoff_ts:
+                strays += 1
+                freed += size
+                if not dry_run:
+                    self.storage.delete(key)
+
+        report = {
+            "enabled": True,
+            "dry_run": dry_run,
+            "referenced_blobs": len(counts),
+            "refcounts_corrected": corrected,
+            "deleted_blobs": deleted,
+            "deleted_strays": strays,
+            "freed_bytes": freed,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+        if deleted or strays or corrected:
+            print(f"🧹 Blob GC: {report}")
+        return report
+
+    def stats(self) -> dict:
+        if self.collection is None:
+            return {"enabled": False}
+        totals = list(self.collection.aggregate([{"$group": {
+            "_id": None, "blobs": {"$sum": 1}, "bytes": {"$sum": "$size"},
+            "unreferenced": {"$sum": {"$cond": [{"$lte": ["$refcount", 0]}, 1, 0]}},
+        }}]))
+        totals = totals[0] if totals else {"blobs": 0, "bytes": 0, "unreferenced": 0}
+        return {"enabled": True, "blobs": totals["blobs"], "bytes": totals["bytes"],
+                "unreferenced": totals["unreferenced"]}
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await asyncio.to_thread(self.collect)
+            except Exception as e:
+                print(f"⚠ Blob GC error: {e}")
+
+    def start(self) -> None:
+        if self.collection is not None and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
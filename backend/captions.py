@@ -0,0 +1,202 @@
+# Instagram caption generation with a cache keyed by the normalised image
+# description, a batched prompt that captions several descriptions in one LLM
+# round-trip, and an hourly LLM budget. When the budget is spent (or the LLM
+# fails) captions come from a local template instead of waiting on Gemini.
+# Posts that already have a generated listing skip all of this and are
+# captioned from the listing's title, short description and tags.
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from metrics import record_fallback
+from rate_limit import TokenBucket
+
+CACHE_SIZE = 2048
+CACHE_TTL_SECONDS = 7 * 24 * 3600
+BATCH_SIZE = int(os.getenv("CAPTION_BATCH_SIZE", "10"))
+LLM_CALLS_PER_HOUR = float(os.getenv("CAPTION_LLM_CALLS_PER_HOUR", "120"))
+LLM_BURST = int(os.getenv("CAPTION_LLM_BURST", "10"))
+
+MAX_HASHTAGS = 15
+MAX_BLURB_CHARS = 600
+BASE_HASHTAGS = ["#handmade", "#artisan", "#handcrafted", "#madeinindia", "#traditionalart"]
+
+SINGLE_PROMPT = """
+        You are a professional Instagram content creator.
+        Write a catchy caption with emojis and at least 5 trending hashtags.
+        Picture description: {picture}
+    """
+
+BATCH_PROMPT = """
+        You are a professional Instagram content creator.
+        For each numbered picture description below, write a catchy caption with
+        emojis and at least 5 trending hashtags.
+        Reply with only a JSON array of {count} strings, one caption per
+        description, in the same order.
+
+{pictures}
+    """
+
+_STOPWORDS = {
+    "a", "an", "the", "there", "is", "are", "of", "on", "in", "with", "and", "some",
+    "this", "that", "it", "its", "to", "for", "at", "close", "up", "image", "picture", "photo",
+}
+
+
+def normalise_description(description: str) -> str:
+    """Case-, punctuation- and filler-insensitive key, so near-identical BLIP output shares a caption."""
+    words = re.findall(r"[a-z0-9]+", (description or "").lower())
+    while words and words[0] in ("a", "an", "the", "there", "is", "are", "arafed", "araffe"):
+        words.pop(0)
+    return " ".join(words)
+
+
+def template_caption(description: str) -> str:
+    """Fast local caption used when the LLM is unavailable or over budget."""
+    description = (description or "").strip() or "A beautiful handcrafted artwork"
+    keywords = []
+    for word in re.findall(r"[a-z]+", description.lower()):
+        if len(word) >= 4 and word not in _STOPWORDS and f"#{word}" not in keywords:
+            keywords.append(f"#{word}")
+    hashtags = keywords[:4] + [t for t in BASE_HASHTAGS if t not in keywords]
+    return (f"✨ {description[0].upper()}{description[1:]} ✨\n\n"
+            f"Handcrafted with love and generations of skill. 🎨🙏\n\n"
+            f"{' '.join(hashtags)}")
+
+
+def listing_caption(listing: Optional[dict]) -> Optional[str]:
+    """Caption from a generated product listing, or None when it has nothing to say."""
+    if not listing:
+        return None
+    title = (listing.get("title") or "").strip()
+    blurb = (listing.get("short_description") or listing.get("long_description") or "").strip()
+    if not title and not blurb:
+        return None
+    if len(blurb) > MAX_BLURB_CHARS:
+        blurb = blurb[:MAX_BLURB_CHARS].rsplit(" ", 1)[0] + "…"
+    hashtags = []
+    for tag in listing.get("tags") or []:
+        tag = "#" + re.sub(r"\W+", "", str(tag).lower())
+        if len(tag) > 1 and tag not in hashtags:
+            hashtags.append(tag)
+    hashtags = (hashtags + [t for t in BASE_HASHTAGS if t not in hashtags])[:MAX_HASHTAGS]
+    lines = [f"✨ {title} ✨" if title else "", blurb, "Handcrafted with love and generations of skill. 🎨🙏",
+             " ".join(hashtags)]
+    return "\n\n".join(line for line in lines if line)
+
+
+def parse_caption_array(text: str, count: int) -> Optional[List[str]]:
+    """Pull a JSON array of ``count`` captions out of an LLM reply, or None."""
+    start, end = (text or "").find("["), (text or "").rfind("]")
+    if start == -1 or end <= start:
+        return None
+    try:
+        captions = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(captions, list) or len(captions) != count:
+        return None
+    if not all(isinstance(c, str) and c.strip() for c in captions):
+        return None
+    return [c.strip() for c in captions]
+
+
+class CaptionGenerator:
+    """Caches captions by normalised description and rations LLM calls.
+
+    ``llm(prompt)`` returns the model's text, or an empty string on failure.
+    """
+
+    def __init__(self, llm: Optional[Callable[[str], str]], batch_size: int = BATCH_SIZE,
+                 calls_per_hour: float = LLM_CALLS_PER_HOUR, burst: int = LLM_BURST,
+                 cache_size: int = CACHE_SIZE, ttl: float = CACHE_TTL_SECONDS):
+        self.llm = llm
+        self.batch_size = max(1, batch_size)
+        self.budget = TokenBucket(calls_per_hour / 3600.0, burst)
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ---------- cache ----------
+    def _cached(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            caption, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return caption
+
+    def _store(self, key: str, caption: str) -> None:
+        with self._lock:
+            self._cache[key] = (caption, time.monotonic())
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _take_budget(self) -> bool:
+        if self.llm is None:
+            record_fallback("caption_llm_unavailable")
+            return False
+        with self._lock:
+            allowed = self.budget.try_take()
+        if not allowed:
+            record_fallback("caption_llm_budget")
+        return allowed
+
+    # ---------- generation ----------
+    def generate(self, description: str) -> str:
+        return self.generate_batch([description])[0]
+
+    def generate_batch(self, descriptions: List[str]) -> List[str]:
+        """One caption per description; duplicates and cache hits cost no LLM call."""
+        keys = [normalise_description(d) for d in descriptions]
+        captions: Dict[str, str] = {}
+        missing: Dict[str, str] = {}
+        for key, description in zip(keys, descriptions):
+            if key in captions or key in missing:
+                continue
+            cached = self._cached(key)
+            if cached is not None:
+                captions[key] = cached
+            else:
+                missing[key] = description
+
+        pending = list(missing.items())
+        for i in range(0, len(pending), self.batch_size):
+            chunk = pending[i:i + self.batch_size]
+            results = self._ask(chunk[0][1]) if len(chunk) == 1 else self._ask_batch([d for _, d in chunk])
+            for (key, description), caption in zip(chunk, results):
+                if caption:
+                    self._store(key, caption)
+                    captions[key] = caption
+                else:
+                    # Not cached, so a later call can still get an LLM caption
+                    captions[key] = template_caption(description)
+        return [captions[key] for key in keys]
+
+    def _ask(self, description: str) -> List[Optional[str]]:
+        if not self._take_budget():
+            return [None]
+        reply = (self.llm(SINGLE_PROMPT.format(picture=description)) or "").strip()
+        return [reply or None]
+
+    def _ask_batch(self, descriptions: List[str]) -> List[Optional[str]]:
+        if not self._take_budget():
+            return [None] * len(descriptions)
+        pictures = "\n".join(f"{n}. {d}" for n, d in enumerate(descriptions, 1))
+        reply = self.llm(BATCH_PROMPT.format(count=len(descriptions), pictures=pictures))
+        captions = parse_caption_array(reply, len(descriptions))
+        if captions is None:
+            print(f"⚠ Batched caption reply could not be parsed; using templates for {len(descriptions)} posts")
+            record_fallback("caption_batch_unparsed")
+            return [None] * len(descriptions)
+        return captions
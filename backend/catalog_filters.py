@@ -0,0 +1,181 @@
+# Combined product filters with facet counts for the storefront sidebar.
+# Matching products, the total and the facets come back from one $facet
+# aggregation behind an indexed $match on every selected filter.
+#
+# Category and price range are single-choice, so those facets are counted
+# without their own filter: the sidebar keeps offering the other choices with
+# the counts switching to them would give. When one of them is selected its
+# counts come from a separate (still indexed) aggregation rather than from
+# inside $facet, where no index applies. Tags combine with $all, so the tag
+# counts stay within the current tag selection.
+from typing import Dict, List, Optional
+
+PRICE_BOUNDARIES = [0, 500, 1000, 2500, 5000, 10000, 25000]
+PRICE_OVERFLOW = "25000+"
+MAX_TAG_FACETS = 20
+# Facet name -> the query field it must not be filtered by
+EXCLUSIVE_FACETS = {"category": "category", "price_ranges": "price"}
+
+SORT_OPTIONS = {
+    "price-low": [("price", 1)],
+    "price-high": [("price", -1)],
+    "newest": [("created_at", -1)],
+    "rating": [("rating", -1)],
+}
+
+# The collection whose indexes exist; rebinding to another database creates them again
+_indexed_collection = None
+
+
+def ensure_filter_indexes(products_collection) -> None:
+    """Indexes backing the filter combinations the sidebar can produce."""
+    global _indexed_collection
+    if products_collection is _indexed_collection:
+        return
+    products_collection.create_index([("status", 1), ("category", 1), ("price", 1)])
+    products_collection.create_index([("status", 1), ("tags", 1)])
+    products_collection.create_index([("status", 1), ("created_at", -1)])
+    _indexed_collection = products_collection
+
+
+def build_filter_query(category: Optional[str] = None, tags: Optional[List[str]] = None,
+                       min_price: Optional[float] = None, max_price: Optional[float] = None,
+                       in_stock: bool = False) -> dict:
+    query = {"status": "active"}
+    if category:
+        query["category"] = category
+    if tags:
+        query["tags"] = {"$all": tags}
+    if min_price is not None or max_price is not None:
+        query["price"] = {}
+        if min_price is not None:
+            query["price"]["$gte"] = min_price
+        if max_price is not None:
+            query["price"]["$lte"] = max_price
+    if in_stock:
+        query["stock"] = {"$gt": 0}
+    return query
+
+
+def _price_bucket_label(lower) -> str:
+    if lower == PRICE_OVERFLOW:
+        return PRICE_OVERFLOW
+    index = PRICE_BOUNDARIES.index(lower)
+    return f"{lower}-{PRICE_BOUNDARIES[index + 1]}"
+
+
+def _value_counts(field: str, limit: Optional[int] = None, unwind: bool = False) -> list:
+    pipeline = []
+    if unwind:
+        pipeline.append({"$unwind": f"${field}"})
+    pipeline += [
+        {"$match": {field: {"$nin": [None, ""]}}},
+        {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, "_id": 1}},
+    ]
+    if limit:
+        pipeline.append({"$limit": limit})
+    return pipeline
+
+
+def _facet_stages(field: str) -> list:
+    if field == "price_ranges":
+        return [
+            # Range operators are type-bracketed, so this drops missing, non-numeric and negative prices
+            {"$match": {"price": {"$gte": 0}}},
+            {"$bucket": {
+                "groupBy": "$price",
+                "boundaries": PRICE_BOUNDARIES,
+                "default": PRICE_OVERFLOW,
+                "output": {"count": {"$sum": 1}},
+            }},
+        ]
+    if field == "tags":
+        return _value_counts("tags", MAX_TAG_FACETS, unwind=True)
+    return _value_counts(field)
+
+
+def facet_pipeline(query: dict, sort_by: str, skip: int, limit: int) -> list:
+    sort = SORT_OPTIONS.get(sort_by, [("created_at", -1)])
+    facets = {
+        "data": [
+            {"$sort": dict(sort + [("id", 1)])},
+            {"$skip": skip},
+            {"$limit": limit},
+            {"$project": {"_id": 0}},
+        ],
+        "total": [{"$count": "count"}],
+    }
+    for facet in ("category", "tags", "price_ranges"):
+        # Counted separately when their own filter is applied, see own_facet_pipeline
+        if EXCLUSIVE_FACETS.get(facet) not in query:
+            facets[facet] = _facet_stages(facet)
+    return [{"$match": query}, {"$facet": facets}]
+
+
+def own_facet_pipeline(query: dict, facet: str) -> list:
+    """Counts for a single-choice facet with its own filter lifted."""
+    field = EXCLUSIVE_FACETS[facet]
+    return [{"$match": {k: v for k, v in query.items() if k != field}}] + _facet_stages(facet)
+
+
+def _format_facets(raw: dict) -> Dict[str, list]:
+    facets = {
+        key: [{"value": row["_id"], "count": row["count"]} for row in raw.get(key, [])]
+        for key in ("category", "tags")
+    }
+    facets["price_ranges"] = [
+        {"value": _price_bucket_label(row["_id"]), "count": row["count"]}
+        for row in raw.get("price_ranges", []) if row["count"]
+    ]
+    return facets
+
+
+def filter_products(products_collection, query: dict, sort_by: str = "relevance",
+                    page: int = 1, limit: int = 20) -> dict:
+    """Run the filter and facet aggregation, plus one per selected single-choice facet."""
+    ensure_filter_indexes(products_collection)
+    skip = (max(page, 1) - 1) * limit
+    result = next(products_collection.aggregate(facet_pipeline(query, sort_by, skip, limit)), {})
+    for facet, field in EXCLUSIVE_FACETS.items():
+        if field in query:
+            result[facet] = list(products_collection.aggregate(own_facet_pipeline(query, facet)))
+    total = result["total"][0]["count"] if result.get("total") else 0
+    data = result.get("data", [])
+    return {
+        "data": data,
+        "total": total,
+        "hasMore": skip + len(data) < total,
+        "facets": _format_facets(result),
+    }
+
+
+def count_facets(products: List[dict]) -> Dict[str, list]:
+    """Facet counts for an in-memory product list (same shape as the aggregation)."""
+    raw = {"category": {}, "tags": {}, "price_ranges": {}}
+    for product in products:
+        if product.get("category"):
+            raw["category"][product["category"]] = raw["category"].get(product["category"], 0) + 1
+        for tag in product.get("tags") or []:
+            raw["tags"][tag] = raw["tags"].get(tag, 0) + 1
+        price = product.get("price")
+        if isinstance(price, (int, float)) and not isinstance(price, bool) and price >= 0:
+            bucket = PRICE_OVERFLOW
+            for lower, upper in zip(PRICE_BOUNDARIES, PRICE_BOUNDARIES[1:]):
+                if lower <= price < upper:
+                    bucket = lower
+                    break
+            raw["price_ranges"][bucket] = raw["price_ranges"].get(bucket, 0) + 1
+
+    def rows(counts, limit=None):
+        ordered = sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))
+        return [{"_id": value, "count": count} for value, count in ordered[:limit]]
+
+    return _format_facets({
+        "category": rows(raw["category"]),
+        "tags": rows(raw["tags"], MAX_TAG_FACETS),
+        "price_ranges": [
+            {"_id": lower, "count": raw["price_ranges"][lower]}
+            for lower in PRICE_BOUNDARIES + [PRICE_OVERFLOW] if lower in raw["price_ranges"]
+        ],
+    })
@@ -0,0 +1,182 @@
+# Resized image derivatives for listing pages (/img/{path}?w=320&fmt=webp).
+# Derivatives live in a disk cache keyed by the source content hash plus the
+# resize parameters, evicted least-recently-used once the cache outgrows its
+# byte budget. Concurrent requests for the same derivative share one render,
+# which runs in the image worker pool. The cache sits outside uploads/, so
+# derivatives are only ever served through the /img endpoint.
+import asyncio
+import hashlib
+import os
+import pathlib
+import threading
+import uuid
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from PIL import Image
+
+from image_loader import load_image
+from image_workers import image_pool
+from media import compute_etag
+from tracing import bind_context
+
+DERIVATIVE_DIR = pathlib.Path(os.getenv("DERIVATIVE_DIR", str(pathlib.Path("data") / "derivatives")))
+MAX_CACHE_BYTES = int(os.getenv("DERIVATIVE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Widths are snapped up to a bucket so arbitrary ?w= values cannot fill the cache
+WIDTH_BUCKETS = [64, 128, 160, 240, 320, 480, 640, 800, 1024, 1280, 1600]
+FORMATS = {"webp": "WEBP", "jpeg": "JPEG", "jpg": "JPEG", "png": "PNG"}
+MEDIA_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg", "PNG": "image/png"}
+DEFAULT_QUALITY = 80
+
+
+class DerivativeError(ValueError):
+    """Raised for resize parameters the service does not accept."""
+
+
+def snap_width(width: int) -> int:
+    if width <= 0:
+        raise DerivativeError("Width must be positive")
+    index = bisect_left(WIDTH_BUCKETS, width)
+    return WIDTH_BUCKETS[min(index, len(WIDTH_BUCKETS) - 1)]
+
+
+def normalise_params(width: int, height: Optional[int], fmt: str, quality: int) -> Tuple[int, Optional[int], str, int]:
+    pil_format = FORMATS.get(fmt.lower())
+    if pil_format is None:
+        raise DerivativeError(f"Unsupported format '{fmt}', use one of: webp, jpeg, png")
+    snapped = snap_width(width)
+    if height is not None:
+        if height <= 0:
+            raise DerivativeError("Height must be positive")
+        # Keep the requested aspect ratio when the width was snapped
+        height = max(1, round(height * snapped / width))
+    quality = max(30, min(95, quality))
+    return snapped, height, pil_format, quality
+
+
+def render_derivative(source_path: str, out_path: str, width: int, height: Optional[int],
+                      pil_format: str, quality: int) -> None:
+    """Resize ``source_path`` into ``out_path`` using Pillow's decode-time fast paths."""
+    target = (width, height or width * 4)
+    # Decodes JPEGs at a reduced DCT scale and applies EXIF orientation
+    im = load_image(source_path, None, size_hint=(width, height or width))
+    # reducing_gap lets thumbnail() use the cheap integer reduce() before LANCZOS
+    im.thumbnail(target, Image.LANCZOS, reducing_gap=3.0)
+    if pil_format == "JPEG" and im.mode not in ("RGB", "L"):
+        im = im.convert("RGB")
+    elif im.mode not in ("RGB", "RGBA", "L", "LA"):
+        im = im.convert("RGBA" if "transparency" in im.info else "RGB")
+
+    tmp_path = f"{out_path}.{uuid.uuid4().hex[:8]}.tmp"
+    save_kwargs = {"optimize": True} if pil_format == "PNG" else {"quality": quality}
+    if pil_format == "WEBP":
+        save_kwargs["method"] = 4
+    im.save(tmp_path, format=pil_format, **save_kwargs)
+    os.replace(tmp_path, out_path)
+
+
+class DerivativeCache:
+    """Disk cache of derivatives with LRU eviction by total size."""
+
+    def __init__(self, directory: pathlib.Path = DERIVATIVE_DIR, max_bytes: int = MAX_CACHE_BYTES):
+        self.directory = pathlib.Path(directory)
+        self.max_bytes = max_bytes
+        self._entries = None  # OrderedDict path -> size, oldest first
+        self._total = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def _load(self) -> None:
+        if self._entries is not None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                st = entry.stat()
+                files.append((st.st_mtime, entry.path, st.st_size))
+        files.sort()
+        self._entries = OrderedDict((path, size) for _, path, size in files)
+        self._total = sum(self._entries.values())
+
+    def path_for(self, source_etag: str, width: int, height: Optional[int], pil_format: str, quality: int) -> str:
+        key = f"{source_etag}|{width}|{height}|{pil_format}|{quality}"
+        digest = hashlib.sha256(key.encode()).hexdigest()[:40]
+        ext = "jpg" if pil_format == "JPEG" else pil_format.lower()
+        return str(self.directory / f"{digest}.{ext}")
+
+    def lookup(self, path: str) -> Optional[os.stat_result]:
+        with self._lock:
+            self._load()
+            if path not in self._entries:
+                return None
+            self._entries.move_to_end(path)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._total -= self._entries.pop(path, 0)
+            return None
+        # Persist recency across restarts; _load() orders by mtime
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return st
+
+    def add(self, path: str) -> os.stat_result:
+        st = os.stat(path)
+        with self._lock:
+            self._load()
+            self._total += st.st_size - self._entries.pop(path, 0)
+            self._entries[path] = st.st_size
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old_path, old_size = self._entries.popitem(last=False)
+                self._total -= old_size
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+        return st
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total
+
+    async def get(self, source_path: str, source_stat: os.stat_result, width: int,
+                  height: Optional[int] = None, fmt: str = "webp",
+                  quality: int = DEFAULT_QUALITY, source_relative_path: str = "") -> Tuple[str, os.stat_result, str]:
+        """Return (path, stat, media_type) of the derivative, rendering it if needed."""
+        width, height, pil_format, quality = normalise_params(width, height, fmt, quality)
+        loop = asyncio.get_running_loop()
+        source_etag = await loop.run_in_executor(None, compute_etag, source_path, source_stat, source_relative_path)
+        path = self.path_for(source_etag, width, height, pil_format, quality)
+        media_type = MEDIA_TYPES[pil_format]
+
+        st = await loop.run_in_executor(None, self.lookup, path)
+        if st is not None:
+            return path, st, media_type
+
+        # Single-flight: later requests for the same derivative await the first render
+        future = self._inflight.get(path)
+        if future is None:
+            render = bind_context(self._render_and_add, "derivative.render")
+            future = loop.run_in_executor(None, render, source_path, path,
+                                          width, height, pil_format, quality)
+            self._inflight[path] = future
+            future.add_done_callback(lambda _: self._inflight.pop(path, None))
+        st = await asyncio.shield(future)
+        return path, st, media_type
+
+    def _render_and_add(self, source_path: str, path: str, width: int, height: Optional[int],
+                        pil_format: str, quality: int) -> os.stat_result:
+        with self._lock:
+            self._load()
+        image_pool.call(render_derivative, os.path.abspath(source_path), os.path.abspath(path),
+                        width, height, pil_format, quality)
+        return self.add(path)
+
+
+derivative_cache = DerivativeCache()
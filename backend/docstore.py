@@ -0,0 +1,1236 @@
+# Embedded document stores for running the backend without a MongoDB server.
+# They implement only the part of the pymongo Collection API the app uses
+# (find/find_one with sort/skip/limit and projections, $set/$setOnInsert/
+# $unset/$inc/$pull, find_one_and_update/delete, upserts, bulk updates,
+# count/distinct, unique indexes and the aggregation stages behind the
+# catalog facets and blob stats), so main.py runs unchanged on:
+#   - MemoryDatabase: documents in per-process dicts, for tests and load tests
+#   - SQLiteDatabase: one SQLite file (WAL), for single-node deployments; all
+#     workers on the node share it and see each other's writes
+# Equality and $in lookups are answered from hash indexes instead of scanning:
+# fields passed to create_index, plus any field the first time a query
+# filters on it by equality. Indexes are always built before an operation's
+# transaction starts, never inside it. Range filters and sorts run over the
+# (indexed) candidate set in Python. Anything outside the supported subset
+# raises UnsupportedOperation rather than silently matching the wrong
+# documents; point DATABASE_BACKEND at MongoDB for it.
+import abc
+import heapq
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from functools import cmp_to_key
+from typing import Callable, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure, WriteError
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+_MISSING = object()
+_NULL_KEY = "null"
+_SQLITE_MAX_PARAMS = 900
+
+QUERY_OPERATORS = {"$or", "$ne", "$in", "$nin", "$gt", "$gte", "$lt", "$lte", "$exists", "$regex", "$options", "$all"}
+UPDATE_OPERATORS = {"$set", "$setOnInsert", "$unset", "$inc", "$pull"}
+STAGES = {"$match", "$sort", "$skip", "$limit", "$project", "$unwind", "$group", "$count", "$bucket", "$facet"}
+EXPRESSION_OPERATORS = {"$cond", "$eq", "$ne", "$gt", "$gte", "$lt", "$lte"}
+ACCUMULATORS = {"$sum"}
+BULK_OPERATIONS = {"UpdateOne", "UpdateMany", "ReplaceOne"}
+
+
+class UnsupportedOperation(OperationFailure):
+    """A query, update or pipeline uses something the embedded stores do not implement."""
+
+
+def _unsupported(kind: str, name, supported: set) -> UnsupportedOperation:
+    return UnsupportedOperation(
+        f"Unsupported {kind} {name} in the embedded document store (supported: {', '.join(sorted(supported))})",
+        code=2)
+
+
+# ---------- values ----------
+def _copy(value):
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_copy(v) for v in value]
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    raise TypeError(f"Cannot store {type(value).__name__} values")
+
+
+def _json_hook(obj: dict):
+    if len(obj) == 1:
+        if "$date" in obj:
+            return datetime.fromisoformat(obj["$date"])
+        if "$oid" in obj:
+            return ObjectId(obj["$oid"])
+    return obj
+
+
+def _encode(doc) -> str:
+    return json.dumps(doc, default=_json_default, separators=(",", ":"), ensure_ascii=False)
+
+
+def _decode(text: str):
+    return json.loads(text, object_hook=_json_hook)
+
+
+def _normalized(value):
+    # 3 and 3.0 are the same key, as they are equal in a MongoDB query
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, dict):
+        return {k: _normalized(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalized(v) for v in value]
+    return value
+
+
+def _key(value) -> str:
+    """Hashable index key for a value; equal values (in MongoDB's sense) share a key."""
+    if isinstance(value, str):
+        return json.dumps(value, ensure_ascii=False)
+    return json.dumps(_normalized(value), default=_json_default, separators=(",", ":"), ensure_ascii=False)
+
+
+def _rank(value) -> int:
+    # BSON comparison order across types
+    if value is None:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, (list, tuple)):
+        return 5
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def _sort_key(value):
+    rank = _rank(value)
+    if rank == 1:
+        return (1, 0)
+    if rank in (4, 5, 10):
+        return (rank, _key(value) if rank != 10 else str(value))
+    return (rank, value)
+
+
+def _equal(a, b) -> bool:
+    if isinstance(a, bool) != isinstance(b, bool):
+        return False
+    return a == b
+
+
+# ---------- paths ----------
+def _path_values(doc, path: str) -> list:
+    """Every value at a dotted path, descending into arrays the way MongoDB does."""
+    values = [doc]
+    for part in path.split("."):
+        found = []
+        for value in values:
+            if isinstance(value, dict):
+                if part in value:
+                    found.append(value[part])
+            elif isinstance(value, list):
+                if part.isdigit():
+                    if int(part) < len(value):
+                        found.append(value[int(part)])
+                else:
+                    found.extend(item[part] for item in value if isinstance(item, dict) and part in item)
+        values = found
+        if not values:
+            break
+    return values
+
+
+def _expand(values: list) -> list:
+    """Values plus the elements of array values, for equality and range matches."""
+    expanded = []
+    for value in values:
+        expanded.append(value)
+        if isinstance(value, list):
+            expanded.extend(value)
+    return expanded
+
+
+def _get_path(doc, path: str, default=None):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return default
+    return value
+
+
+def _set_path(doc, path: str, value) -> None:
+    parts = path.split(".")
+    target = doc
+    for part in parts[:-1]:
+        if isinstance(target, list) and part.isdigit():
+            target = target[int(part)]
+            continue
+        if not isinstance(target.get(part), (dict, list)):
+            target[part] = {}
+        target = target[part]
+    if isinstance(target, list) and parts[-1].isdigit():
+        target[int(parts[-1])] = value
+    else:
+        target[parts[-1]] = value
+
+
+def _unset_path(doc, path: str) -> None:
+    parts = path.split(".")
+    parent = _get_path(doc, ".".join(parts[:-1])) if len(parts) > 1 else doc
+    if isinstance(parent, dict):
+        parent.pop(parts[-1], None)
+
+
+# ---------- queries ----------
+def _is_operator_dict(value) -> bool:
+    return isinstance(value, dict) and bool(value) and all(k.startswith("$") for k in value)
+
+
+def _regex(pattern, options: str = ""):
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    flags = 0
+    for letter, flag in (("i", re.IGNORECASE), ("m", re.MULTILINE), ("s", re.DOTALL), ("x", re.VERBOSE)):
+        if letter in options:
+            flags |= flag
+    return re.compile(pattern, flags)
+
+
+def compile_query(query: dict) -> Callable[[dict], bool]:
+    """Predicate for a MongoDB query filter, built once and then applied to each document."""
+    tests = []
+    for field, condition in query.items():
+        if field == "$or":
+            parts = [compile_query(q) for q in condition]
+            tests.append(lambda doc, parts=parts: any(p(doc) for p in parts))
+        elif field.startswith("$"):
+            raise _unsupported("query operator", field, QUERY_OPERATORS)
+        else:
+            tests.append(_field_test(field, _compile_condition(condition)))
+    if not tests:
+        return lambda doc: True
+    if len(tests) == 1:
+        return tests[0]
+    return lambda doc: all(t(doc) for t in tests)
+
+
+def _field_test(field: str, test: Callable[[list], bool]) -> Callable[[dict], bool]:
+    if "." in field:
+        return lambda doc: test(_path_values(doc, field))
+
+    def top_level(doc):
+        value = doc.get(field, _MISSING)
+        return test([] if value is _MISSING else [value])
+    return top_level
+
+
+def _compile_condition(condition) -> Callable[[list], bool]:
+    """Test over the values found at a field's path."""
+    if isinstance(condition, re.Pattern):
+        raise _unsupported("query value", "re.Pattern (use $regex)", QUERY_OPERATORS)
+    if _is_operator_dict(condition):
+        options = condition.get("$options", "")
+        tests = [_compile_operator(op, arg, options) for op, arg in condition.items() if op != "$options"]
+        if len(tests) == 1:
+            return tests[0]
+        return lambda values: all(t(values) for t in tests)
+    return _equality_test(condition)
+
+
+def _regex_test(pattern: re.Pattern) -> Callable[[list], bool]:
+    search = pattern.search
+    return lambda values: any(isinstance(v, str) and search(v) for v in _expand(values))
+
+
+def _equality_test(target) -> Callable[[list], bool]:
+    if isinstance(target, str):
+        # Strings only ever equal strings, so plain == is exact here
+        return lambda values: any(v == target or (isinstance(v, list) and target in v) for v in values)
+    return lambda values: _equals_any(values, target)
+
+
+def _equals_any(values: list, target) -> bool:
+    if target is None and not values:
+        return True
+    return any(_equal(v, target) for v in _expand(values))
+
+
+_COMPARISONS = {
+    "$gt": lambda a, b: a > b,
+    "$gte": lambda a, b: a >= b,
+    "$lt": lambda a, b: a < b,
+    "$lte": lambda a, b: a <= b,
+}
+
+
+def _compare(value, op: str, target) -> bool:
+    # Range operators only match values of the same BSON type class
+    if _rank(value) != _rank(target) or _rank(value) in (4, 5, 10):
+        return False
+    if value is None:
+        return op in ("$gte", "$lte")
+    return _COMPARISONS[op](value, target)
+
+
+def _compile_operator(op: str, arg, options: str) -> Callable[[list], bool]:
+    if op == "$ne":
+        equal = _equality_test(arg)
+        return lambda values: not equal(values)
+    if op in ("$in", "$nin"):
+        if all(isinstance(a, str) for a in arg):
+            wanted = set(arg)
+            found = lambda values: any(  # noqa: E731
+                v in wanted if isinstance(v, str) else isinstance(v, list) and any(
+                    isinstance(i, str) and i in wanted for i in v)
+                for v in values)
+        else:
+            tests = [_equality_test(a) for a in arg]
+            found = lambda values: any(t(values) for t in tests)  # noqa: E731
+        return found if op == "$in" else (lambda values: not found(values))
+    if op in _COMPARISONS:
+        return lambda values: any(_compare(v, op, arg) for v in _expand(values))
+    if op == "$exists":
+        return lambda values: bool(values) == bool(arg)
+    if op == "$regex":
+        return _regex_test(_regex(arg, options))
+    if op == "$all":
+        tests = [_equality_test(a) for a in arg]
+        return lambda values: bool(tests) and all(t(values) for t in tests)
+    raise _unsupported("query operator", op, QUERY_OPERATORS)
+
+
+def _element_test(condition) -> Callable[[object], bool]:
+    """Test for one array element of a $pull: a filter for embedded documents, else equality."""
+    if isinstance(condition, dict):
+        test = compile_query(condition)
+        return lambda item: isinstance(item, dict) and test(item)
+    return lambda item: _equal(item, condition)
+
+
+def _equality_terms(query: dict) -> Dict[str, set]:
+    """Index keys each equality / $in field of a filter must have."""
+    terms = {}
+    for field, condition in query.items():
+        if field.startswith("$") or isinstance(condition, re.Pattern):
+            continue
+        if _is_operator_dict(condition):
+            if "$in" in condition:
+                values = condition["$in"]
+            elif condition.get("$all"):
+                values = condition["$all"][:1]
+            else:
+                continue
+            if any(isinstance(v, re.Pattern) or _is_operator_dict(v) for v in values):
+                continue
+        else:
+            values = [condition]
+        terms[field] = {_key(v) for v in values}
+    return terms
+
+
+def _index_keys(doc: dict, field: str) -> set:
+    values = _path_values(doc, field)
+    if not values:
+        # Missing fields are indexed as null, so {field: None} finds them
+        return {_NULL_KEY}
+    return {_key(v) for v in _expand(values)}
+
+
+# ---------- updates ----------
+def apply_update(doc: dict, update: dict, inserting: bool = False) -> None:
+    """Apply update operators to ``doc`` in place."""
+    for op, fields in update.items():
+        if op == "$set" or (op == "$setOnInsert" and inserting):
+            for path, value in fields.items():
+                _set_path(doc, path, _copy(value))
+        elif op == "$setOnInsert":
+            continue
+        elif op == "$unset":
+            for path in fields:
+                _unset_path(doc, path)
+        elif op == "$inc":
+            for path, amount in fields.items():
+                _set_path(doc, path, _get_path(doc, path, 0) + amount)
+        elif op == "$pull":
+            for path, condition in fields.items():
+                current = _get_path(doc, path, None)
+                if isinstance(current, list):
+                    pulled = _element_test(condition)
+                    _set_path(doc, path, [item for item in current if not pulled(item)])
+        else:
+            raise _unsupported("update operator", op, UPDATE_OPERATORS)
+
+
+def _upsert_seed(query: dict) -> dict:
+    """The document an upsert starts from: the filter's equality fields."""
+    seed = {}
+    for field, condition in query.items():
+        if not field.startswith("$") and not _is_operator_dict(condition):
+            _set_path(seed, field, _copy(condition))
+    return seed
+
+
+# ---------- projections and sorting ----------
+def project(doc: dict, projection=None, copy: bool = True) -> dict:
+    if not projection:
+        return _copy(doc) if copy else doc
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    slices = {k: v["$slice"] for k, v in projection.items() if isinstance(v, dict) and "$slice" in v}
+    flags = {k: v for k, v in projection.items() if k not in slices}
+    include_id = flags.pop("_id", 1)
+    if any(flags.values()):
+        out = {"_id": _copy(doc["_id"])} if include_id and "_id" in doc else {}
+        for path in flags:
+            value = _get_path(doc, path, _MISSING)
+            if value is not _MISSING:
+                _set_path(out, path, _copy(value))
+    else:
+        excluded = set(flags)
+        if not include_id:
+            excluded.add("_id")
+        out = {k: (_copy(v) if copy else v) for k, v in doc.items() if k not in excluded}
+        for path in excluded:
+            if "." in path:
+                _unset_path(out, path)
+    for path, n in slices.items():
+        value = _get_path(doc, path, _MISSING)
+        if value is _MISSING and path not in out:
+            continue
+        if isinstance(value, list):
+            value = value[:n] if n >= 0 else value[n:]
+        _set_path(out, path, _copy(value))
+    return out
+
+
+def _sort_spec(key_or_list, direction=None) -> list:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [(field, d) for field, d in key_or_list]
+
+
+def _sort_value(doc, field: str, direction: int):
+    values = _path_values(doc, field)
+    if not values:
+        return _sort_key(None)
+    value = values[0] if len(values) == 1 else values
+    if isinstance(value, list) and value:
+        # Arrays sort by their smallest (ascending) or largest (descending) element
+        keys = [_sort_key(v) for v in value]
+        return min(keys) if direction > 0 else max(keys)
+    return _sort_key(value)
+
+
+def sort_docs(docs: list, spec: list, limit: Optional[int] = None) -> list:
+    """Sort by a [(field, direction)] spec; with ``limit``, only the first ``limit`` are ordered."""
+    if len(spec) == 1:
+        field, direction = spec[0]
+        key = lambda d: _sort_value(d, field, direction)  # noqa: E731
+        if limit is not None and limit < len(docs):
+            pick = heapq.nsmallest if direction > 0 else heapq.nlargest
+            return pick(limit, docs, key=key)
+        return sorted(docs, key=key, reverse=direction < 0)
+
+    def compare(a, b):
+        for field, direction in spec:
+            ka, kb = _sort_value(a, field, direction), _sort_value(b, field, direction)
+            if ka != kb:
+                return -direction if ka < kb else direction
+        return 0
+
+    key = cmp_to_key(compare)
+    if limit is not None and limit < len(docs):
+        return heapq.nsmallest(limit, docs, key=key)
+    return sorted(docs, key=key)
+
+
+# ---------- aggregation ----------
+def evaluate(expression, doc):
+    """Value of an aggregation expression for one document."""
+    if isinstance(expression, str) and expression.startswith("$"):
+        values = _path_values(doc, expression[1:])
+        if not values:
+            return None
+        return values[0] if len(values) == 1 else values
+    if not isinstance(expression, (dict, list)):
+        return expression
+    if not isinstance(expression, dict) or len(expression) != 1:
+        raise _unsupported("expression", type(expression).__name__, EXPRESSION_OPERATORS)
+    op, arg = next(iter(expression.items()))
+    if op == "$cond":
+        if isinstance(arg, dict):
+            arg = [arg["if"], arg["then"], arg["else"]]
+        condition = evaluate(arg[0], doc)
+        return evaluate(arg[1] if condition not in (None, False, 0) else arg[2], doc)
+    if op in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte"):
+        a, b = (_sort_key(evaluate(e, doc)) for e in arg)
+        return {"$eq": a == b, "$ne": a != b, "$gt": a > b, "$gte": a >= b, "$lt": a < b, "$lte": a <= b}[op]
+    raise _unsupported("expression operator", op, EXPRESSION_OPERATORS)
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return ("d",) + tuple((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return ("l",) + tuple(_freeze(v) for v in value)
+    if isinstance(value, bool):
+        return ("b", value)
+    return value
+
+
+class _Accumulator:
+    def __init__(self, spec: dict):
+        (self.op, self.expression), = spec.items()
+        if self.op not in ACCUMULATORS:
+            raise _unsupported("accumulator", self.op, ACCUMULATORS)
+        self.total = 0
+
+    def add(self, doc) -> None:
+        value = evaluate(self.expression, doc)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            self.total += value
+
+    def result(self):
+        return self.total
+
+
+def _group(docs: list, spec: dict) -> list:
+    id_expression = spec["_id"]
+    outputs = {k: v for k, v in spec.items() if k != "_id"}
+    groups = {}
+    for doc in docs:
+        group_id = evaluate(id_expression, doc)
+        group = groups.get(_freeze(group_id))
+        if group is None:
+            group = groups[_freeze(group_id)] = (group_id, {k: _Accumulator(v) for k, v in outputs.items()})
+        for accumulator in group[1].values():
+            accumulator.add(doc)
+    return [{"_id": group_id, **{k: a.result() for k, a in accumulators.items()}}
+            for group_id, accumulators in groups.values()]
+
+
+def _bucket(docs: list, spec: dict) -> list:
+    boundaries = spec["boundaries"]
+    default = spec.get("default", _MISSING)
+    outputs = spec.get("output") or {"count": {"$sum": 1}}
+    buckets = {}
+    for doc in docs:
+        value = evaluate(spec["groupBy"], doc)
+        bucket_id = default
+        if _rank(value) == _rank(boundaries[0]):
+            for lower, upper in zip(boundaries, boundaries[1:]):
+                if lower <= value < upper:
+                    bucket_id = lower
+                    break
+        if bucket_id is _MISSING:
+            raise OperationFailure(f"$bucket could not place value {value!r} and has no default")
+        bucket = buckets.setdefault(_freeze(bucket_id), (bucket_id, {k: _Accumulator(v) for k, v in outputs.items()}))
+        for accumulator in bucket[1].values():
+            accumulator.add(doc)
+    order = {_freeze(b): i for i, b in enumerate(boundaries)}
+    rows = sorted(buckets.items(), key=lambda item: order.get(item[0], len(order)))
+    return [{"_id": bucket_id, **{k: a.result() for k, a in accumulators.items()}}
+            for _, (bucket_id, accumulators) in rows]
+
+
+def _unwind(docs: list, spec) -> list:
+    if not isinstance(spec, str):
+        raise _unsupported("$unwind option", "document form", {"$<field>"})
+    path = spec[1:]
+    out = []
+    for doc in docs:
+        value = _get_path(doc, path, _MISSING)
+        if isinstance(value, list):
+            for item in value:
+                unwound = dict(doc) if "." not in path else _copy(doc)
+                _set_path(unwound, path, item)
+                out.append(unwound)
+        elif value is not _MISSING and value is not None:
+            out.append(doc)
+    return out
+
+
+def run_pipeline(docs: list, pipeline: list) -> list:
+    """Run aggregation stages over documents (which are never modified in place)."""
+    stages = list(pipeline)
+    for position, stage in enumerate(stages):
+        (op, arg), = stage.items()
+        if op == "$match":
+            matches = compile_query(arg)
+            docs = [d for d in docs if matches(d)]
+        elif op == "$sort":
+            # A following $skip/$limit means only the head has to be ordered
+            window, skip_limit = None, stages[position + 1:position + 3]
+            if skip_limit and "$limit" in skip_limit[0]:
+                window = skip_limit[0]["$limit"]
+            elif len(skip_limit) == 2 and "$skip" in skip_limit[0] and "$limit" in skip_limit[1]:
+                window = skip_limit[0]["$skip"] + skip_limit[1]["$limit"]
+            docs = sort_docs(docs, list(arg.items()), window)
+        elif op == "$skip":
+            docs = docs[arg:]
+        elif op == "$limit":
+            docs = docs[:arg]
+        elif op == "$project":
+            if any(not isinstance(v, (bool, int)) for v in arg.values()):
+                raise _unsupported("$project value", "computed field", {"0", "1"})
+            docs = [project(doc, arg, copy=False) for doc in docs]
+        elif op == "$unwind":
+            docs = _unwind(docs, arg)
+        elif op == "$group":
+            docs = _group(docs, arg)
+        elif op == "$count":
+            docs = [{arg: len(docs)}] if docs else []
+        elif op == "$bucket":
+            docs = _bucket(docs, arg)
+        elif op == "$facet":
+            docs = [{name: run_pipeline(docs, sub) for name, sub in arg.items()}]
+        else:
+            raise _unsupported("aggregation stage", op, STAGES)
+    return docs
+
+
+# ---------- collections ----------
+class Cursor:
+    """Lazily evaluated find() result supporting sort/skip/limit chaining."""
+
+    def __init__(self, collection, filter=None, projection=None, sort=None, skip: int = 0, limit: int = 0):
+        self._collection = collection
+        self._filter = filter or {}
+        self._projection = projection
+        self._sort = _sort_spec(sort) if sort else None
+        self._skip = skip
+        self._limit = limit
+        self._results = None
+
+    def sort(self, key_or_list, direction=None) -> "Cursor":
+        self._sort = _sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, skip: int) -> "Cursor":
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int) -> "Cursor":
+        self._limit = limit
+        return self
+
+    def _execute(self):
+        window = self._skip + self._limit if self._limit else None
+        docs = self._collection._read(self._filter, None if self._sort else window)
+        if self._sort:
+            docs = sort_docs(docs, self._sort, window)
+        docs = docs[self._skip:window]
+        return iter([self._collection._out(d, self._projection) for d in docs])
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> dict:
+        if self._results is None:
+            self._results = self._execute()
+        return next(self._results)
+
+
+class Collection(abc.ABC):
+    """Engine shared by the backends; subclasses provide storage and indexes.
+
+    Storage hooks run inside ``_transaction``: ``_all``/``_by_ids`` return
+    stored documents in insertion order, ``_lookup`` answers an index, and
+    ``_insert``/``_replace``/``_remove`` write a document and its index
+    entries (checking unique indexes first). ``_build_index`` is the one hook
+    called outside a transaction.
+    """
+
+    # Documents from storage are private copies (no copy needed before returning them)
+    _fresh = False
+
+    def __init__(self, database, name: str):
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+
+    # ----- storage hooks -----
+    @abc.abstractmethod
+    def _transaction(self, write: bool = False):
+        """Context manager around one read or read-modify-write."""
+
+    @abc.abstractmethod
+    def _all(self) -> Iterable[dict]:
+        ...
+
+    @abc.abstractmethod
+    def _by_ids(self, ids: set) -> Iterable[dict]:
+        ...
+
+    @abc.abstractmethod
+    def _has_index(self, field: str) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def _build_index(self, field: str, unique: bool) -> None:
+        ...
+
+    @abc.abstractmethod
+    def _lookup(self, field: str, keys: set) -> set:
+        ...
+
+    @abc.abstractmethod
+    def _insert(self, doc: dict) -> None:
+        ...
+
+    @abc.abstractmethod
+    def _replace(self, old: dict, new: dict) -> None:
+        ...
+
+    @abc.abstractmethod
+    def _remove(self, doc: dict) -> None:
+        ...
+
+    # ----- engine -----
+    def _duplicate(self, field: str, value) -> DuplicateKeyError:
+        return DuplicateKeyError(
+            f"E11000 duplicate key error collection: {self.full_name} index: {field}_1 dup key: {{ {field}: {value!r} }}",
+            11000, {"keyPattern": {field: 1}, "keyValue": {field: value}})
+
+    def _prepare(self, query: dict) -> dict:
+        """Index keys for the filter's equality fields, building missing indexes (before any transaction)."""
+        terms = _equality_terms(query)
+        for field in terms:
+            if not self._has_index(field):
+                self._build_index(field, False)
+        return terms
+
+    def _select(self, query: dict, terms: dict, limit: Optional[int] = None) -> list:
+        candidates = None
+        for field, keys in terms.items():
+            ids = self._lookup(field, keys)
+            if candidates is None or len(ids) < len(candidates):
+                candidates = ids
+            if not candidates:
+                return []
+        docs = self._all() if candidates is None else self._by_ids(candidates)
+        matches = compile_query(query)
+        selected = []
+        for doc in docs:
+            if matches(doc):
+                selected.append(doc)
+                if limit is not None and len(selected) >= limit:
+                    break
+        return selected
+
+    def _read(self, query: dict, limit: Optional[int] = None) -> list:
+        terms = self._prepare(query)
+        with self._transaction():
+            return self._select(query, terms, limit)
+
+    def _out(self, doc: dict, projection=None) -> dict:
+        return project(doc, projection, copy=not self._fresh)
+
+    def _modify(self, query: dict, update: dict, terms: dict, upsert: bool = False, multi: bool = False,
+                replacement: bool = False, sort=None) -> tuple:
+        """Update matching documents; returns ([(before, after)], upserted_id).
+
+        Runs in a write transaction, so ``terms`` come from ``_prepare`` beforehand.
+        """
+        if replacement and any(k.startswith("$") for k in update):
+            raise ValueError("replacement document must not contain update operators")
+        if not replacement and not all(k.startswith("$") for k in update):
+            raise ValueError("update only works with $ operators")
+        docs = self._select(query, terms, None if multi or sort else 1)
+        if sort:
+            docs = sort_docs(docs, _sort_spec(sort), 1)
+        changes = []
+        for old in docs:
+            if replacement:
+                new = {"_id": old["_id"], **{k: _copy(v) for k, v in update.items() if k != "_id"}}
+            else:
+                new = _copy(old)
+                apply_update(new, update)
+            if not _equal(new.get("_id", _MISSING), old["_id"]) or \
+                    (replacement and "_id" in update and not _equal(update["_id"], old["_id"])):
+                raise WriteError("Performing an update on the path '_id' would modify the immutable field '_id'")
+            if new != old:
+                self._replace(old, new)
+            changes.append((old, new))
+        if changes or not upsert:
+            return changes, None
+        seed = _upsert_seed(query)
+        if replacement:
+            new = {k: _copy(v) for k, v in update.items()}
+            if "_id" in seed and "_id" not in new:
+                new["_id"] = seed["_id"]
+        else:
+            new = seed
+            apply_update(new, update, inserting=True)
+        if "_id" not in new:
+            new = {"_id": ObjectId(), **new}
+        self._insert(new)
+        return [(None, new)], new["_id"]
+
+    # ----- pymongo API -----
+    def create_index(self, keys, unique: bool = False, name: Optional[str] = None, **kwargs) -> str:
+        spec = _sort_spec(keys)
+        if unique and len(spec) > 1:
+            raise _unsupported("index", "compound unique", {"unique single-field", "compound"})
+        # Equality lookups use the leading field; the rest of a compound key is filtered in Python
+        field = spec[0][0]
+        if unique or not self._has_index(field):
+            self._build_index(field, unique)
+        return name or "_".join(f"{f}_{d}" for f, d in spec)
+
+    def find(self, filter=None, projection=None, sort=None, skip: int = 0, limit: int = 0, **kwargs) -> Cursor:
+        return Cursor(self, filter, projection, sort, skip, limit)
+
+    def find_one(self, filter=None, projection=None, sort=None, **kwargs) -> Optional[dict]:
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        return next(Cursor(self, filter, projection, sort, 0, 1), None)
+
+    def count_documents(self, filter: dict, skip: int = 0, limit: int = 0, **kwargs) -> int:
+        count = max(len(self._read(filter)) - skip, 0)
+        return min(count, limit) if limit else count
+
+    def distinct(self, key: str, filter=None, **kwargs) -> list:
+        values = {}
+        for doc in self._read(filter or {}):
+            for value in _path_values(doc, key):
+                for item in (value if isinstance(value, list) else [value]):
+                    values.setdefault(_key(item), item)
+        return [_copy(v) for v in values.values()]
+
+    def aggregate(self, pipeline: list, **kwargs):
+        pipeline = list(pipeline)
+        query = pipeline.pop(0)["$match"] if pipeline and "$match" in pipeline[0] else {}
+        docs = run_pipeline(self._read(query), pipeline)
+        return iter([_copy(d) if not self._fresh else d for d in docs])
+
+    def insert_one(self, document: dict, **kwargs) -> InsertOneResult:
+        if "_id" not in document:
+            # pymongo adds the generated _id to the caller's document too
+            document["_id"] = ObjectId()
+        with self._transaction(write=True):
+            self._insert(_copy(document))
+        return InsertOneResult(document["_id"], True)
+
+    def insert_many(self, documents: Iterable[dict], ordered: bool = True, **kwargs) -> InsertManyResult:
+        documents = list(documents)
+        with self._transaction(write=True):
+            for document in documents:
+                if "_id" not in document:
+                    document["_id"] = ObjectId()
+                self._insert(_copy(document))
+        return InsertManyResult([d["_id"] for d in documents], True)
+
+    def _update(self, filter: dict, update: dict, upsert: bool, multi: bool, replacement: bool) -> UpdateResult:
+        terms = self._prepare(filter)
+        with self._transaction(write=True):
+            changes, upserted_id = self._modify(filter, update, terms, upsert, multi, replacement)
+        raw = {"n": len(changes), "nModified": sum(1 for old, new in changes if old is not None and old != new)}
+        if upserted_id is not None:
+            raw["upserted"] = upserted_id
+        return UpdateResult(raw, True)
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update(filter, update, upsert, False, False)
+
+    def update_many(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update(filter, update, upsert, True, False)
+
+    def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update(filter, replacement, upsert, False, True)
+
+    def _find_and_modify(self, filter, update, projection, sort, upsert, return_document, replacement):
+        terms = self._prepare(filter)
+        with self._transaction(write=True):
+            changes, _ = self._modify(filter, update, terms, upsert, False, replacement, sort)
+        if not changes:
+            return None
+        old, new = changes[0]
+        doc = new if return_document == ReturnDocument.AFTER else old
+        return None if doc is None else project(doc, projection)
+
+    def find_one_and_update(self, filter: dict, update: dict, projection=None, sort=None, upsert: bool = False,
+                            return_document: bool = ReturnDocument.BEFORE, **kwargs) -> Optional[dict]:
+        return self._find_and_modify(filter, update, projection, sort, upsert, return_document, False)
+
+    def _delete(self, filter: dict, multi: bool, sort=None) -> list:
+        terms = self._prepare(filter)
+        with self._transaction(write=True):
+            docs = self._select(filter, terms, None if multi or sort else 1)
+            if sort:
+                docs = sort_docs(docs, _sort_spec(sort), 1)
+            for doc in docs:
+                self._remove(doc)
+        return docs
+
+    def find_one_and_delete(self, filter: dict, projection=None, sort=None, **kwargs) -> Optional[dict]:
+        docs = self._delete(filter, False, sort)
+        return project(docs[0], projection) if docs else None
+
+    def delete_one(self, filter: dict, **kwargs) -> DeleteResult:
+        return DeleteResult({"n": len(self._delete(filter, False))}, True)
+
+    def delete_many(self, filter: dict, **kwargs) -> DeleteResult:
+        return DeleteResult({"n": len(self._delete(filter, True))}, True)
+
+    def bulk_write(self, requests: list, ordered: bool = True, **kwargs) -> BulkWriteResult:
+        # pymongo's request objects (UpdateOne, ReplaceOne, ...) keep their arguments in _filter/_doc/_upsert
+        result = {"nInserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "nUpserted": 0,
+                  "upserted": [], "writeErrors": [], "writeConcernErrors": []}
+        for request in requests:
+            if type(request).__name__ not in BULK_OPERATIONS:
+                raise _unsupported("bulk operation", type(request).__name__, BULK_OPERATIONS)
+        plans = [(request, self._prepare(request._filter)) for request in requests]
+        with self._transaction(write=True):
+            for index, (request, terms) in enumerate(plans):
+                kind = type(request).__name__
+                changes, upserted_id = self._modify(request._filter, request._doc, terms, request._upsert,
+                                                    kind == "UpdateMany", kind == "ReplaceOne")
+                if upserted_id is not None:
+                    result["nUpserted"] += 1
+                    result["upserted"].append({"index": index, "_id": upserted_id})
+                else:
+                    result["nMatched"] += len(changes)
+                    result["nModified"] += sum(1 for old, new in changes if old != new)
+        return BulkWriteResult(result, True)
+
+
+class MemoryCollection(Collection):
+    """Documents in a dict keyed by _id, with hash indexes from index key to _ids.
+
+    Stored documents are never modified in place (updates store a new dict),
+    so readers can use them after the lock is released.
+    """
+
+    def __init__(self, database, name: str):
+        super().__init__(database, name)
+        self._docs: Dict[str, dict] = {}
+        self._order: Dict[str, int] = {}
+        self._next = 0
+        self._indexes: Dict[str, Dict[str, set]] = {}
+        self._unique: set = set()
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def _transaction(self, write: bool = False):
+        with self._lock:
+            yield
+
+    def _all(self):
+        return list(self._docs.values())
+
+    def _by_ids(self, ids: set):
+        if len(ids) * 4 > len(self._docs):
+            return [doc for key, doc in self._docs.items() if key in ids]
+        return [self._docs[key] for key in sorted(ids, key=self._order.__getitem__)]
+
+    def _has_index(self, field: str) -> bool:
+        return field in self._indexes
+
+    def _build_index(self, field: str, unique: bool) -> None:
+        with self._lock:
+            index: Dict[str, set] = {}
+            for id_key, doc in self._docs.items():
+                for key in _index_keys(doc, field):
+                    ids = index.setdefault(key, set())
+                    if unique and ids:
+                        raise self._duplicate(field, _get_path(doc, field))
+                    ids.add(id_key)
+            self._indexes[field] = index
+            if unique:
+                self._unique.add(field)
+
+    def _lookup(self, field: str, keys: set) -> set:
+        index = self._indexes[field]
+        if len(keys) == 1:
+            return index.get(next(iter(keys)), set())
+        ids = set()
+        for key in keys:
+            ids |= index.get(key, set())
+        return ids
+
+    def _check_unique(self, doc: dict, id_key: str) -> None:
+        for field in self._unique:
+            for key in _index_keys(doc, field):
+                if self._indexes[field].get(key, set()) - {id_key}:
+                    raise self._duplicate(field, _get_path(doc, field))
+
+    def _index(self, doc: dict, id_key: str, add: bool) -> None:
+        for field, index in self._indexes.items():
+            for key in _index_keys(doc, field):
+                if add:
+                    index.setdefault(key, set()).add(id_key)
+                else:
+                    ids = index.get(key)
+                    if ids is not None:
+                        ids.discard(id_key)
+                        if not ids:
+                            del index[key]
+
+    def _insert(self, doc: dict) -> None:
+        id_key = _key(doc["_id"])
+        if id_key in self._docs:
+            raise self._duplicate("_id", doc["_id"])
+        self._check_unique(doc, id_key)
+        self._docs[id_key] = doc
+        self._order[id_key] = self._next
+        self._next += 1
+        self._index(doc, id_key, True)
+
+    def _replace(self, old: dict, new: dict) -> None:
+        id_key = _key(old["_id"])
+        self._check_unique(new, id_key)
+        self._index(old, id_key, False)
+        self._docs[id_key] = new
+        self._index(new, id_key, True)
+
+    def _remove(self, doc: dict) -> None:
+        id_key = _key(doc["_id"])
+        self._index(doc, id_key, False)
+        del self._docs[id_key]
+        del self._order[id_key]
+
+
+class SQLiteCollection(Collection):
+    """Documents as JSON rows in ``<name>``; index entries as (field, key, id) rows in ``<name>__index``.
+
+    Writes take SQLite's write lock (BEGIN IMMEDIATE) for the whole
+    read-modify-write, so find_one_and_update and friends stay atomic across
+    worker processes. The set of indexed fields lives in a shared table and is
+    re-read by every write, so an index one worker builds is maintained by all.
+    """
+
+    _fresh = True
+
+    def __init__(self, database, name: str):
+        super().__init__(database, name)
+        self._table = '"' + name.replace('"', '""') + '"'
+        self._index_table = '"' + (name + "__index").replace('"', '""') + '"'
+        self._known: Dict[str, bool] = {}
+        self._fields: Dict[str, bool] = {}
+        with self._transaction(write=True) as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {self._table} ("
+                         "seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL UNIQUE, doc TEXT NOT NULL)")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {self._index_table} "
+                         "(field TEXT NOT NULL, key TEXT NOT NULL, id TEXT NOT NULL)")
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "{name}__index_lookup" ON {self._index_table} (field, key)')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "{name}__index_id" ON {self._index_table} (id)')
+
+    @contextmanager
+    def _transaction(self, write: bool = False):
+        conn = self.database._connection()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            if write:
+                self._fields = self._load_fields(conn)
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _load_fields(self, conn) -> Dict[str, bool]:
+        rows = conn.execute("SELECT field, is_unique FROM docstore_indexes WHERE collection = ?", (self.name,))
+        fields = {field: bool(is_unique) for field, is_unique in rows}
+        self._known.update(fields)
+        return fields
+
+    def _rows(self, sql: str, params=()):
+        return [_decode(doc) for (doc,) in self.database._connection().execute(sql, params)]
+
+    def _all(self):
+        return self._rows(f"SELECT doc FROM {self._table} ORDER BY seq")
+
+    def _by_ids(self, ids: set):
+        conn = self.database._connection()
+        if len(ids) * 4 > self._count():
+            return [_decode(doc) for id_key, doc in conn.execute(f"SELECT id, doc FROM {self._table} ORDER BY seq")
+                    if id_key in ids]
+        ids = list(ids)
+        rows = []
+        for start in range(0, len(ids), _SQLITE_MAX_PARAMS):
+            chunk = ids[start:start + _SQLITE_MAX_PARAMS]
+            marks = ",".join("?" * len(chunk))
+            rows.extend(conn.execute(f"SELECT seq, doc FROM {self._table} WHERE id IN ({marks})", chunk))
+        rows.sort()
+        return [_decode(doc) for _, doc in rows]
+
+    def _count(self) -> int:
+        return self.database._connection().execute(f"SELECT COUNT(*) FROM {self._table}").fetchone()[0]
+
+    def _has_index(self, field: str) -> bool:
+        return field in self._known
+
+    def _build_index(self, field: str, unique: bool) -> None:
+        if self.database._connection().in_transaction:
+            # A read would otherwise hold the write lock for a full index build
+            raise RuntimeError(f"Index on {self.name}.{field} must be built before the transaction starts")
+        with self._transaction(write=True) as conn:
+            if field in self._fields and (self._fields[field] or not unique):
+                return
+            if field not in self._fields:
+                entries = set()
+                for id_key, doc in conn.execute(f"SELECT id, doc FROM {self._table}"):
+                    entries.update((field, key, id_key) for key in _index_keys(_decode(doc), field))
+                conn.executemany(f"INSERT INTO {self._index_table} (field, key, id) VALUES (?, ?, ?)", entries)
+            if unique:
+                dup = conn.execute(f"SELECT key FROM {self._index_table} WHERE field = ? "
+                                   "GROUP BY key HAVING COUNT(*) > 1 LIMIT 1", (field,)).fetchone()
+                if dup is not None:
+                    raise self._duplicate(field, _decode(dup[0]))
+            conn.execute("INSERT OR REPLACE INTO docstore_indexes (collection, field, is_unique) VALUES (?, ?, ?)",
+                         (self.name, field, int(unique)))
+            self._fields[field] = unique
+        self._known[field] = unique
+
+    def _lookup(self, field: str, keys: set) -> set:
+        keys = list(keys)
+        conn = self.database._connection()
+        ids = set()
+        for start in range(0, len(keys), _SQLITE_MAX_PARAMS):
+            chunk = keys[start:start + _SQLITE_MAX_PARAMS]
+            marks = ",".join("?" * len(chunk))
+            ids.update(id_key for (id_key,) in conn.execute(
+                f"SELECT id FROM {self._index_table} WHERE field = ? AND key IN ({marks})", [field, *chunk]))
+        return ids
+
+    def _write_index(self, conn, doc: dict, id_key: str, old: Optional[dict] = None) -> None:
+        for field, unique in self._fields.items():
+            keys = _index_keys(doc, field)
+            old_keys = _index_keys(old, field) if old is not None else set()
+            if keys == old_keys:
+                continue
+            if unique:
+                for key in keys - old_keys:
+                    if conn.execute(f"SELECT 1 FROM {self._index_table} WHERE field = ? AND key = ? AND id != ? LIMIT 1",
+                                    (field, key, id_key)).fetchone():
+                        raise self._duplicate(field, _get_path(doc, field))
+            conn.executemany(f"DELETE FROM {self._index_table} WHERE field = ? AND key = ? AND id = ?",
+                             [(field, key, id_key) for key in old_keys - keys])
+            conn.executemany(f"INSERT INTO {self._index_table} (field, key, id) VALUES (?, ?, ?)",
+                             [(field, key, id_key) for key in keys - old_keys])
+
+    def _insert(self, doc: dict) -> None:
+        conn = self.database._connection()
+        id_key = _key(doc["_id"])
+        try:
+            conn.execute(f"INSERT INTO {self._table} (id, doc) VALUES (?, ?)", (id_key, _encode(doc)))
+        except sqlite3.IntegrityError:
+            raise self._duplicate("_id", doc["_id"])
+        self._write_index(conn, doc, id_key)
+
+    def _replace(self, old: dict, new: dict) -> None:
+        conn = self.database._connection()
+        id_key = _key(old["_id"])
+        self._write_index(conn, new, id_key, old)
+        conn.execute(f"UPDATE {self._table} SET doc = ? WHERE id = ?", (_encode(new), id_key))
+
+    def _remove(self, doc: dict) -> None:
+        conn = self.database._connection()
+        id_key = _key(doc["_id"])
+        conn.execute(f"DELETE FROM {self._table} WHERE id = ?", (id_key,))
+        conn.execute(f"DELETE FROM {self._index_table} WHERE id = ?", (id_key,))
+
+
+# ---------- databases ----------
+class _Database:
+    collection_class = Collection
+
+    def __init__(self, name: str):
+        self.name = name
+        self._collections: Dict[str, Collection] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> Collection:
+        collection = self._collections.get(name)
+        if collection is None:
+            with self._lock:
+                collection = self._collections.get(name)
+                if collection is None:
+                    collection = self._collections[name] = self.collection_class(self, name)
+        return collection
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryDatabase(_Database):
+    """Collections held in this process's memory; nothing is persisted."""
+
+    collection_class = MemoryCollection
+
+
+class SQLiteDatabase(_Database):
+    """Collections stored in one SQLite file, shared by every process on the node.
+
+    Each thread gets its own connection (created after fork, like the Mongo
+    client), so readers run concurrently under WAL while writers queue on
+    SQLite's single write lock.
+    """
+
+    collection_class = SQLiteCollection
+
+    def __init__(self, path: str, name: str = "kalakriti", timeout_seconds: float = 5.0):
+        super().__init__(name)
+        self.path = path
+        self.timeout_seconds = timeout_seconds
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._generation = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS docstore_indexes (collection TEXT NOT NULL, field TEXT NOT NULL, "
+                     "is_unique INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (collection, field))")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.owner != (os.getpid(), self._generation):
+            conn = sqlite3.connect(self.path, timeout=self.timeout_seconds,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.owner = conn, (os.getpid(), self._generation)
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._connections = self._connections, []
+            # Threads holding a connection from before the close open a new one
+            self._generation += 1
+        for conn in connections:
+            conn.close()
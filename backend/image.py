@@ -1,6 +1,5 @@
 import os, json, uuid, pathlib
 from typing import Optional
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
 from vertexai.generative_models import GenerativeModel
 from dotenv import load_dotenv
 from vertexai import init
@@ -8,36 +7,44 @@ from google import genai
 from langchain_core.prompts import PromptTemplate
 import re
 from langchain_huggingface import ChatHuggingFace, HuggingFaceEndpoint
+from metrics import timed, record_fallback
+from resources import ProcessLocal
+from image_workers import average_color, image_pool, render_poster
 
 load_dotenv()
 
 PROJECT_ID = os.getenv("PROJECT_ID")
 REGION = os.getenv("REGION", "us-central1")
 
-print("DEBUG: Initializing Vertex AI with", PROJECT_ID, REGION)  # sanity check
+def _init_vertex():
+    init(project=PROJECT_ID, location=REGION)
+    return True
 
-init(project=PROJECT_ID, location=REGION)
+# SDK clients are built on first use in each worker process, never before fork
+vertex_ai = ProcessLocal(_init_vertex)
+gemini_client = ProcessLocal(lambda: genai.Client(api_key=os.getenv("GENAI_API_KEY")))
 
 try:
     from google.cloud import vision, aiplatform
     GCP_AVAILABLE = True
+    vision_client = ProcessLocal(vision.ImageAnnotatorClient)
 except Exception as e:
     GCP_AVAILABLE = False
 
 OUTPUT_DIR = pathlib.Path("uploads") / "outputs"
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-client_gemini = genai.Client(api_key = os.getenv("GENAI_API_KEY"))
-
+@timed("ask_gemini")
 def ask_gemini(prompt: str):
     try:
-        response = client_gemini.models.generate_content(
+        response = gemini_client.get().models.generate_content(
             model="gemini-2.0-flash",
             contents=prompt
         )
         return response.candidates[0].content.parts[0].text
     except Exception as e:
         print("Gemini API error: ", e)
+        record_fallback("gemini_error")
         return ""
 
 # llm = HuggingFaceEndpoint(
@@ -53,10 +60,11 @@ def safe_json_loads(text: str):
     return json.loads(text)
 
 # --------------- Vision Pass -----------------
-def vision_inspect(image_path: str):
+@timed("vision_inspect")
+def vision_inspect(image_path: str, original_name: Optional[str] = None):
     if GCP_AVAILABLE:
         try:
-            client = vision.ImageAnnotatorClient()
+            client = vision_client.get()
             with open(image_path, "rb") as f:
                 content = f.read()
                 image = vision.Image(content=content)
@@ -74,12 +82,14 @@ def vision_inspect(image_path: str):
         except Exception as e:
             print("Vision API error: ", e)
     
-    im = Image.open(image_path).convert("RGB")
-    pixels = list(im.getdata())
-    avg = tuple(sum(c[i] for c in pixels)//len(pixels) for i in range(3))
-    return {"labels": [pathlib.Path(image_path).stem], "color": [f"rgb{avg}"], "confidence": 0.5}
+    record_fallback("local_vision")
+    avg = image_pool.call(average_color, os.path.abspath(image_path))
+    # Stored uploads are named by content hash, so only the client's filename can hint at the craft
+    label = pathlib.Path(original_name).stem.replace("_", " ").replace("-", " ").strip() if original_name else ""
+    return {"labels": [label or "handmade craft"], "color": [f"rgb{avg}"], "confidence": 0.5}
 
 # --------------- LLM call -----------------
+@timed("call_genai_for_listing")
 def call_genai_for_listing(seed_info: dict, artisan_info: dict):
     labels = seed_info.get("labels", [])[:5]
     colors = seed_info.get("colors", [])[:3]
@@ -124,6 +134,7 @@ def call_genai_for_listing(seed_info: dict, artisan_info: dict):
 
     except Exception as e:
         print("Gemini call failed, using fallback:", e)
+        record_fallback("gemini_listing_template")
 
         # ----------------
         # Fallback template
@@ -144,75 +155,23 @@ def call_genai_for_listing(seed_info: dict, artisan_info: dict):
         }
 
 # ------------ Poster Creation --------------
+@timed("create_watermarked_image")
 def create_watermarked_image(image_path: str, artisan_name: str, artisan_photo_path: Optional[str]):
-    im = Image.open(image_path).convert("RGBA")
-
-    maxw = 800
-    if im.width > maxw:
-        h = int(maxw * im.height / im.width)
-        im = im.resize((maxw, h), Image.LANCZOS)
-    im = im.filter(ImageFilter.SHARPEN)
-
-    bg_w, bg_h = im.width + 200, im.height + 200
-    gradient = Image.new("RGBA", (bg_w, bg_h), (255, 255, 255, 255))
-    draw = ImageDraw.Draw(gradient)
-    for y in range(bg_h):
-        r = int(245 - (y/bg_h) * 40)
-        g = int(230 - (y/bg_h) * 30)
-        b = int(210 - (y/bg_h) * 20)
-        draw.line([(0, y), (bg_w, y)], fill=(r, g, b, 255))
-    
-    canvas = gradient.copy()
-    px = (bg_w - im.width) // 2
-    py = (bg_h - im.height) // 2
-    canvas.paste(im, (px, py), im)
-
-    try:
-        if artisan_photo_path and pathlib.Path(artisan_photo_path).exists():
-            p = Image.open(artisan_photo_path).convert("RGBA")
-            size = 120
-            p = p.resize((size, size), Image.LANCZOS)
-            mask = Image.new("L", (size, size), 0)
-            ImageDraw.Draw(mask).ellipse((0, 0, size, size), fill=255)
-            pos = (30, bg_h - size - 30)
-            canvas.paste(p, pos, mask)
-    except Exception as e:
-        print("Artisan photo error:", e)
-
-    try:
-        font_big = ImageFont.truetype("arial.ttf", 36)
-        font_small = ImageFont.truetype("arial.ttf", 20)
-    except Exception as e:
-        font_big = ImageFont.load_default()
-        font_small = ImageFont.load_default()
-
-    draw = ImageDraw.Draw(canvas)
-
-    if artisan_name:
-        name_text = f"Crafted by {artisan_name}"
-        nbbox = draw.textbbox((0,0), name_text, font=font_big)
-        nw, nh = nbbox[2]-nbbox[0], nbbox[3]-nbbox[1]
-        nx, ny = 180, bg_h - nh - 40
-        draw.text((nx+2, ny+2), name_text, font=font_big, fill=(0,0,0,180))
-        draw.text((nx, ny), name_text, font=font_big, fill=(255,255,255,240))
-
-    wm_text = "Crafted with ♥ | Local Marketplace"
-    wbbox = draw.textbbox((0,0), wm_text, font=font_small)
-    ww, wh = wbbox[2]-wbbox[0], wbbox[3]-wbbox[1]
-    wx, wy = bg_w - ww - 30, bg_h - wh - 30
-    draw.text((wx+2, wy+2), wm_text, font=font_small, fill=(0,0,0,180))
-    draw.text((wx, wy), wm_text, font=font_small, fill=(255,255,255,200))
-
     filename = f"showcase_{uuid.uuid4().hex}.png"
     out_path = OUTPUT_DIR / filename
-    canvas.convert("RGB").save(out_path, format="PNG")
+    # Rendered in the image worker pool so concurrent uploads use every core
+    image_pool.call(render_poster, os.path.abspath(image_path), artisan_name,
+                    os.path.abspath(artisan_photo_path) if artisan_photo_path else None, os.path.abspath(out_path))
     # Return just the relative path from uploads directory for proper URL construction
     return f"outputs/{filename}"
 
 
 #--------------- Full Pipeline ----------------
-def process_artisan_image(image_path: str, artisan_info: dict, artisan_photo_path: Optional[str] = None):
-    seed = vision_inspect(image_path)
+@timed("process_artisan_image")
+def process_artisan_image(image_path: str, artisan_info: dict, artisan_photo_path: Optional[str] = None,
+                          original_name: Optional[str] = None):
+    vertex_ai.get()
+    seed = vision_inspect(image_path, original_name)
     listing = call_genai_for_listing(seed, artisan_info)
     poster = create_watermarked_image(image_path, artisan_info["name"], artisan_photo_path)
 
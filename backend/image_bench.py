@@ -0,0 +1,245 @@
+# Micro-benchmarks for the per-upload CPU work in image.py (and BLIP
+# captioning in instaPost.py when its models are installed).
+#
+# Every case runs in a fresh process so peak RSS belongs to that case alone:
+# wall time is the median of --repeat runs after a warm-up, and a separate
+# tracemalloc pass records peak traced memory and allocated blocks.
+#
+#   python image_bench.py                       # full matrix, 0.3 MP .. 24 MP
+#   python image_bench.py --sizes 0.3,2 --functions vision_inspect
+#   python image_bench.py --compare benchmark_results/image_bench_<old>.json
+import argparse
+import json
+import multiprocessing
+import os
+import pathlib
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from datetime import datetime
+
+from loadtest import RESULTS_DIR, git_revision, peak_rss_mb, rss_mb
+
+# Megapixels -> (width, height) at 4:3, the common phone camera aspect
+SIZES = {0.3: (640, 480), 2: (1632, 1224), 8: (3264, 2448), 12: (4000, 3000), 24: (5664, 4248)}
+FORMATS = ["JPEG", "PNG", "HEIC"]
+FUNCTIONS = ["vision_inspect", "create_watermarked_image", "safe_json_loads", "describe_image"]
+FIXTURE_DIR = pathlib.Path(tempfile.gettempdir()) / "kalakriti_image_bench"
+
+GEMINI_RESPONSE = """```json
+{
+  "title": "Hand-painted Terracotta Matka from Khurja",
+  "short_description": "A sun-baked terracotta pot, painted by hand in earthy reds.",
+  "long_description": "%s",
+  "tags": ["terracotta", "handmade", "pottery", "home-decor", "eco", "made-in-india"],
+  "suggested_price": 1450,
+  "price_explanation": "Materials, two days of work and regional market rates"
+}
+```"""
+
+
+def heic_supported() -> bool:
+    try:
+        import pillow_heif
+        pillow_heif.register_heif_opener()
+        return True
+    except ImportError:
+        return False
+
+
+def fixture_path(megapixels: float, fmt: str) -> pathlib.Path:
+    """A photo-like test image (gradients plus noise), generated once and reused."""
+    from PIL import Image, ImageFilter
+
+    width, height = SIZES[megapixels]
+    ext = {"JPEG": "jpg", "PNG": "png", "HEIC": "heic"}[fmt]
+    path = FIXTURE_DIR / f"bench_{megapixels}mp.{ext}"
+    if path.exists():
+        return path
+    FIXTURE_DIR.mkdir(parents=True, exist_ok=True)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 48).filter(ImageFilter.GaussianBlur(1))
+    im = Image.merge("RGB", (gradient, noise, gradient.rotate(180)))
+    save_kwargs = {"quality": 90} if fmt in ("JPEG", "HEIC") else {}
+    im.save(path, format=fmt, **save_kwargs)
+    return path
+
+
+def import_image_module():
+    """Import image.py for its local code paths, without the cloud SDKs if they are missing."""
+    try:
+        import image
+    except ImportError as e:
+        print(f"⚠ Cloud SDKs not installed ({e}); benchmarking image.py with placeholder clients")
+        placeholders = {
+            "google": {"__path__": []},
+            "vertexai": {"init": lambda **kwargs: None},
+            "vertexai.generative_models": {"GenerativeModel": object},
+            "google.genai": {"Client": lambda **kwargs: None},
+            "langchain_core": {},
+            "langchain_core.prompts": {"PromptTemplate": object},
+            "langchain_huggingface": {"ChatHuggingFace": object, "HuggingFaceEndpoint": object},
+        }
+        for name, attrs in placeholders.items():
+            if name not in sys.modules:
+                module = types.ModuleType(name)
+                module.__dict__.update(attrs)
+                sys.modules[name] = module
+        sys.modules["vertexai"].generative_models = sys.modules["vertexai.generative_models"]
+        google = sys.modules.setdefault("google", types.ModuleType("google"))
+        google.genai = sys.modules["google.genai"]
+        import image
+    # Measure the local fallback, not the Vision API round-trip
+    image.GCP_AVAILABLE = False
+    return image
+
+
+def build_call(function: str, path: pathlib.Path, megapixels: float):
+    if function == "safe_json_loads":
+        image = import_image_module()
+        # Scale the long description with the "size" so the axis still means something
+        text = GEMINI_RESPONSE % ("Each piece is unique. " * int(40 * megapixels))
+        return lambda: image.safe_json_loads(text)
+    if function == "describe_image":
+        import instaPost
+        if not getattr(instaPost, "BLIP_AVAILABLE", True):
+            raise RuntimeError("BLIP model not available")
+        return lambda: instaPost.describe_image(str(path))
+
+    image = import_image_module()
+    if function == "vision_inspect":
+        return lambda: image.vision_inspect(str(path))
+    if function == "create_watermarked_image":
+        def run():
+            poster = image.create_watermarked_image(str(path), "Sita Devi", None)
+            os.remove(image.OUTPUT_DIR / pathlib.Path(poster).name)
+        return run
+    raise ValueError(f"Unknown function {function}")
+
+
+def run_case(function: str, megapixels: float, fmt: str, repeat: int) -> dict:
+    """Executed in a child process."""
+    # Measure the rendering itself inline; pool workers could not be started from
+    # this (daemonic) benchmark process anyway
+    os.environ["IMAGE_WORKERS"] = "0"
+    if fmt == "HEIC":
+        heic_supported()
+    path = fixture_path(megapixels, fmt)
+    call = build_call(function, path, megapixels)
+    rss_before = rss_mb()
+
+    call()  # warm-up: imports, font loading, lazy model init
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    call()
+    _, traced_peak = tracemalloc.get_traced_memory()
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    tracemalloc.stop()
+
+    return {
+        "function": function,
+        "megapixels": megapixels,
+        "format": fmt,
+        "file_bytes": path.stat().st_size,
+        "repeat": repeat,
+        "wall_ms": {
+            "median": round(statistics.median(timings) * 1000, 3),
+            "min": round(min(timings) * 1000, 3),
+            "max": round(max(timings) * 1000, 3),
+        },
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "rss_growth_mb": round(peak_rss_mb() - rss_before, 1),
+        "tracemalloc_peak_mb": round(traced_peak / 2 ** 20, 2),
+        "live_blocks_after": blocks,
+    }
+
+
+def _child(args):
+    try:
+        return run_case(*args)
+    except Exception as e:
+        function, megapixels, fmt, _ = args
+        return {"function": function, "megapixels": megapixels, "format": fmt,
+                "skipped": f"{type(e).__name__}: {e}"}
+
+
+def case_key(case: dict) -> str:
+    return f"{case['function']}/{case['megapixels']}mp/{case['format']}"
+
+
+def compare(current: dict, baseline: dict) -> None:
+    old_cases = {case_key(c): c for c in baseline.get("cases", []) if "wall_ms" in c}
+    print(f"\nvs {baseline.get('git_revision')} ({baseline.get('timestamp')})")
+    print(f"{'case':42} {'median ms':>12} {'change':>9} {'peak MB':>9}")
+    for case in current["cases"]:
+        old = old_cases.get(case_key(case))
+        if "wall_ms" not in case or old is None:
+            continue
+        before, after = old["wall_ms"]["median"], case["wall_ms"]["median"]
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"{case_key(case):42} {after:>12} {change:>9} {case['tracemalloc_peak_mb']:>9}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="image.py micro-benchmarks")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in SIZES), help="megapixels, comma list")
+    parser.add_argument("--formats", default=",".join(FORMATS))
+    parser.add_argument("--functions", default=",".join(FUNCTIONS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="result file (default benchmark_results/image_bench_<rev>_<time>.json)")
+    parser.add_argument("--compare", help="baseline result file to diff against")
+    args = parser.parse_args()
+
+    sizes = [float(s) if "." in s else int(s) for s in args.sizes.split(",")]
+    formats = [f.upper() for f in args.formats.split(",")]
+    if "HEIC" in formats and not heic_supported():
+        print("⚠ HEIC skipped: pillow-heif is not installed")
+        formats.remove("HEIC")
+
+    cases = []
+    for function in args.functions.split(","):
+        # safe_json_loads does not read the image, one format is enough
+        for fmt in formats[:1] if function == "safe_json_loads" else formats:
+            for megapixels in sizes:
+                cases.append((function, megapixels, fmt, args.repeat))
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for case in cases:
+        with context.Pool(1) as pool:
+            result = pool.apply(_child, (case,))
+        results.append(result)
+        if "skipped" in result:
+            print(f"  {case_key(result):42} skipped ({result['skipped']})")
+        else:
+            print(f"  {case_key(result):42} {result['wall_ms']['median']:>10} ms  "
+                  f"rss {result['peak_rss_mb']:>7} MB  traced {result['tracemalloc_peak_mb']:>7} MB")
+
+    report = {
+        "git_revision": git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "cases": results,
+    }
+    output = pathlib.Path(args.output) if args.output else (
+        RESULTS_DIR / f"image_bench_{report['git_revision']}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"✓ Results written to {output}")
+    if args.compare:
+        compare(report, json.loads(pathlib.Path(args.compare).read_text()))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,246 @@
+# Image fetcher for post-from-url. One pooled requests.Session is shared by
+# every download, bodies stream to disk in large chunks under a size cap and
+# must look like an image (Content-Type plus magic bytes). URLs that point at
+# our own /uploads are read straight from disk (blobs through the storage
+# read-through cache when media lives in object storage), and remote images
+# are cached by URL and revalidated with ETag / Last-Modified. The cache lives
+# outside uploads/ so fetched third-party images are never served publicly.
+import base64
+import hashlib
+import json
+import os
+import pathlib
+import threading
+import time
+import uuid
+from typing import Optional
+from urllib.parse import unquote, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from blob_store import BLOB_REFERENCE
+from ingest import detect_image_type
+from media import lookup_media
+from object_storage import StorageError
+
+UPLOAD_DIR = pathlib.Path("uploads")
+CACHE_DIR = pathlib.Path(os.getenv("FETCH_CACHE_DIR", str(pathlib.Path("data") / "fetch_cache")))
+MAX_FETCH_BYTES = int(os.getenv("MAX_FETCH_BYTES", str(15 * 1024 * 1024)))
+MAX_CACHE_BYTES = int(os.getenv("FETCH_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Files handed out by fetch() within this window are never evicted, so callers can finish using them
+CACHE_GRACE_SECONDS = int(os.getenv("FETCH_CACHE_GRACE_SECONDS", "600"))
+CHUNK_SIZE = 1024 * 1024
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+POOL_SIZE = 16
+
+# Hosts whose /uploads/... URLs are served by this API, so they map to local files
+LOCAL_MEDIA_HOSTS = {
+    h.strip().lower() for h in os.getenv("MEDIA_LOCAL_HOSTS", "localhost,127.0.0.1,0.0.0.0").split(",") if h.strip()
+}
+
+
+class FetchError(Exception):
+    pass
+
+
+def _make_session() -> requests.Session:
+    session = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504), allowed_methods=("GET",))
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = "KalaKriti-ImageFetcher/1.0"
+    return session
+
+
+class ImageFetcher:
+    """Resolve an image URL to a local file path.
+
+    Returned paths are owned by the fetcher (cache entries or files under
+    ``uploads/``); callers must not delete them. A cache entry stays on disk
+    for at least ``grace_seconds`` after it was last returned.
+    """
+
+    def __init__(self, upload_dir: pathlib.Path = UPLOAD_DIR, cache_dir: pathlib.Path = CACHE_DIR,
+                 max_bytes: int = MAX_FETCH_BYTES, max_cache_bytes: int = MAX_CACHE_BYTES,
+                 local_hosts=LOCAL_MEDIA_HOSTS, blob_store=None, grace_seconds: int = CACHE_GRACE_SECONDS):
+        self.upload_dir = pathlib.Path(upload_dir)
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_cache_bytes = max_cache_bytes
+        self.grace_seconds = grace_seconds
+        self.local_hosts = set(local_hosts)
+        self.blob_store = blob_store  # set by the app once storage is configured
+        self._session: Optional[requests.Session] = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = _make_session()
+        return self._session
+
+    def close(self) -> None:
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def fetch(self, url: str) -> str:
+        if url.startswith("data:"):
+            return self._from_data_url(url)
+        local = self._local_path(url)
+        if local is not None:
+            return local
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https"):
+            raise FetchError(f"Unsupported URL scheme: {parsed.scheme or 'none'}")
+        return self._download(url)
+
+    # ---------- local short-circuits ----------
+    def _local_path(self, url: str) -> Optional[str]:
+        parsed = urlparse(url)
+        if parsed.netloc and (parsed.hostname or "").lower() not in self.local_hosts:
+            return None
+        path = unquote(parsed.path)
+        if not path.startswith("/uploads/"):
+            return None
+        relative = path[len("/uploads/"):]
+        remote_blobs = self.blob_store is not None and self.blob_store.storage.remote
+        if remote_blobs and BLOB_REFERENCE.fullmatch(relative):
+            # Object storage: the blob may only exist in the bucket, so go through its local cache
+            try:
+                return self.blob_store.local_path(relative)
+            except StorageError:
+                pass
+        full_path, stat_result = lookup_media(str(self.upload_dir), relative)
+        if stat_result is None:
+            # Not on this node's disk; fall back to HTTP for absolute URLs
+            if parsed.netloc:
+                return None
+            raise FetchError(f"Upload not found: {path}")
+        return full_path
+
+    def _from_data_url(self, url: str) -> str:
+        header, _, encoded = url.partition(",")
+        if ";base64" not in header:
+            raise FetchError("Only base64 data URLs are supported")
+        if len(encoded) * 3 // 4 > self.max_bytes:
+            raise FetchError(f"Image larger than {self.max_bytes} bytes")
+        try:
+            data = base64.b64decode(encoded)
+        except ValueError as e:
+            raise FetchError(f"Invalid base64 data URL: {e}")
+        image_type = detect_image_type(data[:16])
+        if image_type is None:
+            raise FetchError("Data URL does not contain a supported image")
+        path = self.cache_dir / f"data_{hashlib.sha256(data).hexdigest()}.{image_type[0]}"
+        try:
+            # Reused entries count as freshly handed out
+            os.utime(path)
+        except FileNotFoundError:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f".{uuid.uuid4().hex}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+            self._evict()
+        return str(path)
+
+    # ---------- remote downloads ----------
+    def _entry_paths(self, url: str):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return self.cache_dir / f"url_{key}", self.cache_dir / f"url_{key}.json"
+
+    def _download(self, url: str) -> str:
+        body_path, meta_path = self._entry_paths(url)
+        meta = None
+        if body_path.exists() and meta_path.exists():
+            try:
+                meta = json.loads(meta_path.read_text())
+            except (OSError, ValueError):
+                meta = None
+
+        headers = {}
+        if meta:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            response = self.session.get(url, headers=headers, stream=True,
+                                        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        except requests.RequestException as e:
+            raise FetchError(f"Failed to download image: {e}")
+
+        with response:
+            if response.status_code == 304 and meta:
+                os.utime(body_path)
+                return str(body_path)
+            if response.status_code >= 400:
+                raise FetchError(f"Failed to download image: HTTP {response.status_code}")
+
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            if content_type and not (content_type.startswith("image/") or content_type == "application/octet-stream"):
+                raise FetchError(f"URL did not return an image (Content-Type {content_type})")
+            length = response.headers.get("Content-Length")
+            if length and length.isdigit() and int(length) > self.max_bytes:
+                raise FetchError(f"Image larger than {self.max_bytes} bytes")
+
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_dir / f".{uuid.uuid4().hex}.tmp"
+            size = 0
+            try:
+                with open(tmp_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        if size == 0 and detect_image_type(chunk[:16]) is None:
+                            raise FetchError("URL did not return a PNG, JPEG, GIF, WebP or HEIC image")
+                        size += len(chunk)
+                        if size > self.max_bytes:
+                            raise FetchError(f"Image larger than {self.max_bytes} bytes")
+                        f.write(chunk)
+                if size == 0:
+                    raise FetchError("URL returned an empty body")
+                os.replace(tmp_path, body_path)
+            except requests.RequestException as e:
+                raise FetchError(f"Failed to download image: {e}")
+            finally:
+                if tmp_path.exists():
+                    tmp_path.unlink()
+
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            if etag or last_modified:
+                meta_path.write_text(json.dumps({"url": url, "etag": etag, "last_modified": last_modified}))
+            elif meta_path.exists():
+                meta_path.unlink()
+        self._evict()
+        return str(body_path)
+
+    def _evict(self) -> None:
+        """Drop least recently used cache files once the cache outgrows its budget.
+
+        Files returned within the grace period are kept even over budget, as
+        a caller may still be reading them.
+        """
+        cutoff = time.time() - self.grace_seconds
+        try:
+            entries = [(e.stat().st_mtime, e.stat().st_size, pathlib.Path(e.path))
+                       for e in os.scandir(self.cache_dir)
+                       if e.is_file() and not e.name.endswith((".json", ".tmp"))]
+        except FileNotFoundError:
+            return
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_cache_bytes or mtime > cutoff:
+                break
+            path.unlink(missing_ok=True)
+            path.with_name(path.name + ".json").unlink(missing_ok=True)
+            total -= size
+
+
+image_fetcher = ImageFetcher()
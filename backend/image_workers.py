@@ -0,0 +1,233 @@
+# Process pool for the CPU-bound Pillow work (poster rendering, the local
+# vision fallback, derivatives and placeholders). Pillow holds the GIL for
+# most of its pixel loops, so threads serialise on one core; worker processes
+# scale across all of them. Tasks take and return file paths or small values,
+# never pixel data, so nothing large is pickled between processes.
+#
+# The pool bounds the number of queued + running tasks: sync callers wait up
+# to IMAGE_POOL_QUEUE_TIMEOUT seconds for a slot, then get ImagePoolBusy.
+# IMAGE_WORKERS=0 runs tasks inline in the calling thread. Every web worker
+# owns a pool, so the default splits the cores across WEB_CONCURRENCY of them.
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Callable, Optional
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+from image_loader import load_image
+from metrics import IMAGE_POOL_PENDING, IMAGE_POOL_REJECTED, IMAGE_POOL_TASK_SECONDS
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(max(1, (os.cpu_count() or 1) // max(WEB_CONCURRENCY, 1)))))
+IMAGE_POOL_MAX_PENDING = int(os.getenv("IMAGE_POOL_MAX_PENDING", str(max(IMAGE_WORKERS, 1) * 4)))
+IMAGE_POOL_QUEUE_TIMEOUT = float(os.getenv("IMAGE_POOL_QUEUE_TIMEOUT", "10"))
+POSTER_MAX_WIDTH = 800
+
+
+class ImagePoolBusy(Exception):
+    pass
+
+
+# ---------- tasks (run inside the workers) ----------
+@lru_cache(maxsize=1)
+def _poster_fonts():
+    try:
+        return ImageFont.truetype("arial.ttf", 36), ImageFont.truetype("arial.ttf", 20)
+    except Exception:
+        return ImageFont.load_default(), ImageFont.load_default()
+
+
+def render_poster(image_path: str, artisan_name: str, artisan_photo_path: Optional[str], out_path: str) -> str:
+    """Showcase poster: sharpened product on a warm gradient with name and watermark."""
+    im = load_image(image_path, "RGBA", size_hint=(POSTER_MAX_WIDTH, POSTER_MAX_WIDTH))
+
+    if im.width > POSTER_MAX_WIDTH:
+        h = int(POSTER_MAX_WIDTH * im.height / im.width)
+        im = im.resize((POSTER_MAX_WIDTH, h), Image.LANCZOS, reducing_gap=3.0)
+    im = im.filter(ImageFilter.SHARPEN)
+
+    bg_w, bg_h = im.width + 200, im.height + 200
+    canvas = Image.new("RGBA", (bg_w, bg_h), (255, 255, 255, 255))
+    draw = ImageDraw.Draw(canvas)
+    for y in range(bg_h):
+        r = int(245 - (y/bg_h) * 40)
+        g = int(230 - (y/bg_h) * 30)
+        b = int(210 - (y/bg_h) * 20)
+        draw.line([(0, y), (bg_w, y)], fill=(r, g, b, 255))
+
+    px = (bg_w - im.width) // 2
+    py = (bg_h - im.height) // 2
+    canvas.paste(im, (px, py), im)
+
+    try:
+        if artisan_photo_path and os.path.exists(artisan_photo_path):
+            size = 120
+            p = load_image(artisan_photo_path, "RGBA", size_hint=(size, size))
+            p = p.resize((size, size), Image.LANCZOS, reducing_gap=3.0)
+            mask = Image.new("L", (size, size), 0)
+            ImageDraw.Draw(mask).ellipse((0, 0, size, size), fill=255)
+            pos = (30, bg_h - size - 30)
+            canvas.paste(p, pos, mask)
+    except Exception as e:
+        print("Artisan photo error:", e)
+
+    font_big, font_small = _poster_fonts()
+    draw = ImageDraw.Draw(canvas)
+
+    if artisan_name:
+        name_text = f"Crafted by {artisan_name}"
+        nbbox = draw.textbbox((0, 0), name_text, font=font_big)
+        nh = nbbox[3] - nbbox[1]
+        nx, ny = 180, bg_h - nh - 40
+        draw.text((nx+2, ny+2), name_text, font=font_big, fill=(0, 0, 0, 180))
+        draw.text((nx, ny), name_text, font=font_big, fill=(255, 255, 255, 240))
+
+    wm_text = "Crafted with ♥ | Local Marketplace"
+    wbbox = draw.textbbox((0, 0), wm_text, font=font_small)
+    ww, wh = wbbox[2]-wbbox[0], wbbox[3]-wbbox[1]
+    wx, wy = bg_w - ww - 30, bg_h - wh - 30
+    draw.text((wx+2, wy+2), wm_text, font=font_small, fill=(0, 0, 0, 180))
+    draw.text((wx, wy), wm_text, font=font_small, fill=(255, 255, 255, 200))
+
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    canvas.convert("RGB").save(tmp_path, format="PNG")
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def average_color(image_path: str) -> tuple:
+    """Mean RGB of an image, for the local vision fallback."""
+    im = load_image(image_path, "RGB", size_hint=(64, 64))
+    # A 1x1 box-filtered reduction is the exact mean without a Python pixel loop
+    return im.resize((1, 1), Image.BOX).getpixel((0, 0))
+
+
+# ---------- pool ----------
+def _context():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        # Workers only need this module and Pillow, not the app's __main__
+        context.set_forkserver_preload(["image_workers"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+class ImageWorkerPool:
+    """Bounded ProcessPoolExecutor with sync (``call``) and async (``run``) entry points."""
+
+    def __init__(self, workers: int = IMAGE_WORKERS, max_pending: int = IMAGE_POOL_MAX_PENDING,
+                 queue_timeout: float = IMAGE_POOL_QUEUE_TIMEOUT):
+        self.workers = max(workers, 0)
+        self.max_pending = max(max_pending, 1)
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_context())
+            return self._executor
+
+    def _reset_broken(self, executor: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is executor:
+                print("⚠ Image worker pool broke (a worker died); starting a new one")
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _dispatch(self, fn: Callable, args: tuple) -> Future:
+        """Submit once a slot is held; the slot is released when the task finishes."""
+        task = fn.__name__
+        start = time.perf_counter()
+        with self._lock:
+            self._pending += 1
+        IMAGE_POOL_PENDING.inc()
+
+        def finished(future: Future) -> None:
+            with self._lock:
+                self._pending -= 1
+            IMAGE_POOL_PENDING.dec()
+            self._slots.release()
+            outcome = "error" if future.cancelled() or future.exception() is not None else "ok"
+            IMAGE_POOL_TASK_SECONDS.observe(time.perf_counter() - start, task=task, outcome=outcome)
+
+        if self.workers == 0:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            future.add_done_callback(finished)
+            return future
+
+        executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._reset_broken(executor)
+            executor = self._get_executor()
+            try:
+                future = executor.submit(fn, *args)
+            except BaseException:
+                finished(_failed_future())
+                raise
+        except BaseException:
+            finished(_failed_future())
+            raise
+        future.add_done_callback(
+            lambda f: self._reset_broken(executor)
+            if not f.cancelled() and isinstance(f.exception(), BrokenProcessPool) else None)
+        future.add_done_callback(finished)
+        return future
+
+    def _reject(self, fn: Callable):
+        IMAGE_POOL_REJECTED.inc(task=fn.__name__)
+        return ImagePoolBusy(f"Image workers are busy ({self.max_pending} tasks pending)")
+
+    def submit(self, fn: Callable, *args) -> Future:
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise self._reject(fn)
+        return self._dispatch(fn, args)
+
+    def call(self, fn: Callable, *args):
+        """Run ``fn(*args)`` in a worker and wait for the result (blocks this thread)."""
+        return self.submit(fn, *args).result()
+
+    async def run(self, fn: Callable, *args):
+        """Async form of :meth:`call`; waiting for a slot happens off the event loop."""
+        if not self._slots.acquire(blocking=False):
+            acquired = await asyncio.to_thread(self._slots.acquire, True, self.queue_timeout)
+            if not acquired:
+                raise self._reject(fn)
+        return await asyncio.wrap_future(self._dispatch(fn, args))
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "pending": self._pending, "max_pending": self.max_pending}
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def _failed_future() -> Future:
+    future = Future()
+    future.set_exception(RuntimeError("submit failed"))
+    return future
+
+
+image_pool = ImageWorkerPool()
@@ -0,0 +1,273 @@
+# Streaming image ingestion for /upload-base64-image. The request body is
+# read chunk by chunk and decoded straight into a temp file, so peak memory
+# stays at one chunk regardless of image size. Accepted bodies:
+#   - application/json  {"image_data": "<base64 or data: URL>", "filename": "..."}
+#   - text/plain        base64 text, optionally a data: URL
+#   - image/* or application/octet-stream  raw image bytes
+import base64
+import binascii
+import hashlib
+import json
+import os
+import pathlib
+import re
+import uuid
+from typing import Optional, Tuple
+
+import anyio
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(15 * 1024 * 1024)))
+MAX_FIELD_LENGTH = 1024
+
+IMAGE_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "png", "image/png"),
+    (b"\xff\xd8\xff", "jpg", "image/jpeg"),
+    (b"GIF87a", "gif", "image/gif"),
+    (b"GIF89a", "gif", "image/gif"),
+]
+_URLSAFE_TO_STANDARD = bytes.maketrans(b"-_", b"+/")
+
+
+class IngestError(Exception):
+    """Upload rejected; carries the HTTP status to answer with."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def detect_image_type(head: bytes) -> Optional[Tuple[str, str]]:
+    """Return (extension, media type) from the first bytes of an image."""
+    for signature, ext, media_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext, media_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp", "image/webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"mif1", b"msf1"):
+        return "heic", "image/heic"
+    return None
+
+
+class Base64StreamDecoder:
+    """Incremental base64 decoder that also strips a leading data: URL header."""
+
+    def __init__(self):
+        self._pending = b""
+        self._head = b""
+        self._started = False
+
+    def feed(self, data: bytes) -> bytes:
+        if not self._started:
+            self._head += data
+            if self._head.startswith(b"data:"):
+                comma = self._head.find(b",")
+                if comma == -1:
+                    if len(self._head) > 256:
+                        raise IngestError("Malformed data URL")
+                    return b""
+                data = self._head[comma + 1:]
+            elif len(self._head) < 5 and b"data:".startswith(self._head):
+                # Too short to tell whether this is a data: URL yet
+                return b""
+            else:
+                data = self._head
+            self._head = b""
+            self._started = True
+
+        data = self._pending + data.translate(_URLSAFE_TO_STANDARD, b" \t\r\n")
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        try:
+            return base64.b64decode(data[:usable], validate=True)
+        except binascii.Error as e:
+            raise IngestError(f"Invalid base64 data: {e}")
+
+    def finish(self) -> bytes:
+        if not self._started:
+            # Whole body was shorter than a data: prefix
+            self._started = True
+            data, self._head = self._head, b""
+            return self.feed(data) + self.finish()
+        if not self._pending:
+            return b""
+        data = self._pending + b"=" * (-len(self._pending) % 4)
+        self._pending = b""
+        try:
+            return base64.b64decode(data, validate=True)
+        except binascii.Error as e:
+            raise IngestError(f"Invalid base64 data: {e}")
+
+
+_SEEK_KEY, _IN_KEY, _SEEK_VALUE, _IN_VALUE, _SKIP_SCALAR = range(5)
+
+
+class JsonFieldStreamer:
+    """Streams one string field of a flat JSON object, collecting the others.
+
+    Only handles the shape this endpoint accepts: a single object whose values
+    are strings or scalars. The streamed field is returned chunk by chunk from
+    feed() without ever holding the whole value.
+    """
+
+    def __init__(self, stream_key: str = "image_data"):
+        self.stream_key = stream_key.encode()
+        self.fields = {}
+        self.found = False
+        self._state = _SEEK_KEY
+        self._key = bytearray()
+        self._value = bytearray()
+        self._escape = False
+
+    def feed(self, data: bytes) -> bytes:
+        out = bytearray()
+        i, n = 0, len(data)
+        while i < n:
+            streaming = self._state == _IN_VALUE and self._key == self.stream_key
+            if streaming and not self._escape:
+                # Fast path: copy everything up to the next quote or backslash
+                quote, backslash = data.find(b'"', i), data.find(b"\\", i)
+                stops = [pos for pos in (quote, backslash) if pos != -1]
+                if not stops:
+                    out += data[i:]
+                    break
+                j = min(stops)
+                out += data[i:j]
+                i = j + 1
+                if j == quote:
+                    self.found = True
+                    self._state = _SEEK_KEY
+                else:
+                    self._escape = True
+                continue
+
+            ch = data[i]
+            i += 1
+            if self._state == _IN_VALUE:
+                if self._escape:
+                    self._escape = False
+                    if streaming:
+                        # "\/" is an escaped slash; "\n" etc. are line wraps
+                        if ch == ord("/"):
+                            out.append(ch)
+                    elif len(self._value) < MAX_FIELD_LENGTH:
+                        self._value += b"\\" + bytes([ch])
+                elif ch == ord("\\"):
+                    self._escape = True
+                elif ch == ord('"'):
+                    try:
+                        self.fields[self._key.decode()] = json.loads(b'"' + bytes(self._value) + b'"')
+                    except ValueError:
+                        pass
+                    self._state = _SEEK_KEY
+                elif len(self._value) < MAX_FIELD_LENGTH:
+                    self._value.append(ch)
+            elif self._state == _SEEK_KEY:
+                if ch == ord('"'):
+                    self._key = bytearray()
+                    self._state = _IN_KEY
+            elif self._state == _IN_KEY:
+                if ch == ord('"'):
+                    self._state = _SEEK_VALUE
+                elif len(self._key) < MAX_FIELD_LENGTH:
+                    self._key.append(ch)
+            elif self._state == _SEEK_VALUE:
+                if ch in b" \t\r\n:":
+                    continue
+                if ch == ord('"'):
+                    self._value = bytearray()
+                    self._state = _IN_VALUE
+                else:
+                    self._state = _SKIP_SCALAR
+            elif self._state == _SKIP_SCALAR:
+                if ch in b",}":
+                    self._state = _SEEK_KEY
+        return bytes(out)
+
+
+def safe_filename(name: Optional[str], ext: str) -> str:
+    """Strip directories and odd characters and force the detected extension."""
+    stem = pathlib.Path(name or "").name
+    stem = re.sub(r"\.(png|jpe?g|gif|webp|heic)$", "", stem, flags=re.IGNORECASE)
+    stem = re.sub(r"[^A-Za-z0-9_-]", "_", stem).strip("_")[:80]
+    return f"{stem or 'uploaded_' + uuid.uuid4().hex[:12]}.{ext}"
+
+
+async def ingest_image(request, upload_dir: pathlib.Path, filename: Optional[str] = None,
+                       max_bytes: int = MAX_UPLOAD_BYTES, blob_store=None) -> dict:
+    """Stream an uploaded image from ``request`` into ``upload_dir``.
+
+    With a ``blob_store`` the image is stored under its content hash instead
+    of the client's filename, and ``filename`` in the result is its path
+    relative to ``upload_dir``.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == "application/json":
+        mode, max_body = "json", max_bytes * 4 // 3 + 4096
+    elif (content_type.startswith("text/")
+          or request.headers.get("content-transfer-encoding", "").lower() == "base64"):
+        mode, max_body = "base64", max_bytes * 4 // 3 + 4096
+    else:
+        mode, max_body = "raw", max_bytes
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_body:
+        raise IngestError(f"Image larger than {max_bytes // (1024 * 1024)} MB", 413)
+
+    streamer = JsonFieldStreamer() if mode == "json" else None
+    decoder = Base64StreamDecoder() if mode != "raw" else None
+    tmp_path = upload_dir / f".ingest_{uuid.uuid4().hex}.tmp"
+    head = b""
+    image_type = None
+    written = 0
+    sha = hashlib.sha256()
+
+    async def write(f, chunk: bytes):
+        nonlocal head, image_type, written
+        if not chunk:
+            return
+        written += len(chunk)
+        if written > max_bytes:
+            raise IngestError(f"Image larger than {max_bytes // (1024 * 1024)} MB", 413)
+        if image_type is None:
+            head = (head + chunk)[:16]
+            if len(head) >= 12:
+                image_type = detect_image_type(head)
+                if image_type is None:
+                    raise IngestError("Uploaded data is not a PNG, JPEG, GIF, WebP or HEIC image", 415)
+        sha.update(chunk)
+        await f.write(chunk)
+
+    try:
+        async with await anyio.open_file(tmp_path, "wb") as f:
+            async for chunk in request.stream():
+                if streamer is not None:
+                    chunk = streamer.feed(chunk)
+                if decoder is not None:
+                    chunk = decoder.feed(chunk)
+                await write(f, chunk)
+            if decoder is not None:
+                await write(f, decoder.finish())
+
+        if streamer is not None and not streamer.found:
+            raise IngestError("No image data provided")
+        if image_type is None:
+            image_type = detect_image_type(head)
+            if image_type is None:
+                raise IngestError("Uploaded data is not a PNG, JPEG, GIF, WebP or HEIC image", 415)
+
+        ext, media_type = image_type
+        if blob_store is not None:
+            blob = await anyio.to_thread.run_sync(blob_store.put_file, tmp_path, ext, sha.hexdigest())
+            return {"filename": blob["path"], "size": written, "content_type": media_type,
+                    "digest": blob["digest"]}
+        requested_name = filename or (streamer.fields.get("filename") if streamer else None)
+        final_name = safe_filename(requested_name, ext)
+        final_path = upload_dir / final_name
+        if final_path.exists():
+            final_name = safe_filename(f"{final_path.stem}_{uuid.uuid4().hex[:6]}", ext)
+            final_path = upload_dir / final_name
+        os.replace(tmp_path, final_path)
+        return {"filename": final_name, "size": written, "content_type": media_type}
+    finally:
+        if tmp_path.exists():
+            os.remove(tmp_path)
@@ -1,27 +1,38 @@
 from langchain_huggingface import HuggingFaceEndpoint, ChatHuggingFace
-from langchain_core.prompts import PromptTemplate
 from instagrapi import Client
 from dotenv import load_dotenv
 from transformers import BlipProcessor, BlipForConditionalGeneration
-from PIL import Image
 import os
-import requests
-import tempfile
-import base64
-from urllib.parse import urlparse, unquote
+from metrics import stage_timer, timed, record_fallback
+from image_fetch import FetchError, image_fetcher
+from captions import CaptionGenerator, listing_caption
+from image_loader import load_image
+from resources import ProcessLocal
 
 # Load env variables
 load_dotenv()
 
+try:
+    from google import genai
+    # Built on first use in each worker process, never before fork
+    gemini_client = ProcessLocal(lambda: genai.Client(api_key=os.getenv("GENAI_API_KEY")))
+    LLM_AVAILABLE = True
+except Exception as e:
+    print(f"⚠ Gemini client not available for captions: {e}")
+    gemini_client = None
+    LLM_AVAILABLE = False
+
+@timed("ask_gemini")
 def ask_gemini(prompt: str):
     try:
-        response = client_gemini.models.generate_content(
+        response = gemini_client.get().models.generate_content(
             model="gemini-2.0-flash",
             contents=prompt
         )
         return response.candidates[0].content.parts[0].text
     except Exception as e:
         print("Gemini API error: ", e)
+        record_fallback("gemini_error")
         return ""
 
 def get_client(username=None, password=None):
@@ -34,12 +45,49 @@ def get_client(username=None, password=None):
 
     cl = Client()
     try:
-        cl.login(username, password)
+        with stage_timer("instagram_login"):
+            cl.login(username, password)
         return cl
     except Exception as e:
         raise Exception(f"Failed to login to Instagram: {str(e)}")
 
+# Logged-in clients reused across outbox posts, keyed by account
+_account_clients = {}
+
+def default_account() -> str:
+    return os.getenv("INSTAGRAM_USERNAME") or os.getenv("INSTA_USER") or "default"
+
+def account_credentials(account: str) -> tuple:
+    """(username, password) for a queued account; unknown accounts are an error, never the default login."""
+    if account == default_account():
+        return (os.getenv("INSTAGRAM_USERNAME") or os.getenv("INSTA_USER"),
+                os.getenv("INSTAGRAM_PASSWORD") or os.getenv("INSTA_PASS"))
+    # Other accounts: INSTAGRAM_PASSWORD_<ACCOUNT>, e.g. INSTAGRAM_PASSWORD_SHOP_TWO for shop.two
+    env_name = "INSTAGRAM_PASSWORD_" + "".join(c if c.isalnum() else "_" for c in account).upper()
+    password = os.getenv(env_name)
+    if not password:
+        raise ValueError(f"No Instagram credentials for account {account!r} (set {env_name})")
+    return account, password
+
+def publish_photo(image_path: str, caption: str, account: str = None) -> dict:
+    """Upload an already-captioned photo. Raises on failure so the outbox can retry."""
+    account = account or default_account()
+    cl = _account_clients.get(account)
+    if cl is None:
+        cl = _account_clients[account] = get_client(*account_credentials(account))
+    try:
+        with stage_timer("instagram_upload"):
+            result = cl.photo_upload(image_path, caption)
+    except Exception:
+        # Drop the session so the retry logs in again
+        _account_clients.pop(account, None)
+        raise
+    return {"status": "posted", "post_id": str(result.pk) if hasattr(result, 'pk') else None}
+
 # ========== Image Captioning Model ==========
+# BLIP resizes its input to 384x384, so JPEGs never need decoding above that
+BLIP_SIZE_HINT = (384, 384)
+
 try:
     processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
     blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
@@ -48,13 +96,15 @@ except Exception as e:
     print(f"⚠ BLIP model not available: {e}")
     BLIP_AVAILABLE = False
 
+@timed("describe_image")
 def describe_image(img_path: str) -> str:
     """Generate a description of an image using BLIP."""
     if not BLIP_AVAILABLE:
+        record_fallback("blip_unavailable")
         return "A beautiful handcrafted artwork"
     
     try:
-        image = Image.open(img_path).convert("RGB")
+        image = load_image(img_path, "RGB", size_hint=BLIP_SIZE_HINT)
         inputs = processor(image, return_tensors="pt")
         out = blip_model.generate(**inputs)
         description = processor.decode(out[0], skip_special_tokens=True)
@@ -75,68 +125,57 @@ def describe_image(img_path: str) -> str:
 #     print(f"⚠ LLM model not available: {e}")
 #     LLM_AVAILABLE = False
 
-caption_prompt = PromptTemplate(
-    template="""
-        You are a professional Instagram content creator.
-        Write a catchy caption with emojis and at least 5 trending hashtags.
-        Picture description: {picture}
-    """,
-    input_variables=["picture"]
-)
+# Captions are cached by normalised description and rationed against an hourly
+# LLM budget; past the budget they come from a local template
+caption_generator = CaptionGenerator(ask_gemini if LLM_AVAILABLE else None)
 
+@timed("generate_captions")
 def generate_captions(img_desc: str) -> str:
     """Generate an Instagram caption based on image description."""
-    if not LLM_AVAILABLE:
-        return f"✨ Beautiful handcrafted artwork! 🎨\n\n{img_desc}\n\n#handmade #artisan #craft #traditional #beautiful #art #culture #heritage #handcrafted #unique"
-    
-    try:
-        prompt = caption_prompt.format(picture=img_desc)
-        response = ask_gemini(prompt)
-        return response
-    except Exception as e:
-        print(f"Error generating caption: {e}")
-        return f"✨ Beautiful handcrafted artwork! 🎨\n\n{img_desc}\n\n#handmade #artisan #craft #traditional #beautiful #art #culture #heritage #handcrafted #unique"
+    return caption_generator.generate(img_desc)
+
+@timed("generate_captions_batch")
+def generate_captions_batch(img_descs: list) -> list:
+    """Caption several image descriptions with one LLM round-trip per batch."""
+    return caption_generator.generate_batch(img_descs)
 
+def caption_for_post(image_path: str, product_data: dict = None) -> tuple:
+    """(description, caption) for a post; BLIP and the LLM only run when there is no listing."""
+    caption = listing_caption(product_data)
+    if caption:
+        return product_data.get("short_description") or product_data.get("title", ""), caption
+    img_desc = describe_image(image_path)
+    return img_desc, generate_captions(img_desc)
+
+def build_caption(image_path: str, product_data: dict = None) -> str:
+    return caption_for_post(image_path, product_data)[1]
+
+def build_captions_batch(items: list) -> list:
+    """Captions for several (image_path, product_data) posts; BLIP runs per image, the LLM once per batch."""
+    captions = [listing_caption(product_data) for _, product_data in items]
+    missing = [i for i, caption in enumerate(captions) if not caption]
+    descriptions = [describe_image(items[i][0]) for i in missing]
+    for i, caption in zip(missing, generate_captions_batch(descriptions)):
+        captions[i] = caption
+    return captions
+
+@timed("download_image")
 def download_image_from_url(image_url: str) -> str:
-    """Download image from URL and return temporary file path."""
+    """Resolve an image URL to a local file path (owned by the fetcher, do not delete)."""
     try:
-        # Handle base64 data URLs
-        if image_url.startswith('data:'):
-            header, encoded = image_url.split(',', 1)
-            image_data = base64.b64decode(encoded)
-            
-            # Create temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_file:
-                temp_file.write(image_data)
-                return temp_file.name
-        
-        # Handle regular URLs
-        else:
-            # Clean up the URL
-            parsed_url = urlparse(image_url)
-            clean_url = f"{parsed_url.scheme}://{parsed_url.netloc}{unquote(parsed_url.path)}"
-            
-            response = requests.get(clean_url, stream=True, timeout=30)
-            response.raise_for_status()
-            
-            # Create temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    temp_file.write(chunk)
-                return temp_file.name
-                
-    except Exception as e:
-        raise Exception(f"Failed to download image: {str(e)}")
+        return image_fetcher.fetch(image_url)
+    except FetchError as e:
+        raise Exception(str(e))
 
+@timed("post_to_instagram_from_url")
 def post_to_instagram_from_url(image_url: str, username=None, password=None) -> dict:
     """Download an image from a URL, process it, and post to Instagram."""
-    temp_file_path = None
     try:
         print(f"📸 Processing Instagram post for URL: {image_url[:100]}...")
         
         # Step 1: Download the image
         temp_file_path = download_image_from_url(image_url)
-        print(f"✅ Image downloaded to: {temp_file_path}")
+        print(f"✅ Image available at: {temp_file_path}")
         
         # Step 2: Generate description and caption
         img_desc = describe_image(temp_file_path)
@@ -147,7 +186,8 @@ def post_to_instagram_from_url(image_url: str, username=None, password=None) ->
         
         # Step 3: Get Instagram client and post
         cl = get_client(username, password)
-        result = cl.photo_upload(temp_file_path, caption)
+        with stage_timer("instagram_upload"):
+            result = cl.photo_upload(temp_file_path, caption)
         print(f"🚀 Posted to Instagram successfully!")
         
         return {
@@ -169,15 +209,8 @@ def post_to_instagram_from_url(image_url: str, username=None, password=None) ->
             "message": f"Failed to post to Instagram: {error_msg}",
             "error": error_msg
         }
-    finally:
-        # Step 4: Clean up the temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path)
-                print(f"🧹 Cleaned up temporary file: {temp_file_path}")
-            except:
-                pass
 
+@timed("post_to_instagram")
 def post_to_instagram(image_path: str, product_data: dict) -> dict:
     """Generate caption and post image to Instagram (for local file paths)."""
     try:
@@ -186,11 +219,11 @@ def post_to_instagram(image_path: str, product_data: dict) -> dict:
         if not os.path.exists(image_path):
             raise FileNotFoundError(f"Image file not found: {image_path}")
         
-        img_desc = describe_image(image_path)
-        caption = generate_captions(img_desc)
+        img_desc, caption = caption_for_post(image_path, product_data)
         
         cl = get_client()
-        result = cl.photo_upload(image_path, caption)
+        with stage_timer("instagram_upload"):
+            result = cl.photo_upload(image_path, caption)
         
         return {
             "description": img_desc,
@@ -210,85 +243,6 @@ def post_to_instagram(image_path: str, product_data: dict) -> dict:
             "error": error_msg
         }
 
-    cl = Client()
-    cl.login(username=username.strip(), password=password.strip())
-    return cl
-
-# ========== Image Captioning Model ==========
-processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
-
-def describe_image(img_path: str) -> str:
-    """Generate a description of an image using BLIP."""
-    image = Image.open(img_path).convert("RGB")
-    inputs = processor(image, return_tensors="pt")
-    out = blip_model.generate(**inputs)
-    description = processor.decode(out[0], skip_special_tokens=True)
-    return description
-
-
-# ========== Hugging Face LLM (Qwen for captions) ==========
-# llm = HuggingFaceEndpoint(
-#     repo_id="Qwen/Qwen3-Coder-480B-A35B-Instruct",   # lighter & faster than 480B
-#     task="text-generation"
-# )
-# model = ChatHuggingFace(llm=llm)
-
-caption_prompt = PromptTemplate(
-    template="""
-        You are a professional Instagram content creator.
-        Write a catchy caption with emojis and at least 5 trending hashtags.
-        Picture description: {picture}
-    """,
-    input_variables=["picture"]
-)
-
-def generate_captions(img_desc: str) -> str:
-    """Generate an Instagram caption based on image description."""
-    prompt = caption_prompt.format(picture=img_desc)
-    response = ask_gemini(prompt)
-    return response
-
-def post_to_instagram_from_url(image_url: str) -> dict:
-    """Download an image from a URL, process it, and post to Instagram."""
-    try:
-        # Step 1: Download the image from the URL
-        cl = get_client()
-        response = requests.get(image_url, stream=True)
-        response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
-
-        # Step 2: Save the image to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_file:
-            for chunk in response.iter_content(chunk_size=8192):
-                temp_file.write(chunk)
-            temp_file_path = temp_file.name
-
-        # Step 3: Use the local file path to generate caption and post
-        img_desc = describe_image(temp_file_path)
-        caption = generate_captions(img_desc)
-        cl.photo_upload(temp_file_path, caption)
-
-        return {"description": img_desc, "caption": caption, "status": "posted", "message": "Photo posted successfully!"}
-
-    except Exception as e:
-        print(f"Error during Instagram post: {e}")
-        return {"description": "", "caption": "", "status": "failed", "message": "Failed to post to Instagram."}
-    finally:
-        # Step 4: Clean up the temporary file
-        if 'temp_file_path' in locals() and os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-
-def post_to_instagram(image_path: str, product_data: dict) -> dict:
-    """Generate caption and post image to Instagram (for local file paths)."""
-    try:
-        cl = get_client()
-        img_desc = describe_image(image_path)
-        caption = generate_captions(img_desc)
-        cl.photo_upload(image_path, caption)
-        return {"description": img_desc, "caption": caption, "status": "posted", "message": "Photo posted successfully!"}
-    except Exception as e:
-        print(f"Error during Instagram post: {e}")
-        return {"description": "", "caption": "", "status": "failed", "message": "Failed to post to Instagram."}
 
 # # ========== Main Flow ==========
 # if __name__ == "__main__":
@@ -0,0 +1,298 @@
+# Durable Instagram publishing outbox. Requests enqueue a post (poster path,
+# optional caption, optional scheduled time) into the `instagram_outbox`
+# collection and return immediately; a scheduler task publishes due posts
+# under a per-account token bucket, retrying failures with jittered
+# exponential backoff. The buckets live in their own collection and are
+# updated with compare-and-set, so every worker process draws on the same
+# budget and restarts don't grant a fresh burst. A client-supplied idempotency
+# key makes enqueueing safe to repeat (a post that went dead is reopened), and
+# claimed posts carry a lease so a crashed worker's posts are picked up again.
+# Posts queued without a caption are captioned just before publishing, together
+# with the next few uncaptioned posts, so a bulk campaign makes one caption
+# LLM call per batch instead of one per post.
+# All times in the queue are naive UTC, so they compare the same way in
+# MongoDB and the embedded stores whatever the server's local timezone.
+import asyncio
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+POSTS_PER_HOUR = float(os.getenv("INSTAGRAM_POSTS_PER_HOUR", "10"))
+BURST = int(os.getenv("INSTAGRAM_POST_BURST", "3"))
+MAX_ATTEMPTS = int(os.getenv("INSTAGRAM_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE_SECONDS = 60
+BACKOFF_MAX_SECONDS = 3600
+LEASE_SECONDS = 600
+POLL_SECONDS = 5
+BUCKET_CAS_RETRIES = 5
+CAPTION_BATCH_SIZE = int(os.getenv("CAPTION_BATCH_SIZE", "10"))
+
+PENDING, SENDING, POSTED, DEAD = "pending", "sending", "posted", "dead"
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def to_utc(value: datetime) -> datetime:
+    """Naive UTC for a client-supplied time; naive input is taken to be UTC already."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Exponential backoff, jittered to 50-150% of the nominal delay."""
+    nominal = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** max(attempts - 1, 0))
+    return nominal * random.uniform(0.5, 1.5)
+
+
+class InstagramOutbox:
+    """Enqueue and publish Instagram posts from a Mongo-backed queue.
+
+    ``publisher(image_path, caption, account)`` must raise on failure.
+    ``caption_builder(image_path, product_data)`` fills in captions that were
+    not supplied at enqueue time, so the slow caption work happens off the
+    request path. ``batch_caption_builder([(image_path, product_data), ...])``
+    does the same for several posts at once and is preferred when given.
+    """
+
+    def __init__(self, collection, publisher: Callable, caption_builder: Optional[Callable] = None,
+                 posts_per_hour: float = POSTS_PER_HOUR, burst: int = BURST,
+                 max_attempts: int = MAX_ATTEMPTS, limits_collection=None,
+                 batch_caption_builder: Optional[Callable] = None, caption_batch_size: int = CAPTION_BATCH_SIZE):
+        self.collection = collection
+        self.limits = limits_collection if limits_collection is not None else \
+            collection.database[f"{collection.name}_rate_limits"]
+        self.publisher = publisher
+        self.caption_builder = caption_builder
+        self.batch_caption_builder = batch_caption_builder
+        self.caption_batch_size = max(1, caption_batch_size)
+        self.rate = posts_per_hour / 3600.0
+        self.burst = burst
+        self.max_attempts = max_attempts
+        self._indexes_ready = False
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _ensure_indexes(self) -> None:
+        if self._indexes_ready:
+            return
+        self.collection.create_index("id", unique=True)
+        self.collection.create_index("idempotency_key", unique=True)
+        self.collection.create_index([("status", ASCENDING), ("next_attempt_at", ASCENDING)])
+        self.limits.create_index("account", unique=True)
+        self._indexes_ready = True
+
+    def _adjust_tokens(self, account: str, delta: int) -> bool:
+        """Refill the account's bucket and add ``delta`` tokens; False if it would go below zero."""
+        for _ in range(BUCKET_CAS_RETRIES):
+            now = time.time()
+            bucket = self.limits.find_one({"account": account})
+            if bucket is None:
+                if self.burst + delta < 0:
+                    return False
+                try:
+                    self.limits.insert_one({"account": account, "tokens": float(min(self.burst, self.burst + delta)),
+                                            "updated_at": now})
+                    return True
+                except DuplicateKeyError:
+                    continue
+            refilled = min(self.burst, bucket["tokens"] + max(now - bucket["updated_at"], 0.0) * self.rate)
+            tokens = min(self.burst, refilled + delta)
+            if tokens < 0:
+                return False
+            # Compare-and-set on the state we read, so two workers never spend the same token
+            swapped = self.limits.find_one_and_update(
+                {"account": account, "tokens": bucket["tokens"], "updated_at": bucket["updated_at"]},
+                {"$set": {"tokens": tokens, "updated_at": now}},
+            )
+            if swapped is not None:
+                return True
+        return False
+
+    # ---------- producer side ----------
+    def enqueue(self, image_path: str, account: str, caption: Optional[str] = None,
+                product_data: Optional[dict] = None, scheduled_at: Optional[datetime] = None,
+                idempotency_key: Optional[str] = None) -> dict:
+        """Queue a post; re-enqueueing the same idempotency key returns the existing post.
+
+        Without a key every call is a new post: posters are content-addressed,
+        so keying on the image would make reposting the same poster impossible.
+        """
+        self._ensure_indexes()
+        now = utcnow()
+        if scheduled_at is not None:
+            scheduled_at = to_utc(scheduled_at)
+        key = idempotency_key or str(uuid.uuid4())
+        post = {
+            "id": str(uuid.uuid4()),
+            "idempotency_key": key,
+            "account": account,
+            "image_path": image_path,
+            "caption": caption,
+            "product_data": product_data or {},
+            "status": PENDING,
+            "attempts": 0,
+            "scheduled_at": scheduled_at or now,
+            "next_attempt_at": scheduled_at or now,
+            "created_at": now,
+            "updated_at": now,
+            "last_error": None,
+            "result": None,
+        }
+        try:
+            self.collection.insert_one(dict(post))
+        except DuplicateKeyError:
+            # A retry of a request whose post gave up gets another round of attempts
+            reopened = self.collection.find_one_and_update(
+                {"idempotency_key": key, "status": DEAD},
+                {"$set": {"status": PENDING, "attempts": 0, "next_attempt_at": now, "updated_at": now,
+                          "last_error": None}},
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER,
+            )
+            if reopened is None:
+                return self.collection.find_one({"idempotency_key": key}, {"_id": 0})
+            post = reopened
+        if self._wakeup is not None:
+            # Called from request threads, so hand the wakeup to the scheduler's loop
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return post
+
+    def get(self, post_id: str) -> Optional[dict]:
+        return self.collection.find_one({"id": post_id}, {"_id": 0})
+
+    # ---------- consumer side ----------
+    def _claim(self, account: Optional[str] = None) -> Optional[dict]:
+        """Atomically take the oldest due post (or one whose lease expired)."""
+        now = utcnow()
+        due = {"$or": [
+            {"status": PENDING, "next_attempt_at": {"$lte": now}},
+            {"status": SENDING, "lease_until": {"$lte": now}},
+        ]}
+        if account is not None:
+            due["account"] = account
+        post = self.collection.find_one_and_update(
+            due,
+            {"$set": {"status": SENDING, "lease_until": now + timedelta(seconds=LEASE_SECONDS),
+                      "updated_at": now},
+             "$inc": {"attempts": 1}},
+            sort=[("next_attempt_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if post is not None:
+            post.pop("_id", None)
+        return post
+
+    def _next_due_account(self) -> Optional[str]:
+        """The account of the next due post whose bucket has a token."""
+        now = utcnow()
+        accounts = self.collection.distinct("account", {"$or": [
+            {"status": PENDING, "next_attempt_at": {"$lte": now}},
+            {"status": SENDING, "lease_until": {"$lte": now}},
+        ]})
+        for account in accounts:
+            if self._adjust_tokens(account, -1):
+                return account
+        return None
+
+    def _caption_batch(self, post: dict) -> str:
+        """Caption ``post`` along with the next uncaptioned pending posts in one builder call."""
+        others = list(self.collection.find(
+            {"status": PENDING, "caption": None, "id": {"$ne": post["id"]}},
+            {"_id": 0, "id": 1, "image_path": 1, "product_data": 1},
+            sort=[("next_attempt_at", ASCENDING)], limit=self.caption_batch_size - 1,
+        ))
+        batch = [post] + others
+        captions = self.batch_caption_builder([(p["image_path"], p.get("product_data") or {}) for p in batch])
+        for other, caption in zip(others, captions[1:]):
+            if caption:
+                # Another worker may have captioned it meanwhile; keep theirs
+                self.collection.update_one({"id": other["id"], "caption": None}, {"$set": {"caption": caption}})
+        return captions[0]
+
+    def _publish(self, post: dict) -> dict:
+        caption = post.get("caption")
+        if not caption and (self.batch_caption_builder is not None or self.caption_builder is not None):
+            if self.batch_caption_builder is not None:
+                caption = self._caption_batch(post)
+            else:
+                caption = self.caption_builder(post["image_path"], post.get("product_data") or {})
+            self.collection.update_one({"id": post["id"]}, {"$set": {"caption": caption}})
+        return self.publisher(post["image_path"], caption or "", post["account"])
+
+    def _record_success(self, post: dict, result: dict) -> None:
+        self.collection.update_one({"id": post["id"]}, {
+            "$set": {"status": POSTED, "result": result, "posted_at": utcnow(),
+                     "updated_at": utcnow(), "last_error": None},
+            "$unset": {"lease_until": ""},
+        })
+
+    def _record_failure(self, post: dict, error: Exception) -> None:
+        attempts = post.get("attempts", 1)
+        update = {"last_error": str(error), "updated_at": utcnow()}
+        if attempts >= self.max_attempts:
+            update["status"] = DEAD
+            print(f"❌ Instagram post {post['id']} gave up after {attempts} attempts: {error}")
+        else:
+            delay = backoff_seconds(attempts)
+            update.update({"status": PENDING, "next_attempt_at": utcnow() + timedelta(seconds=delay)})
+            print(f"⚠ Instagram post {post['id']} failed (attempt {attempts}), retrying in {delay:.0f}s: {error}")
+        self.collection.update_one({"id": post["id"]}, {"$set": update, "$unset": {"lease_until": ""}})
+
+    def process_one(self) -> Optional[dict]:
+        """Publish at most one due post if its account has rate budget. Blocking."""
+        self._ensure_indexes()
+        account = self._next_due_account()
+        if account is None:
+            return None
+        post = self._claim(account)
+        if post is None:
+            # Someone else took it; give the token back (capped at the burst size)
+            self._adjust_tokens(account, 1)
+            return None
+        try:
+            result = self._publish(post)
+            if result.get("status") == "failed":
+                raise RuntimeError(result.get("message") or result.get("error") or "publish failed")
+            self._record_success(post, result)
+        except Exception as e:
+            self._record_failure(post, e)
+        return self.get(post["id"])
+
+    async def run(self) -> None:
+        """Scheduler loop; publishing runs in a worker thread."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                while await asyncio.to_thread(self.process_one) is not None:
+                    pass
+            except Exception as e:
+                print(f"⚠ Instagram outbox error: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
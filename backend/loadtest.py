@@ -0,0 +1,372 @@
+# Reproducible load test for the FastAPI app in main.py.
+#
+# Boots the app in-process with stubbed Gemini / Vision / BLIP / Instagram
+# backends (fixed, configurable latency) and a MongoDB database or one of the
+# embedded stores (docstore.py: indexed in-memory by default, or SQLite),
+# seeds a generated catalog, then drives the storefront,
+# search, auth and /process-and-post endpoints at a fixed concurrency.
+# Throughput, p50/p95/p99 latency and memory are written as JSON so two
+# commits can be compared:
+#
+#   python loadtest.py --products 100000 --concurrency 32 --duration 20
+#   python loadtest.py --compare benchmark_results/loadtest_<old>.json
+#
+# Needs httpx (in-process ASGI client).
+import argparse
+import asyncio
+import io
+import json
+import os
+import pathlib
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import time
+import types
+from datetime import datetime, timedelta
+
+RESULTS_DIR = pathlib.Path("benchmark_results")
+CATEGORIES = ["Pottery", "Textiles", "Jewelry", "Woodwork", "Paintings", "Metalwork", "Leather", "Bamboo"]
+CRAFT_TYPES = ["Traditional", "Modern", "Fusion"]
+TAGS = ["handmade", "eco", "gift", "blue", "red", "terracotta", "silk", "brass", "madhubani",
+        "warli", "block-print", "ikat", "festive", "home-decor", "wall-art", "kitchen", "vintage",
+        "minimal", "bridal", "kids"]
+WORDS = ["handwoven", "painted", "carved", "glazed", "embroidered", "rustic", "royal", "village",
+         "heritage", "indigo", "golden", "earthen", "classic", "vibrant", "delicate"]
+SEARCH_TERMS = ["painted", "silk", "brass", "heritage", "indigo", "bowl", "saree", "lamp"]
+NOUNS = ["bowl", "vase", "saree", "stole", "necklace", "lamp", "panel", "tray", "bag", "mask"]
+
+
+# ---------- stubs ----------
+def install_ai_stubs(latency_ms: float) -> None:
+    """Replace image.py / instaPost.py with stand-ins of fixed latency.
+
+    The real modules load Vertex AI, Gemini, BLIP and instagrapi clients at
+    import time; the stubs keep the call shape and blocking behaviour, so
+    event-loop stalls in async handlers still show up in the numbers.
+    """
+    delay = latency_ms / 1000.0
+
+    image_stub = types.ModuleType("image")
+
+    def process_artisan_image(image_path, artisan_info, artisan_photo_path=None, original_name=None):
+        time.sleep(delay * 3)  # vision + LLM + poster
+        poster = f"outputs/bench_{os.getpid()}_{time.perf_counter_ns()}.png"
+        shutil.copyfile(image_path, pathlib.Path("uploads") / poster)
+        return {
+            "artisan": artisan_info,
+            "seed": {"labels": ["pottery"], "colors": [], "confidence": 0.5},
+            "listing": {"title": f"Handmade pottery by {artisan_info['name']}",
+                        "tags": ["handmade"], "suggested_price": 900},
+            "poster": poster,
+        }
+
+    image_stub.process_artisan_image = process_artisan_image
+
+    insta_stub = types.ModuleType("instaPost")
+
+    def post_to_instagram(image_path, product_data):
+        time.sleep(delay)  # upload; the caption comes from the listing
+        return {"description": "stub", "caption": "stub", "status": "posted", "message": "stub"}
+
+    def post_to_instagram_from_url(image_url, username=None, password=None):
+        return post_to_instagram(image_url, {})
+
+    def publish_photo(image_path, caption, account=None):
+        time.sleep(delay)  # upload
+        return {"status": "posted", "post_id": "stub"}
+
+    def build_caption(image_path, product_data=None):
+        return f"✨ {(product_data or {}).get('title', 'stub')} ✨"
+
+    insta_stub.post_to_instagram = post_to_instagram
+    insta_stub.post_to_instagram_from_url = post_to_instagram_from_url
+    insta_stub.publish_photo = publish_photo
+    insta_stub.build_caption = build_caption
+    insta_stub.default_account = lambda: "loadtest"
+
+    sys.modules["image"] = image_stub
+    sys.modules["instaPost"] = insta_stub
+
+
+def connect_database(mongo_url: str = None, database: str = "memory"):
+    if mongo_url:
+        from pymongo import MongoClient
+        client = MongoClient(mongo_url, serverSelectionTimeoutMS=3000)
+        client.admin.command("ping")
+        client.drop_database("kalakriti_bench")
+        return client["kalakriti_bench"], "mongodb"
+    from docstore import MemoryDatabase, SQLiteDatabase
+    if database == "sqlite":
+        path = RESULTS_DIR / "loadtest.db"
+        for stale in RESULTS_DIR.glob("loadtest.db*"):
+            stale.unlink()
+        return SQLiteDatabase(str(path), "kalakriti_bench"), "sqlite"
+    return MemoryDatabase("kalakriti_bench"), "memory"
+
+
+def bind_collections(main, db) -> None:
+    """Point main.py's collections and the services built on them at the benchmark database."""
+    main.bind_database(db)
+
+
+def generate_catalog(db, count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    ids, batch = [], []
+    for i in range(count):
+        product_id = f"bench-{i:07d}"
+        ids.append(product_id)
+        title = f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {rng.choice(NOUNS)}"
+        batch.append({
+            "id": product_id,
+            "title": title,
+            "description": f"{title} made by hand. " + " ".join(rng.choices(WORDS, k=20)),
+            "price": rng.randint(150, 40000),
+            "category": rng.choice(CATEGORIES),
+            "craft_type": rng.choice(CRAFT_TYPES),
+            "tags": rng.sample(TAGS, 4),
+            "artisan_id": f"artisan-{rng.randint(0, count // 50 + 1)}",
+            "stock": rng.randint(0, 20),
+            "status": "active" if rng.random() < 0.95 else "inactive",
+            "images": [f"/uploads/bench/{product_id}.jpg"],
+            "rating": round(rng.uniform(3, 5), 1),
+            "sales_count": rng.randint(0, 500),
+            "featured": rng.random() < 0.02,
+            "created_at": (start + timedelta(minutes=i)).isoformat(),
+        })
+        if len(batch) == 10000:
+            db["products"].insert_many(batch)
+            batch = []
+    if batch:
+        db["products"].insert_many(batch)
+    return ids
+
+
+def sample_image_bytes() -> bytes:
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new("RGB", (640, 480), (180, 90, 40)).save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+# ---------- scenarios ----------
+def build_scenarios(product_ids: list, users: list, image_bytes: bytes) -> dict:
+    async def storefront(client, rng):
+        kind = rng.random()
+        if kind < 0.3:
+            return await client.get(f"/api/user/products/all?page={rng.randint(1, 50)}&limit=20")
+        if kind < 0.5:
+            return await client.get("/api/user/products/filter", params={
+                "category": rng.choice(CATEGORIES), "min_price": 500, "max_price": 5000,
+                "sort_by": rng.choice(["price-low", "newest", "rating"])})
+        if kind < 0.6:
+            return await client.get("/api/user/products/featured")
+        if kind < 0.85:
+            return await client.get(f"/api/user/products/{rng.choice(product_ids)}")
+        return await client.get(f"/api/user/products/{rng.choice(product_ids)}/related")
+
+    async def search(client, rng):
+        return await client.get("/api/user/search", params={"q": rng.choice(SEARCH_TERMS), "limit": 20})
+
+    async def auth(client, rng):
+        email, password = rng.choice(users)
+        response = await client.post("/api/user/auth/login", json={"email": email, "password": password})
+        if response.status_code != 200:
+            return response
+        token = response.json()["data"]["token"]
+        return await client.get("/api/user/auth/me", headers={"Authorization": f"Bearer {token}"})
+
+    async def process_and_post(client, rng):
+        return await client.post(
+            "/process-and-post",
+            files={"file": (f"bench_{rng.randint(0, 9)}.jpg", image_bytes, "image/jpeg")},
+            data={"name": "Bench Artisan", "location": "Jaipur"},
+        )
+
+    return {"storefront": storefront, "search": search, "auth": auth, "process_and_post": process_and_post}
+
+
+async def register_users(client, count: int) -> list:
+    users = []
+    for i in range(count):
+        email, password = f"bench{i}@example.com", "bench-password"
+        response = await client.post("/api/user/auth/register", json={
+            "email": email, "username": f"bench_user_{i}", "full_name": f"Bench User {i}",
+            "password": password, "user_type": "user"})
+        if response.status_code == 200:
+            users.append((email, password))
+    return users
+
+
+# ---------- measurement ----------
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_scenario(client, scenario, concurrency: int, duration: float, max_requests: int, seed: int) -> dict:
+    latencies, statuses = [], {}
+    deadline = time.perf_counter() + duration
+    issued = 0
+
+    async def worker(worker_id: int):
+        nonlocal issued
+        rng = random.Random(seed * 1000 + worker_id)
+        while time.perf_counter() < deadline and (not max_requests or issued < max_requests):
+            issued += 1
+            start = time.perf_counter()
+            try:
+                response = await scenario(client, rng)
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    errors = sum(n for status, n in statuses.items() if not status.startswith(("2", "3")))
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": statuses,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+            "p50": round(percentile(latencies, 50) * 1000, 3),
+            "p95": round(percentile(latencies, 95) * 1000, 3),
+            "p99": round(percentile(latencies, 99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        },
+        "rss_mb": {"before": round(rss_before, 1), "after": round(rss_mb(), 1), "peak": round(peak_rss_mb(), 1)},
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current: dict, baseline: dict) -> None:
+    print(f"\nvs {baseline.get('git_revision')} ({baseline.get('timestamp')})")
+    print(f"{'scenario':18} {'rps':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for name, result in current["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+
+        def delta(new, before):
+            return f"{(new - before) / before * 100:+.1f}%" if before else "n/a"
+
+        print(f"{name:18} {delta(result['throughput_rps'], old['throughput_rps']):>10} "
+              f"{delta(result['latency_ms']['p50'], old['latency_ms']['p50']):>10} "
+              f"{delta(result['latency_ms']['p95'], old['latency_ms']['p95']):>10} "
+              f"{delta(result['latency_ms']['p99'], old['latency_ms']['p99']):>10}")
+
+
+async def run(args) -> dict:
+    import httpx
+
+    install_ai_stubs(args.stub_latency_ms)
+    import main
+
+    db, backend = connect_database(args.mongo_url, args.database)
+    bind_collections(main, db)
+
+    seeding = time.perf_counter()
+    product_ids = generate_catalog(db, args.products, args.seed)
+    seed_seconds = time.perf_counter() - seeding
+    print(f"Seeded {len(product_ids)} products into {backend} in {seed_seconds:.1f}s")
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        users = await register_users(client, args.users)
+        scenarios = build_scenarios(product_ids, users, sample_image_bytes())
+        selected = args.scenarios.split(",") if args.scenarios else list(scenarios)
+
+        results = {}
+        for name in selected:
+            print(f"→ {name}: {args.concurrency} workers for {args.duration}s")
+            results[name] = await run_scenario(client, scenarios[name], args.concurrency,
+                                               args.duration, args.requests, args.seed)
+            r = results[name]
+            print(f"  {r['throughput_rps']} req/s, p50 {r['latency_ms']['p50']} ms, "
+                  f"p95 {r['latency_ms']['p95']} ms, p99 {r['latency_ms']['p99']} ms, errors {r['errors']}")
+
+    # /process-and-post stores uploads and posters in the blob store
+    for blob in db["blobs"].find():
+        (main.UPLOAD_DIR / main.blob_store.relative_path(blob["digest"], blob["ext"])).unlink(missing_ok=True)
+
+    return {
+        "git_revision": git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "database": backend,
+        "params": {
+            "products": args.products, "users": args.users, "concurrency": args.concurrency,
+            "duration_s": args.duration, "max_requests": args.requests,
+            "stub_latency_ms": args.stub_latency_ms, "seed": args.seed,
+        },
+        "seed_seconds": round(seed_seconds, 2),
+        "scenarios": results,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="KalaKriti backend load test")
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("--requests", type=int, default=0, help="stop a scenario after N requests")
+    parser.add_argument("--scenarios", default="", help="comma list: storefront,search,auth,process_and_post")
+    parser.add_argument("--stub-latency-ms", type=float, default=50.0, help="per AI stage")
+    parser.add_argument("--mongo-url", default=os.getenv("BENCH_MONGO_URL"),
+                        help="use a real MongoDB (database kalakriti_bench is dropped first)")
+    parser.add_argument("--database", choices=["memory", "sqlite"], default="memory",
+                        help="embedded store to use without --mongo-url")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="result file (default benchmark_results/loadtest_<rev>_<time>.json)")
+    parser.add_argument("--compare", help="baseline result file to diff against")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    output = pathlib.Path(args.output) if args.output else (
+        RESULTS_DIR / f"loadtest_{result['git_revision']}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+    print(f"✓ Results written to {output}")
+    if args.compare:
+        compare(result, json.loads(pathlib.Path(args.compare).read_text()))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,8 +1,10 @@
-from fastapi import FastAPI, UploadFile, Form, HTTPException, Request, Response
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, Form, HTTPException, Request, Response, Depends, Header, BackgroundTasks, Query
+from fastapi.responses import JSONResponse, RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-import shutil, pathlib
+from starlette.concurrency import run_in_threadpool
+from PIL import Image
+import pathlib, asyncio
+from contextlib import asynccontextmanager
 # Make AI imports optional
 try:
     from image import process_artisan_image
@@ -12,15 +14,43 @@ except Exception as e:
     AI_AVAILABLE = False
 
 try:
-    from instaPost import post_to_instagram, post_to_instagram_from_url
+    from instaPost import (post_to_instagram, post_to_instagram_from_url, publish_photo,
+                           default_account, build_caption, build_captions_batch)
     INSTAGRAM_AVAILABLE = True
 except Exception as e:
     print(f"⚠ Instagram features not available: {e}")
     INSTAGRAM_AVAILABLE = False 
 
-from pymongo import MongoClient
+try:
+    import visual_search
+    VISUAL_SEARCH_AVAILABLE = True
+except Exception as e:
+    print(f"⚠ Visual search not available: {e}")
+    VISUAL_SEARCH_AVAILABLE = False
+
 from pydantic import BaseModel, EmailStr, validator
 from typing import List, Dict, Optional
+from accounts import (AccountExistsError, backfill_legacy_accounts, change_identity, create_account,
+                      find_account, restore_identity, touch_login)
+from session_tokens import InvalidToken, bind_revocations, issue_token, verify_token, revoke_token
+from media import (MediaFiles, MediaResponse, lookup_media, is_content_addressed,
+                   IMMUTABLE_CACHE_CONTROL, MUTABLE_CACHE_CONTROL)
+from placeholders import get_placeholder_async, CACHE_CONTROL as PLACEHOLDER_CACHE_CONTROL
+from derivatives import DerivativeError, derivative_cache
+from image_workers import ImagePoolBusy, image_pool
+from related_products import RelatedProductsEngine
+from instagram_outbox import PENDING as OUTBOX_PENDING, SENDING as OUTBOX_SENDING, InstagramOutbox
+from blob_store import BlobStore
+from object_storage import STORAGE_BACKEND, LocalStorage, StorageError, storage_from_env
+from resources import Resources
+from image_fetch import image_fetcher
+from catalog_filters import EXCLUSIVE_FACETS, build_filter_query, count_facets, filter_products
+from ingest import IngestError, ingest_image
+from request_guard import RequestGuardMiddleware
+from tracing import MongoCommandTracer, TracingMiddleware, bind_context
+from profiler import (ADMIN_TOKEN, LOOP_LAG_MONITOR, loop_lag_monitor, sample_profile,
+                      to_collapsed, to_speedscope, tracemalloc_session)
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, MongoCommandMetrics, render_latest
 import uuid
 from datetime import datetime
 import os
@@ -58,7 +88,50 @@ def validate_username(username: str) -> bool:
     pattern = r'^[a-zA-Z0-9_]{3,20}$'
     return re.match(pattern, username) is not None
 
-app = FastAPI(title="KalaKriti AI Backend", version="1.0.0")
+def _bearer_token(authorization: Optional[str]) -> str:
+    """Extract the token from an Authorization header"""
+    if not authorization or not authorization.lower().startswith("bearer "):
+        raise HTTPException(status_code=401, detail="Missing bearer token")
+    return authorization[7:].strip()
+
+def get_current_user(authorization: Optional[str] = Header(None)) -> dict:
+    """Authenticate a request from its signed token without touching MongoDB"""
+    try:
+        return verify_token(_bearer_token(authorization))
+    except InvalidToken as e:
+        raise HTTPException(status_code=401, detail=str(e))
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """Gate diagnostics endpoints behind the ADMIN_TOKEN shared secret"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open this worker's clients (after fork) and start its background loops; undo both on shutdown"""
+    bind_database(resources.open(), storage_from_env())
+    # Registration only checks the accounts index, so legacy profiles must be in it first
+    await run_in_threadpool(backfill_legacy_accounts, accounts_collection, users_collection,
+                            artisan_profiles_collection, migrations_collection)
+    if LOOP_LAG_MONITOR:
+        loop_lag_monitor.start()
+    if instagram_outbox is not None:
+        instagram_outbox.start()
+    blob_store.start()
+    try:
+        yield
+    finally:
+        if instagram_outbox is not None:
+            await instagram_outbox.stop()
+        await blob_store.stop()
+        loop_lag_monitor.stop()
+        await asyncio.to_thread(image_pool.shutdown)
+        image_fetcher.close()
+        resources.close()
+
+app = FastAPI(title="KalaKriti AI Backend", version="1.0.0", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -74,76 +147,32 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Middleware to handle base64 and long URL validation
-@app.middleware("http")
-async def validate_url_and_handle_base64(request: Request, call_next):
-    url_path = str(request.url.path)
-    query_params = str(request.url.query) if request.url.query else ""
-    
-    # Check for base64 data in URL path or query parameters
-    if ("data:image" in url_path or "data:image" in query_params or 
-        len(url_path) > 200 or len(query_params) > 1000):
-        
-        return JSONResponse(
-            status_code=400,
-            content={
-                "error": "Base64 image data detected in URL",
-                "message": "Base64 data cannot be used in URLs due to length limitations",
-                "suggestion": "Use the /upload-base64-image endpoint for base64 data or upload files directly",
-                "endpoints": {
-                    "base64_upload": "/upload-base64-image",
-                    "file_upload": "/upload",
-                    "instagram_posting": "/instagram/post-from-url"
-                }
-            }
-        )
-    
-    response = await call_next(request)
-    return response
-@app.middleware("http")
-async def validate_url_length(request: Request, call_next):
-    # Windows has a path length limit of ~260 characters for file system operations
-    MAX_PATH_LENGTH = 250  # Leave some buffer
-    
-    # Only check path length for static file requests (not full URL with query params)
-    if request.url.path.startswith("/uploads"):
-        # Extract just the file path part (without query parameters)
-        file_path = request.url.path
-        
-        # Check if this looks like a base64 image URL (common issue)
-        if "data:image" in str(request.url) or len(file_path) > MAX_PATH_LENGTH:
-            return JSONResponse(
-                status_code=400,
-                content={
-                    "error": "Invalid image URL format",
-                    "message": "Base64 image data should not be passed in URLs. Use the upload endpoint instead.",
-                    "suggestion": "Upload the image as a file or use the /upload-base64-image endpoint.",
-                    "path_length": len(file_path) if len(file_path) <= 1000 else "too long to display"
-                }
-            )
-    
-    response = await call_next(request)
-    return response
-
-# MongoDB connection (optional for testing)
-try:
-    MONGO_CLIENT = MongoClient("mongodb://localhost:27017/")
-    db = MONGO_CLIENT["kalakriti"]
-    artisan_collection = db["artisan_info"]
-    products_collection = db["products"]
-    users_collection = db["users"]
-    artisan_profiles_collection = db["artisan_profiles"]
-    orders_collection = db["orders"]
-    cart_collection = db["cart"]
-    print("✓ MongoDB connected successfully")
-except Exception as e:
-    print(f"⚠ MongoDB not available: {e}")
-    artisan_collection = None
-    products_collection = None
-    users_collection = None
-    artisan_profiles_collection = None
-    orders_collection = None
-    cart_collection = None
+# Reject inline base64 data and oversized URLs before routing (pure ASGI)
+app.add_middleware(RequestGuardMiddleware)
+
+# Request latency histograms, outermost so rejected requests are counted too
+app.add_middleware(MetricsMiddleware)
+
+# Server span per request (no-op unless TRACING_ENABLED=1)
+app.add_middleware(TracingMiddleware)
+
+# MongoDB client, pool sizes from MONGO_* settings. Opened per worker by the
+# lifespan, after uvicorn/gunicorn fork; until then every collection is None
+# and the endpoints fall back to their mock responses.
+resources = Resources(event_listeners=[MongoCommandMetrics(), MongoCommandTracer()])
+artisan_collection = None
+products_collection = None
+users_collection = None
+artisan_profiles_collection = None
+orders_collection = None
+cart_collection = None
+accounts_collection = None
+related_collection = None
+outbox_collection = None
+blobs_collection = None
+migrations_collection = None
+related_engine = None
+instagram_outbox = None
 
 UPLOAD_DIR = pathlib.Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
@@ -152,38 +181,65 @@ UPLOAD_DIR.mkdir(exist_ok=True)
 OUTPUTS_DIR = UPLOAD_DIR / "outputs"
 OUTPUTS_DIR.mkdir(exist_ok=True)
 
-# Custom static files handler with error handling for Windows path length
-class SafeStaticFiles(StaticFiles):
-    async def get_response(self, path: str, scope):
-        try:
-            # Check if the full path would be too long for Windows
-            full_path = os.path.join(self.directory, path)
-            if len(full_path) > 250:  # Windows path limit buffer
-                from fastapi.responses import JSONResponse
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "error": "Path too long",
-                        "message": "The requested file path is too long for Windows file system.",
-                        "suggestion": "Use the /upload-base64-image endpoint for large image data."
-                    }
-                )
-            return await super().get_response(path, scope)
-        except Exception as e:
-            if "path too long" in str(e).lower():
-                from fastapi.responses import JSONResponse
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "error": "Windows path length exceeded",
-                        "message": str(e),
-                        "suggestion": "Use the /upload-base64-image endpoint instead."
-                    }
-                )
-            raise
-
-# Mount static files to serve uploaded images with custom handler
-app.mount("/uploads", SafeStaticFiles(directory="uploads"), name="uploads")
+# Local disk until the lifespan picks the configured backend; STORAGE_BACKEND=s3
+# shares media between API nodes
+media_storage = LocalStorage(UPLOAD_DIR)
+blob_store = BlobStore(UPLOAD_DIR, storage=media_storage)
+image_fetcher.blob_store = blob_store
+
+def publish_stored_photo(image_path: str, caption: str, account: str = None) -> dict:
+    """Publish a poster from the blob store (fetched locally first if it lives in object storage)"""
+    return publish_photo(blob_store.local_path(image_path), caption, account)
+
+def build_stored_caption(image_path: str, product_data: dict) -> str:
+    return build_caption(blob_store.local_path(image_path), product_data)
+
+def build_stored_captions(items: list) -> list:
+    return build_captions_batch([(blob_store.local_path(path), data) for path, data in items])
+
+def bind_database(db, storage=None):
+    """Point the collections, and the services built on them, at ``db`` (None means no database)"""
+    global artisan_collection, products_collection, users_collection, artisan_profiles_collection
+    global orders_collection, cart_collection, accounts_collection, related_collection
+    global outbox_collection, blobs_collection, related_engine, instagram_outbox, media_storage, blob_store
+    global migrations_collection
+    collection = (lambda name: db[name]) if db is not None else (lambda name: None)
+    artisan_collection = collection("artisan_info")
+    products_collection = collection("products")
+    users_collection = collection("users")
+    artisan_profiles_collection = collection("artisan_profiles")
+    orders_collection = collection("orders")
+    cart_collection = collection("cart")
+    accounts_collection = collection("accounts")
+    related_collection = collection("related_products")
+    outbox_collection = collection("instagram_outbox")
+    blobs_collection = collection("blobs")
+    migrations_collection = collection("migrations")
+
+    related_engine = (
+        RelatedProductsEngine(products_collection, related_collection)
+        if products_collection is not None else None
+    )
+    instagram_outbox = (
+        InstagramOutbox(outbox_collection, publish_stored_photo, build_stored_caption,
+                        limits_collection=collection("instagram_rate_limits"),
+                        batch_caption_builder=build_stored_captions)
+        if INSTAGRAM_AVAILABLE and outbox_collection is not None else None
+    )
+    if storage is not None:
+        media_storage = storage
+    # Uploads and posters are stored once per content hash; references from these
+    # fields keep a blob alive, everything else is collected after a grace period
+    blob_store = BlobStore(UPLOAD_DIR, blobs_collection, storage=media_storage, reference_sources=[
+        (products_collection, "images", None),
+        (artisan_profiles_collection, "profile_image", None),
+        (users_collection, "profile_image", None),
+        (artisan_collection, "profile_image", None),
+        (outbox_collection, "image_path", {"status": {"$in": [OUTBOX_PENDING, OUTBOX_SENDING]}}),
+    ])
+    image_fetcher.blob_store = blob_store
+    # Logouts must reach every worker, so revoked tokens live in the database
+    bind_revocations(collection("revoked_tokens"))
 
 class Info(BaseModel):
     name: str
@@ -289,20 +345,39 @@ class UserAuth(BaseModel):
     password: str
 
 @app.post("/process-and-post")
-async def process_and_post(file: UploadFile, name: str = Form(...), location: str = Form(...)):
+async def process_and_post(file: UploadFile, name: str = Form(...), location: str = Form(...),
+                           scheduled_at: Optional[datetime] = Form(None),
+                           idempotency_key: Optional[str] = Header(None)):
     try:
-        file_path = UPLOAD_DIR / file.filename
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        try:
+            upload = await run_in_threadpool(blob_store.put_stream, file.file)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=415)
+        file_path = await run_in_threadpool(blob_store.local_path, upload["path"])
 
         artisan_info = {"name": name, "location": location}
 
         if AI_AVAILABLE:
-            # Use AI processing
-            refined_result = process_artisan_image(str(file_path), artisan_info)
+            # Use AI processing (blocking SDK calls; the poster renders in the image worker pool)
+            refined_result = await run_in_threadpool(process_artisan_image, str(file_path), artisan_info,
+                                                      original_name=file.filename)
+            poster = await run_in_threadpool(blob_store.put_file, UPLOAD_DIR / refined_result["poster"])
+            refined_result["poster"] = poster["path"]
             
-            if INSTAGRAM_AVAILABLE:
-                posted_result = post_to_instagram(refined_result["poster"], refined_result["listing"])
+            if instagram_outbox is not None:
+                # Published by the outbox scheduler under the account's rate limit
+                post = await run_in_threadpool(
+                    instagram_outbox.enqueue,
+                    str(UPLOAD_DIR / refined_result["poster"]), default_account(),
+                    product_data=refined_result["listing"], scheduled_at=scheduled_at,
+                    idempotency_key=idempotency_key
+                )
+                posted_result = {
+                    "status": "queued" if post["status"] != "posted" else "posted",
+                    "outbox_id": post["id"],
+                    "scheduled_at": post["scheduled_at"].isoformat() + "Z",
+                    "message": "Instagram post queued for publishing"
+                }
             else:
                 posted_result = {"status": "simulated", "message": "Instagram posting simulated"}
 
@@ -327,47 +402,27 @@ async def process_and_post(file: UploadFile, name: str = Form(...), location: st
                 "message": "File processed successfully (AI features in development)"
             })
     
+    except ImagePoolBusy as e:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "5"})
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
-# Base64 image handling
-class Base64ImageRequest(BaseModel):
-    image_data: str
-    filename: Optional[str] = None
-
+# Base64 / raw image upload, streamed to disk
 @app.post("/upload-base64-image")
-async def upload_base64_image(request: Base64ImageRequest):
-    """Handle base64 image upload and save to file system."""
+async def upload_base64_image(request: Request, filename: Optional[str] = None):
+    """Handle base64 or raw image upload and save to file system."""
     try:
-        import base64
-        from io import BytesIO
-        
-        # Extract base64 data (remove data:image/png;base64, prefix if present)
-        if request.image_data.startswith('data:'):
-            header, encoded = request.image_data.split(',', 1)
-        else:
-            encoded = request.image_data
-        
-        # Decode base64
-        image_data = base64.b64decode(encoded)
-        
-        # Generate filename
-        filename = request.filename or f"uploaded_{uuid.uuid4().hex[:12]}.png"
-        if not filename.endswith(('.png', '.jpg', '.jpeg')):
-            filename += '.png'
-        
-        # Save to uploads directory
-        file_path = UPLOAD_DIR / filename
-        with open(file_path, 'wb') as f:
-            f.write(image_data)
-        
+        saved = await ingest_image(request, UPLOAD_DIR, filename=filename, blob_store=blob_store)
         return JSONResponse({
             "message": "Image uploaded successfully",
-            "filename": filename,
-            "path": f"/uploads/{filename}",
-            "url": f"http://127.0.0.1:8001/uploads/{filename}"
+            "filename": saved["filename"],
+            "path": f"/uploads/{saved['filename']}",
+            "url": f"{str(request.base_url).rstrip('/')}/uploads/{saved['filename']}",
+            "size": saved["size"],
+            "content_type": saved["content_type"]
         })
-        
+    except IngestError as e:
+        return JSONResponse({"error": f"Failed to process image: {e}"}, status_code=e.status_code)
     except Exception as e:
         return JSONResponse(
             {"error": f"Failed to process base64 image: {str(e)}"}, 
@@ -399,43 +454,27 @@ async def get_image_from_data(data: str):
             status_code=400
         )
 
+async def placeholder_response(request: Request, width: Optional[int] = None,
+                               height: Optional[int] = None, text: Optional[str] = None) -> Response:
+    """Serve a cached placeholder image with validators"""
+    content, etag = await get_placeholder_async(width, height, text)
+    headers = {"ETag": etag, "Cache-Control": PLACEHOLDER_CACHE_CONTROL}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type="image/png", headers=headers)
+
 # Fix for missing product images - create fallback endpoint
 @app.get("/uploads/outputs/{filename}")
-async def get_showcase_image(filename: str):
+async def get_showcase_image(filename: str, request: Request, w: Optional[int] = None, h: Optional[int] = None):
     """Serve showcase images or provide fallback."""
     try:
         # Try to serve the actual file first
-        file_path = UPLOAD_DIR / "outputs" / filename
-        if file_path.exists():
-            from fastapi.responses import FileResponse
-            return FileResponse(file_path)
+        full_path, stat_result = lookup_media(str(OUTPUTS_DIR), filename)
+        if stat_result is not None:
+            return MediaResponse(full_path, stat_result, relative_path=f"outputs/{filename}")
         
-        # If file doesn't exist, return a fallback placeholder
-        # Create a simple placeholder image
-        from PIL import Image, ImageDraw, ImageFont
-        import io
-        
-        # Create placeholder image
-        img = Image.new('RGB', (400, 400), color='#f0f0f0')
-        draw = ImageDraw.Draw(img)
-        
-        # Add text
-        try:
-            # Try to use a default font
-            font = ImageFont.load_default()
-        except:
-            font = None
-        
-        text = "Image\nNot Found"
-        draw.text((200, 200), text, fill='#666666', font=font, anchor='mm')
-        
-        # Convert to bytes
-        img_io = io.BytesIO()
-        img.save(img_io, 'PNG')
-        img_io.seek(0)
-        
-        from fastapi.responses import Response
-        return Response(content=img_io.read(), media_type="image/png")
+        # If file doesn't exist, return a cached placeholder
+        return await placeholder_response(request, w, h)
         
     except Exception as e:
         return JSONResponse(
@@ -443,6 +482,47 @@ async def get_showcase_image(filename: str):
             status_code=404
         )
 
+@app.get("/api/placeholder/{width}/{height}")
+async def get_placeholder_image(width: int, height: int, request: Request, text: Optional[str] = None):
+    """Placeholder image of the given size, as requested by the storefront"""
+    return await placeholder_response(request, width, height, text)
+
+@app.get("/img/{path:path}")
+async def get_image_derivative(path: str, request: Request, w: int = 320, h: Optional[int] = None,
+                               fmt: str = "webp", q: int = 80):
+    """Resized copy of an upload for thumbnails and listing pages"""
+    if media_storage.remote and path.startswith("blobs/"):
+        try:
+            await run_in_threadpool(blob_store.local_path, path)
+        except StorageError:
+            return await placeholder_response(request, w, h)
+    full_path, stat_result = lookup_media(str(UPLOAD_DIR), path)
+    if stat_result is None:
+        return await placeholder_response(request, w, h)
+    try:
+        out_path, out_stat, media_type = await derivative_cache.get(full_path, stat_result, w, h, fmt, q,
+                                                                    source_relative_path=path)
+    except DerivativeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ImagePoolBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except Exception as e:
+        raise HTTPException(status_code=415, detail=f"Cannot resize image: {str(e)}")
+    # The derivative is digest-named, but it is only as stable as the upload it was cut from
+    cache_control = IMMUTABLE_CACHE_CONTROL if is_content_addressed(path) else MUTABLE_CACHE_CONTROL
+    return MediaResponse(out_path, out_stat, media_type=media_type, cache_control=cache_control)
+
+if STORAGE_BACKEND == "s3":
+    @app.get("/uploads/blobs/{path:path}")
+    def redirect_to_object_storage(path: str):
+        """Send clients straight to the bucket with a presigned URL"""
+        return RedirectResponse(media_storage.url(f"blobs/{path}"), status_code=307, headers={
+            "Cache-Control": f"private, max-age={media_storage.presign_seconds // 2}"
+        })
+
+# Mount static files to serve uploaded images (after the showcase route so its fallback wins)
+app.mount("/uploads", MediaFiles(directory=UPLOAD_DIR), name="uploads")
+
 # Pydantic model for Instagram posting request
 class InstagramPostRequest(BaseModel):
     image_url: str
@@ -498,17 +578,29 @@ async def post_to_instagram_endpoint(request: InstagramPostRequest):
             status_code=500
         )
 
+@app.get("/instagram/outbox/{post_id}")
+def get_outbox_post(post_id: str):
+    """Publishing status of a queued Instagram post"""
+    if instagram_outbox is None:
+        raise HTTPException(status_code=503, detail="Instagram service is not configured properly")
+    post = instagram_outbox.get(post_id)
+    if post is None:
+        raise HTTPException(status_code=404, detail="Post not found")
+    return post
+
 @app.post("/artisan-info")
 def save_artisan_info(info: Info) -> dict:
     try:
         if artisan_collection is not None:
             # Use upsert to update existing artisan or create new one
-            result = artisan_collection.update_one(
+            previous = artisan_collection.find_one_and_update(
                 {"artisan_id": info.artisan_id},
                 {"$set": info.dict()},
+                projection={"profile_image": 1},
                 upsert=True
             )
-            if result.upserted_id:
+            blob_store.swap_refs(previous and previous.get("profile_image"), info.dict().get("profile_image"))
+            if previous is None:
                 return {"message": "Artisan profile created successfully", "artisan_id": info.artisan_id}
             else:
                 return {"message": "Artisan profile updated successfully", "artisan_id": info.artisan_id}
@@ -555,9 +647,99 @@ def health_check():
         "version": "1.0.0"
     }
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(content=render_latest(), media_type=METRICS_CONTENT_TYPE)
+
+# Admin diagnostics (require the X-Admin-Token header)
+@app.get("/admin/profiler/profile", dependencies=[Depends(require_admin)])
+async def profile_worker(seconds: float = 10, interval_ms: float = 5, format: str = "speedscope", idle: bool = False):
+    """Sample every thread of this worker for N seconds"""
+    try:
+        interval = max(interval_ms, 1) / 1000
+        samples = await asyncio.to_thread(sample_profile, seconds, interval, idle)
+        if format == "collapsed":
+            return Response(content=to_collapsed(samples), media_type="text/plain")
+        return JSONResponse(to_speedscope(samples, interval, name=f"worker-{os.getpid()}"))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/admin/profiler/loop-lag", dependencies=[Depends(require_admin)])
+async def loop_lag_report():
+    """Event-loop stalls seen by the watchdog, with the blocking stacks"""
+    return loop_lag_monitor.report()
+
+@app.get("/admin/blobs", dependencies=[Depends(require_admin)])
+def blob_stats():
+    """Blob store size and unreferenced count"""
+    try:
+        return blob_store.stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/admin/blobs/gc", dependencies=[Depends(require_admin)])
+async def blob_gc(dry_run: bool = False):
+    """Reconcile blob refcounts and delete unreferenced blobs now"""
+    try:
+        return await asyncio.to_thread(blob_store.collect, dry_run)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/admin/related/rebuild", dependencies=[Depends(require_admin)])
+async def related_rebuild():
+    """Recompute every related-products list, e.g. after a bulk import"""
+    if related_engine is None:
+        raise HTTPException(status_code=503, detail="Related products are not available")
+    try:
+        return {"products": await asyncio.to_thread(related_engine.rebuild)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/admin/profiler/tracemalloc/start", dependencies=[Depends(require_admin)])
+def tracemalloc_start(frames: int = 10):
+    """Start tracing allocations and take the baseline snapshot"""
+    return tracemalloc_session.start(max(1, min(frames, 50)))
+
+@app.get("/admin/profiler/tracemalloc/diff", dependencies=[Depends(require_admin)])
+def tracemalloc_diff(limit: int = 25, group_by: str = "lineno"):
+    """Allocation growth since the previous snapshot"""
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    try:
+        return tracemalloc_session.diff(limit, group_by)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/admin/profiler/tracemalloc/stop", dependencies=[Depends(require_admin)])
+def tracemalloc_stop():
+    """Stop tracing allocations"""
+    return tracemalloc_session.stop()
+
 # Product CRUD endpoints
+def refresh_product_indexes(product_dict: dict):
+    """Refresh derived product indexes after a write (runs after the response)"""
+    if VISUAL_SEARCH_AVAILABLE:
+        if media_storage.remote:
+            # Pull images from object storage into the local cache the indexer reads
+            for image_ref in product_dict.get("images") or []:
+                try:
+                    blob_store.local_path(image_ref)
+                except StorageError as e:
+                    print(f"⚠ Image not in object storage: {e}")
+        visual_search.index_product(product_dict, UPLOAD_DIR)
+    if related_engine is not None:
+        related_engine.refresh(product_dict)
+
+def remove_product_indexes(product_id: str):
+    """Drop a deleted product from derived indexes"""
+    if VISUAL_SEARCH_AVAILABLE:
+        visual_search.visual_index.remove(product_id)
+    if related_engine is not None:
+        related_engine.remove(product_id)
+
 @app.post("/products")
-def create_product(product: Product):
+def create_product(product: Product, background_tasks: BackgroundTasks):
     try:
         product_dict = product.dict()
         product_dict["id"] = str(uuid.uuid4())
@@ -565,6 +747,8 @@ def create_product(product: Product):
         product_dict["updated_at"] = datetime.now().isoformat()
         
         products_collection.insert_one(product_dict)
+        blob_store.retain(product_dict["images"])
+        background_tasks.add_task(bind_context(refresh_product_indexes), product_dict)
         return {"message": "Product created successfully", "product_id": product_dict["id"]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -594,18 +778,22 @@ def get_product(product_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/products/{product_id}")
-def update_product(product_id: str, product: Product):
+def update_product(product_id: str, product: Product, background_tasks: BackgroundTasks):
     try:
         product_dict = product.dict()
         product_dict["updated_at"] = datetime.now().isoformat()
         
-        result = products_collection.update_one(
+        previous = products_collection.find_one_and_update(
             {"id": product_id}, 
-            {"$set": product_dict}
+            {"$set": product_dict},
+            projection={"images": 1}
         )
         
-        if result.matched_count == 0:
+        if previous is None:
             raise HTTPException(status_code=404, detail="Product not found")
+        
+        blob_store.swap_refs(previous.get("images"), product_dict["images"])
+        background_tasks.add_task(bind_context(refresh_product_indexes), {**product_dict, "id": product_id})
             
         return {"message": "Product updated successfully"}
     except HTTPException:
@@ -614,12 +802,15 @@ def update_product(product_id: str, product: Product):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/products/{product_id}")
-def delete_product(product_id: str):
+def delete_product(product_id: str, background_tasks: BackgroundTasks):
     try:
-        result = products_collection.delete_one({"id": product_id})
+        deleted = products_collection.find_one_and_delete({"id": product_id}, projection={"images": 1})
         
-        if result.deleted_count == 0:
+        if deleted is None:
             raise HTTPException(status_code=404, detail="Product not found")
+        
+        blob_store.release(deleted.get("images"))
+        background_tasks.add_task(bind_context(remove_product_indexes), product_id)
             
         return {"message": "Product deleted successfully"}
     except HTTPException:
@@ -627,43 +818,6 @@ def delete_product(product_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# Endpoint to handle base64 image data without URL length issues
-@app.post("/upload-base64-image")
-async def upload_base64_image(request: Request):
-    """
-    Handle base64 image uploads to avoid URL length issues.
-    Accepts JSON with base64 image data and saves it as a file.
-    """
-    try:
-        data = await request.json()
-        base64_data = data.get("image_data")
-        filename = data.get("filename", f"image_{uuid.uuid4().hex[:8]}.png")
-        
-        if not base64_data:
-            raise HTTPException(status_code=400, detail="No image data provided")
-        
-        # Remove data URL prefix if present
-        if base64_data.startswith("data:image"):
-            base64_data = base64_data.split(",")[1]
-        
-        import base64
-        # Decode base64 data
-        image_data = base64.b64decode(base64_data)
-        
-        # Save to uploads directory
-        file_path = UPLOAD_DIR / filename
-        with open(file_path, "wb") as f:
-            f.write(image_data)
-        
-        # Return the file URL
-        return {
-            "message": "Image uploaded successfully",
-            "filename": filename,
-            "url": f"/uploads/{filename}"
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
-
 # Endpoint to serve images from base64 data URLs (temporary solution)
 @app.get("/image-from-data")
 async def serve_image_from_data(data: str = None):
@@ -720,17 +874,6 @@ class Order(BaseModel):
     total_amount: float
     status: Optional[str] = "pending"
 
-# Initialize user collections
-try:
-    users_collection = db["users"]
-    orders_collection = db["orders"]
-    cart_collection = db["cart"]
-    print("✓ User collections initialized")
-except:
-    users_collection = None
-    orders_collection = None
-    cart_collection = None
-
 # User-side product endpoints
 @app.get("/api/user/products/featured")
 async def get_featured_products():
@@ -862,6 +1005,63 @@ async def get_all_products(page: int = 1, limit: int = 20):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/user/products/filter")
+def filter_user_products(
+    category: Optional[str] = None,
+    tags: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    in_stock: bool = False,
+    sort_by: str = "relevance",
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=100)
+):
+    """Filter products and return facet counts for the sidebar"""
+    try:
+        tag_list = [t.strip() for t in tags.split(",") if t.strip()] if tags else []
+        
+        if products_collection is not None:
+            query = build_filter_query(category, tag_list, min_price, max_price, in_stock)
+            result = filter_products(products_collection, query, sort_by, page, limit)
+            return {"success": True, **result}
+        else:
+            # Mock catalog filtered in memory
+            mock_products = [
+                {
+                    "id": f"prod_{i}",
+                    "title": f"Product {i}",
+                    "price": 500 + (i * 250),
+                    "category": ["Pottery", "Textiles", "Jewelry"][i % 3],
+                    "tags": ["handmade", ["traditional", "eco-friendly", "gift-worthy"][i % 3]],
+                    "images": [f"/uploads/prod_{i}.jpg"],
+                    "stock": i % 4
+                } for i in range(1, 41)
+            ]
+            def mock_matches(ignore=None):
+                return [
+                    p for p in mock_products
+                    if (ignore == "category" or not category or p["category"] == category)
+                    and all(t in p["tags"] for t in tag_list)
+                    and (ignore == "price" or min_price is None or p["price"] >= min_price)
+                    and (ignore == "price" or max_price is None or p["price"] <= max_price)
+                    and (not in_stock or p["stock"] > 0)
+                ]
+            matches = mock_matches()
+            # Single-choice facets are counted without their own filter, as in the aggregation
+            facets = count_facets(matches)
+            for facet, field in EXCLUSIVE_FACETS.items():
+                facets[facet] = count_facets(mock_matches(field))[facet]
+            skip = (page - 1) * limit
+            return {
+                "success": True,
+                "data": matches[skip:skip + limit],
+                "total": len(matches),
+                "hasMore": skip + limit < len(matches),
+                "facets": facets
+            }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/user/products/{product_id}")
 async def get_user_product(product_id: str):
     """Get single product details for user"""
@@ -951,25 +1151,40 @@ async def search_products(q: str, page: int = 1, limit: int = 20):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/user/search/visual")
-async def visual_search(file: UploadFile):
+async def visual_search_products(file: UploadFile, limit: int = Query(20, ge=1, le=100)):
     """AI-powered visual search"""
     try:
-        # Save uploaded image
-        file_path = UPLOAD_DIR / f"search_{uuid.uuid4().hex[:8]}_{file.filename}"
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Mock AI processing for visual search
-        extracted_tags = ["traditional", "handwoven", "geometric pattern", "blue pottery", "cotton fabric"]
-        
-        # Simulate finding similar products
-        if products_collection is not None:
-            # Find products with similar tags
-            similar_products = list(products_collection.find(
-                {"tags": {"$in": extracted_tags}, "status": "active"}, 
-                {"_id": 0}
-            ).limit(20))
+        if products_collection is not None and VISUAL_SEARCH_AVAILABLE:
+            # Embed the query image straight from the upload, nothing is written to disk
+            try:
+                query = await run_in_threadpool(visual_search.compute_embedding, file.file)
+            except (OSError, ValueError, Image.DecompressionBombError):
+                raise HTTPException(status_code=400, detail="Uploaded file is not a readable image")
+            # Inactive products stay in the index, so over-fetch until enough active hits remain
+            k = limit * 2
+            while True:
+                matches = await run_in_threadpool(visual_search.visual_index.search, query, k)
+                scores = dict(matches)
+                similar_products = list(products_collection.find(
+                    {"id": {"$in": list(scores)}, "status": "active"},
+                    {"_id": 0}
+                ))
+                if len(similar_products) >= limit or len(matches) < k:
+                    break
+                k *= 4
+            for product in similar_products:
+                product["similarity_score"] = round(scores[product["id"]], 4)
+            similar_products.sort(key=lambda p: p["similarity_score"], reverse=True)
+            similar_products = similar_products[:limit]
+            
+            # Tags shared by the closest matches describe what the image looks like
+            tag_counts = {}
+            for product in similar_products[:5]:
+                for tag in product.get("tags", []):
+                    tag_counts[tag] = tag_counts.get(tag, 0) + 1
+            extracted_tags = sorted(tag_counts, key=tag_counts.get, reverse=True)[:5]
         else:
+            extracted_tags = ["traditional", "handwoven", "geometric pattern", "blue pottery", "cotton fabric"]
             # Mock similar products
             similar_products = [
                 {
@@ -983,12 +1198,6 @@ async def visual_search(file: UploadFile):
                 } for i in range(1, 21)
             ]
         
-        # Clean up uploaded file
-        try:
-            os.unlink(file_path)
-        except:
-            pass
-        
         return {
             "success": True, 
             "data": similar_products,
@@ -996,6 +1205,8 @@ async def visual_search(file: UploadFile):
             "total": len(similar_products),
             "hasMore": False
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1031,25 +1242,12 @@ async def get_user_artisan(artisan_id: str):
 async def get_related_products(product_id: str):
     """Get products related to the given product"""
     try:
-        if products_collection is not None:
-            # Get the original product to find similar ones
-            original = products_collection.find_one({"id": product_id}, {"_id": 0})
-            if not original:
+        if related_engine is not None:
+            # Precomputed, ranked neighbours: one indexed read
+            related = related_engine.get(product_id, limit=8)
+            if related is None:
                 return {"success": False, "message": "Product not found"}
             
-            # Find related products (same artisan or similar tags)
-            related = list(products_collection.find(
-                {
-                    "$or": [
-                        {"artisan_id": original.get("artisan_id")},
-                        {"tags": {"$in": original.get("tags", [])}}
-                    ],
-                    "id": {"$ne": product_id},
-                    "status": "active"
-                }, 
-                {"_id": 0}
-            ).limit(8))
-            
             return {"success": True, "data": related}
         else:
             # Mock related products
@@ -1072,47 +1270,30 @@ async def get_related_products(product_id: str):
 async def user_login(credentials: UserLogin):
     """User login endpoint with database authentication"""
     try:
-        user = None
-        user_type = "user"
-        
-        # Check in users collection first
-        if users_collection is not None:
-            user = users_collection.find_one({"email": credentials.email}, {"_id": 0})
-        
-        # If not found, check in artisan profiles
-        if not user and artisan_profiles_collection is not None:
-            user = artisan_profiles_collection.find_one({"email": credentials.email}, {"_id": 0})
-            user_type = "artisan"
+        account = None
+        if accounts_collection is not None:
+            account = find_account(
+                accounts_collection, credentials.email,
+                users_collection, artisan_profiles_collection
+            )
         
-        # Verify password if user found
-        if user and "password" in user:
-            if verify_password(credentials.password, user["password"]):
-                # Update last login
-                login_time = datetime.now().isoformat()
-                if user_type == "user" and users_collection is not None:
-                    users_collection.update_one(
-                        {"email": credentials.email},
-                        {"$set": {"last_login": login_time}}
-                    )
-                elif user_type == "artisan" and artisan_profiles_collection is not None:
-                    artisan_profiles_collection.update_one(
-                        {"email": credentials.email},
-                        {"$set": {"last_login": login_time}}
-                    )
-                
-                # Remove password from response
-                user.pop("password", None)
+        # Verify password if account found
+        if account:
+            if verify_password(credentials.password, account["password"]):
+                # Update last login and fetch the profile in one round-trip
+                user = touch_login(account, users_collection, artisan_profiles_collection) or {}
+                user_type = account["user_type"]
                 
                 return {
                     "success": True,
                     "data": {
-                        "user_id": user.get("user_id") or user.get("artisan_id"),
+                        "user_id": account["account_id"],
                         "name": user.get("full_name"),
-                        "email": user.get("email"),
-                        "username": user.get("username"),
+                        "email": account["email"],
+                        "username": account["username"],
                         "user_type": user_type,
                         "profile": user,
-                        "token": f"jwt_token_{user.get('user_id', user.get('artisan_id', ''))[:8]}"
+                        "token": issue_token(account["account_id"], user_type)
                     },
                     "message": "Login successful"
                 }
@@ -1129,7 +1310,7 @@ async def user_login(credentials: UserLogin):
                         "email": credentials.email,
                         "username": "johndoe",
                         "user_type": "user",
-                        "token": "mock_jwt_token"
+                        "token": issue_token("user_123", "user")
                     },
                     "message": "Login successful (mock)"
                 }
@@ -1154,53 +1335,56 @@ async def user_register(user_data: UserRegistration):
         if len(user_data.password) < 6:
             raise HTTPException(status_code=400, detail="Password must be at least 6 characters")
         
-        # Check if user already exists
-        if users_collection is not None:
-            existing_user = users_collection.find_one({"email": user_data.email})
-            if existing_user:
-                raise HTTPException(status_code=400, detail="User already exists")
-            
-            existing_username = users_collection.find_one({"username": user_data.username})
-            if existing_username:
-                raise HTTPException(status_code=400, detail="Username already taken")
-        
         # Hash password
         hashed_password = hash_password(user_data.password)
         
         # Create user ID
         user_id = str(uuid.uuid4())
+        user_type = "artisan" if user_data.user_type == "artisan" else "user"
+        
+        # Reserve email and username; the unique indexes reject duplicates
+        if accounts_collection is not None:
+            try:
+                create_account(
+                    accounts_collection, user_id, user_data.email,
+                    user_data.username, hashed_password, user_type
+                )
+            except AccountExistsError as e:
+                if e.field == "username":
+                    raise HTTPException(status_code=400, detail="Username already taken")
+                raise HTTPException(status_code=400, detail="User already exists")
         
         # Create profile based on user type
-        if user_data.user_type == "artisan":
-            # Create artisan profile
-            artisan_profile = ArtisanProfile(
-                artisan_id=user_id,
-                email=user_data.email,
-                username=user_data.username,
-                full_name=user_data.full_name,
-                phone=user_data.phone
-            )
-            
-            profile_dict = artisan_profile.dict()
-            profile_dict["password"] = hashed_password
-            
-            if artisan_profiles_collection is not None:
-                artisan_profiles_collection.insert_one(profile_dict)
-        else:
-            # Create regular user profile
-            user_profile = UserProfile(
-                user_id=user_id,
-                email=user_data.email,
-                username=user_data.username,
-                full_name=user_data.full_name,
-                phone=user_data.phone
-            )
-            
-            profile_dict = user_profile.dict()
-            profile_dict["password"] = hashed_password
-            
-            if users_collection is not None:
-                users_collection.insert_one(profile_dict)
+        try:
+            if user_type == "artisan":
+                # Create artisan profile
+                artisan_profile = ArtisanProfile(
+                    artisan_id=user_id,
+                    email=user_data.email,
+                    username=user_data.username,
+                    full_name=user_data.full_name,
+                    phone=user_data.phone
+                )
+                
+                if artisan_profiles_collection is not None:
+                    artisan_profiles_collection.insert_one(artisan_profile.dict())
+            else:
+                # Create regular user profile
+                user_profile = UserProfile(
+                    user_id=user_id,
+                    email=user_data.email,
+                    username=user_data.username,
+                    full_name=user_data.full_name,
+                    phone=user_data.phone
+                )
+                
+                if users_collection is not None:
+                    users_collection.insert_one(user_profile.dict())
+        except Exception:
+            # Release the reserved email/username so the user can retry
+            if accounts_collection is not None:
+                accounts_collection.delete_one({"account_id": user_id})
+            raise
         
         return {
             "success": True,
@@ -1210,7 +1394,7 @@ async def user_register(user_data: UserRegistration):
                 "email": user_data.email,
                 "username": user_data.username,
                 "user_type": user_data.user_type,
-                "token": f"mock_jwt_token_{user_id[:8]}"
+                "token": issue_token(user_id, user_type)
             },
             "message": f"{user_data.user_type.title()} registered successfully"
         }
@@ -1219,6 +1403,27 @@ async def user_register(user_data: UserRegistration):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/user/auth/logout")
+async def user_logout(authorization: Optional[str] = Header(None)):
+    """Revoke the caller's session token"""
+    try:
+        await run_in_threadpool(revoke_token, _bearer_token(authorization))
+    except InvalidToken as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    return {"success": True, "message": "Logged out successfully"}
+
+@app.get("/api/user/auth/me")
+async def get_session(current_user: dict = Depends(get_current_user)):
+    """Return the identity carried by the caller's session token"""
+    return {
+        "success": True,
+        "data": {
+            "user_id": current_user["user_id"],
+            "user_type": current_user["user_type"],
+            "expires_at": current_user["exp"]
+        }
+    }
+
 # Profile Management Endpoints
 
 @app.get("/api/user/profile/{user_id}")
@@ -1255,12 +1460,29 @@ async def update_user_profile(user_id: str, profile_data: UserProfile):
         profile_data.updated_at = datetime.now().isoformat()
         
         if users_collection is not None:
-            result = users_collection.update_one(
-                {"user_id": user_id},
-                {"$set": profile_data.dict(exclude_unset=True)}
-            )
-            if result.matched_count == 0:
+            changes = profile_data.dict(exclude_unset=True)
+            if users_collection.find_one({"user_id": user_id}, {"_id": 1}) is None:
                 raise HTTPException(status_code=404, detail="User not found")
+            # Email/username are login keys: claim them in the accounts index first
+            try:
+                old_identity = change_identity(accounts_collection, user_id, changes.get("email"), changes.get("username"))
+            except AccountExistsError as e:
+                raise HTTPException(status_code=409, detail=str(e))
+            try:
+                previous = users_collection.find_one_and_update(
+                    {"user_id": user_id},
+                    {"$set": changes},
+                    projection={"profile_image": 1}
+                )
+            except Exception:
+                # Give the old email/username back so the index matches the profile
+                restore_identity(accounts_collection, user_id, old_identity)
+                raise
+            if previous is None:
+                restore_identity(accounts_collection, user_id, old_identity)
+                raise HTTPException(status_code=404, detail="User not found")
+            if "profile_image" in changes:
+                blob_store.swap_refs(previous.get("profile_image"), changes["profile_image"])
         
         return {
             "success": True,
@@ -1313,12 +1535,29 @@ async def update_artisan_profile(artisan_id: str, profile_data: ArtisanProfile):
         profile_data.updated_at = datetime.now().isoformat()
         
         if artisan_profiles_collection is not None:
-            result = artisan_profiles_collection.update_one(
-                {"artisan_id": artisan_id},
-                {"$set": profile_data.dict(exclude_unset=True)}
-            )
-            if result.matched_count == 0:
+            changes = profile_data.dict(exclude_unset=True)
+            if artisan_profiles_collection.find_one({"artisan_id": artisan_id}, {"_id": 1}) is None:
+                raise HTTPException(status_code=404, detail="Artisan not found")
+            # Email/username are login keys: claim them in the accounts index first
+            try:
+                old_identity = change_identity(accounts_collection, artisan_id, changes.get("email"), changes.get("username"))
+            except AccountExistsError as e:
+                raise HTTPException(status_code=409, detail=str(e))
+            try:
+                previous = artisan_profiles_collection.find_one_and_update(
+                    {"artisan_id": artisan_id},
+                    {"$set": changes},
+                    projection={"profile_image": 1}
+                )
+            except Exception:
+                # Give the old email/username back so the index matches the profile
+                restore_identity(accounts_collection, artisan_id, old_identity)
+                raise
+            if previous is None:
+                restore_identity(accounts_collection, artisan_id, old_identity)
                 raise HTTPException(status_code=404, detail="Artisan not found")
+            if "profile_image" in changes:
+                blob_store.swap_refs(previous.get("profile_image"), changes["profile_image"])
         
         return {
             "success": True,
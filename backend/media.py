@@ -0,0 +1,258 @@
+# Media serving for /uploads with strong ETags, conditional requests, byte
+# ranges and zero-copy sendfile. Blob store files (blobs/ab/cd/<sha256>.ext)
+# never change once written, so they are served as immutable for a year with
+# their digest as the ETag; every other upload can be overwritten in place.
+import hashlib
+import os
+import stat
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from mimetypes import guess_type
+from typing import Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response
+
+from blob_store import BLOB_REFERENCE
+
+CHUNK_SIZE = 256 * 1024
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MUTABLE_CACHE_CONTROL = "public, max-age=300, must-revalidate"
+
+# If set (e.g. "/_protected_uploads/"), nginx serves the bytes via X-Accel-Redirect
+ACCEL_REDIRECT_PREFIX = os.getenv("MEDIA_ACCEL_REDIRECT_PREFIX")
+
+_etag_cache = OrderedDict()
+_etag_lock = threading.Lock()
+ETAG_CACHE_SIZE = 8192
+
+
+def _blob_digest(relative_path: str) -> Optional[str]:
+    match = BLOB_REFERENCE.fullmatch(relative_path.replace(os.sep, "/").lstrip("/"))
+    return match.group(1) if match else None
+
+
+def is_content_addressed(relative_path: str) -> bool:
+    """True for a path (relative to uploads/) inside the blob store, whose bytes never change."""
+    return _blob_digest(relative_path) is not None
+
+
+def _hash_file(full_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(full_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+def compute_etag(full_path: str, stat_result: os.stat_result, relative_path: str = "") -> str:
+    """Strong ETag for a file, hashed once per (path, size, mtime) version.
+
+    Blobs (``relative_path`` under the blob store) use their digest instead.
+    """
+    digest = _blob_digest(relative_path)
+    if digest:
+        return f'"{digest}"'
+
+    key = (full_path, stat_result.st_size, stat_result.st_mtime_ns)
+    with _etag_lock:
+        etag = _etag_cache.get(key)
+        if etag is not None:
+            _etag_cache.move_to_end(key)
+            return etag
+
+    etag = f'"{_hash_file(full_path)}"'
+    with _etag_lock:
+        _etag_cache[key] = etag
+        while len(_etag_cache) > ETAG_CACHE_SIZE:
+            _etag_cache.popitem(last=False)
+    return etag
+
+
+def parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single ``bytes=`` range into an inclusive (start, end) pair.
+
+    Returns None when the header should be ignored and raises ValueError when
+    the range cannot be satisfied.
+    """
+    units, _, spec = range_header.partition("=")
+    if units.strip().lower() != "bytes" or "," in spec:
+        # Multi-range requests are rare for images, just send the whole file
+        return None
+    start_s, _, end_s = spec.strip().partition("-")
+    try:
+        if start_s == "":
+            length = int(end_s)
+            if length <= 0:
+                raise ValueError("Empty suffix range")
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(start_s)
+            end = int(end_s) if end_s else size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+class MediaResponse(Response):
+    """File response with validators, range support and optional offload."""
+
+    def __init__(self, full_path: str, stat_result: os.stat_result, relative_path: str = "",
+                 media_type: Optional[str] = None, cache_control: Optional[str] = None):
+        self.full_path = full_path
+        self.stat_result = stat_result
+        self.relative_path = relative_path
+        self.status_code = 200
+        self.background = None
+        self.media_type = media_type or guess_type(full_path)[0] or "application/octet-stream"
+        if cache_control is None:
+            cache_control = IMMUTABLE_CACHE_CONTROL if is_content_addressed(relative_path) else MUTABLE_CACHE_CONTROL
+        self.cache_control = cache_control
+        self.init_headers({})
+
+    async def __call__(self, scope, receive, send) -> None:
+        request_headers = Headers(scope=scope)
+        size = self.stat_result.st_size
+        etag = await anyio.to_thread.run_sync(compute_etag, self.full_path, self.stat_result, self.relative_path)
+        last_modified = formatdate(self.stat_result.st_mtime, usegmt=True)
+
+        headers = {
+            "etag": etag,
+            "last-modified": last_modified,
+            "cache-control": self.cache_control,
+            "accept-ranges": "bytes",
+            "content-type": self.media_type,
+        }
+
+        if self._not_modified(request_headers, etag):
+            await self._send_head(send, 304, headers)
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        status_code, start, end = 200, 0, size - 1
+        range_header = request_headers.get("range")
+        if range_header and size and request_headers.get("if-range", etag) == etag:
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                headers.pop("content-type")
+                headers["content-range"] = f"bytes */{size}"
+                headers["content-length"] = "0"
+                await self._send_head(send, 416, headers)
+                await send({"type": "http.response.body", "body": b""})
+                return
+            if byte_range:
+                status_code, (start, end) = 206, byte_range
+                headers["content-range"] = f"bytes {start}-{end}/{size}"
+
+        count = max(end - start + 1, 0)
+        headers["content-length"] = str(count)
+
+        if ACCEL_REDIRECT_PREFIX and self.relative_path:
+            # nginx honours Range/conditional headers itself on the internal redirect
+            headers.pop("content-length")
+            headers.pop("content-range", None)
+            headers["x-accel-redirect"] = ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + self.relative_path.lstrip("/")
+            await self._send_head(send, 200, headers)
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        await self._send_head(send, status_code, headers)
+        if scope["method"] == "HEAD" or count == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.full_path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f.fileno(),
+                    "offset": start,
+                    "count": count,
+                    "more_body": False,
+                })
+            return
+
+        async with await anyio.open_file(self.full_path, mode="rb") as f:
+            await f.seek(start)
+            remaining = count
+            while remaining > 0:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # File shrank underneath us; close the body anyway
+            await send({"type": "http.response.body", "body": b""})
+
+    def _not_modified(self, request_headers: Headers, etag: str) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(self.stat_result.st_mtime) <= since
+        return False
+
+    async def _send_head(self, send, status_code: int, headers: dict) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()],
+        })
+
+
+def lookup_media(directory: str, path: str) -> Tuple[str, Optional[os.stat_result]]:
+    """Resolve ``path`` inside ``directory`` with a single stat call."""
+    directory = os.path.realpath(directory)
+    full_path = os.path.realpath(os.path.join(directory, path.lstrip("/")))
+    if os.path.commonpath([full_path, directory]) != directory:
+        return "", None
+    try:
+        stat_result = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        return "", None
+    except OSError:
+        # e.g. ENAMETOOLONG for paths past the OS limit
+        return "", None
+    if not stat.S_ISREG(stat_result.st_mode):
+        return "", None
+    return full_path, stat_result
+
+
+class MediaFiles:
+    """ASGI app serving a directory of uploaded media through MediaResponse."""
+
+    def __init__(self, directory: str):
+        self.directory = str(directory)
+
+    async def __call__(self, scope, receive, send) -> None:
+        assert scope["type"] == "http"
+        if scope["method"] not in ("GET", "HEAD"):
+            response = JSONResponse({"error": "Method not allowed"}, status_code=405,
+                                    headers={"allow": "GET, HEAD"})
+            await response(scope, receive, send)
+            return
+
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path + "/"):
+            path = path[len(root_path):]
+
+        full_path, stat_result = await anyio.to_thread.run_sync(lookup_media, self.directory, path)
+        if stat_result is None:
+            response = JSONResponse({"error": "File not found"}, status_code=404)
+        else:
+            response = MediaResponse(full_path, stat_result, relative_path=path)
+        await response(scope, receive, send)
@@ -0,0 +1,289 @@
+# Lightweight Prometheus-style metrics. Counters and histograms live in a
+# process-local registry and are rendered in the text exposition format on
+# /metrics. Recording is a dict lookup plus a bisect under a lock; with
+# METRICS_ENABLED=0 the decorators return the original function untouched
+# and every observation is a no-op. Stages timed here are also tracing spans.
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+from pymongo import monitoring
+
+from tracing import start_span, tracer
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Seconds; stretched at the top for the slow AI calls (Gemini, BLIP, Instagram)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_number(value)}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return sum(series[:-1]) if series else 0
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = f'le="{_format_number(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_number(series[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "kalakriti_http_request_duration_seconds", "HTTP request latency by handler",
+    ("method", "handler", "status")))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "kalakriti_stage_duration_seconds", "Pipeline stage latency (vision, LLM, poster, Instagram)",
+    ("stage", "outcome")))
+FALLBACKS = REGISTRY.register(Counter(
+    "kalakriti_ai_fallbacks", "Times an AI call fell back to a local template or heuristic",
+    ("kind",)))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    "kalakriti_mongo_command_duration_seconds", "MongoDB command latency",
+    ("command", "collection", "outcome"), buckets=DB_BUCKETS))
+IMAGE_POOL_PENDING = REGISTRY.register(Gauge(
+    "kalakriti_image_pool_pending", "Image worker tasks submitted and not yet finished"))
+IMAGE_POOL_TASK_SECONDS = REGISTRY.register(Histogram(
+    "kalakriti_image_pool_task_duration_seconds", "Image worker task latency including queueing",
+    ("task", "outcome")))
+IMAGE_POOL_REJECTED = REGISTRY.register(Counter(
+    "kalakriti_image_pool_rejected", "Image worker tasks refused because the queue was full",
+    ("task",)))
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Time a block as a pipeline stage; exceptions are recorded as outcome=error.
+
+    The stage is also opened as a tracing span, so one decorator covers both.
+    """
+    with start_span(stage):
+        if not METRICS_ENABLED:
+            yield
+            return
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage, outcome=outcome)
+
+
+def timed(stage: Optional[str] = None):
+    """Decorator form of :func:`stage_timer`; defaults the stage to the function name."""
+    def decorator(func):
+        if not METRICS_ENABLED and not tracer.enabled:
+            return func
+        name = stage or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_fallback(kind: str) -> None:
+    FALLBACKS.inc(kind=kind)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener feeding :data:`DB_QUERY_SECONDS`."""
+
+    def __init__(self):
+        self._collections: Dict[int, str] = {}
+
+    def started(self, event):
+        # The collection name is the value of the command's first key
+        collection = event.command.get(event.command_name)
+        self._collections[event.request_id] = collection if isinstance(collection, str) else ""
+
+    def _finish(self, event, outcome: str):
+        collection = self._collections.pop(event.request_id, "")
+        DB_QUERY_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name,
+                                 collection=collection, outcome=outcome)
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording request latency per route handler."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched endpoint in scope; using its name keeps
+            # label cardinality bounded regardless of path parameters
+            endpoint = scope.get("endpoint")
+            if endpoint is None:
+                handler = "unmatched"
+            else:
+                handler = getattr(endpoint, "__name__", type(endpoint).__name__)
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope["method"],
+                                    handler=handler, status=str(status["code"]))
+
+
+def render_latest() -> str:
+    return REGISTRY.render()
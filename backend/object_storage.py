@@ -0,0 +1,238 @@
+# Object storage for media. The blob store writes through a storage backend
+# instead of straight to uploads/, so several API nodes can share one bucket:
+#   - LocalStorage keeps objects under uploads/ (single node, the default)
+#   - S3Storage keeps them in any S3-compatible bucket (AWS, MinIO, or a moto
+#     server for tests) and serves them to clients through presigned URLs
+# Both expose local_path(key) for the code that needs a real file (Pillow,
+# BLIP, instagrapi); S3Storage answers it from a read-through cache under
+# uploads/ with the same key layout, so hot objects are downloaded once per
+# node and the rest of the app finds them where it always has.
+import os
+import pathlib
+import threading
+import uuid
+from typing import Iterator, Optional, Tuple
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+    BOTO3_AVAILABLE = True
+except ImportError as e:
+    print(f"⚠ boto3 not available, S3 storage disabled: {e}")
+    BOTO3_AVAILABLE = False
+
+UPLOAD_DIR = pathlib.Path("uploads")
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION") or None
+S3_PREFIX = os.getenv("S3_PREFIX", "")
+S3_PRESIGN_SECONDS = int(os.getenv("S3_PRESIGN_SECONDS", "3600"))
+S3_MAX_CONNECTIONS = int(os.getenv("S3_MAX_CONNECTIONS", "32"))
+MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+MULTIPART_CHUNK_SIZE = int(os.getenv("S3_MULTIPART_CHUNK_SIZE", str(8 * 1024 * 1024)))
+CACHE_MAX_BYTES = int(os.getenv("STORAGE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+
+class StorageError(Exception):
+    pass
+
+
+class LocalStorage:
+    """Objects are plain files under ``root``; URLs go through the /uploads mount."""
+
+    remote = False
+
+    def __init__(self, root: pathlib.Path = UPLOAD_DIR, base_url: str = "/uploads"):
+        self.root = pathlib.Path(root)
+        self.base_url = base_url.rstrip("/")
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.root / key
+
+    def put_file(self, key: str, src_path, content_type: Optional[str] = None) -> None:
+        """Move ``src_path`` to ``key`` (the source is consumed)."""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(src_path, path)
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).is_file()
+
+    def discard_duplicate(self, key: str, src_path) -> None:
+        """``src_path`` has the same content as ``key``, which is already stored."""
+        path = self._path(key)
+        if not path.samefile(src_path):
+            os.remove(src_path)
+        os.utime(path)
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    def local_path(self, key: str) -> pathlib.Path:
+        path = self._path(key)
+        if not path.is_file():
+            raise StorageError(f"No such object: {key}")
+        return path
+
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+    def list(self, prefix: str) -> Iterator[Tuple[str, int, float]]:
+        """(key, size, mtime) of every object under ``prefix``."""
+        base = self._path(prefix)
+        if not base.exists():
+            return
+        for dirpath, _, filenames in os.walk(base):
+            for name in filenames:
+                if name.endswith(".tmp"):
+                    continue
+                path = pathlib.Path(dirpath) / name
+                stat = path.stat()
+                yield path.relative_to(self.root).as_posix(), stat.st_size, stat.st_mtime
+
+
+class S3Storage:
+    """Objects live in an S3-compatible bucket; ``cache_dir`` holds a local
+    read-through copy of recently used ones, capped at ``cache_max_bytes``.
+    """
+
+    remote = True
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+                 region: Optional[str] = S3_REGION, prefix: str = S3_PREFIX,
+                 cache_dir: pathlib.Path = UPLOAD_DIR, cache_max_bytes: int = CACHE_MAX_BYTES,
+                 presign_seconds: int = S3_PRESIGN_SECONDS, client=None):
+        if not bucket:
+            raise StorageError("S3_BUCKET is required for S3 storage")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.cache_max_bytes = cache_max_bytes
+        self.presign_seconds = presign_seconds
+        # One client per process: it is thread-safe and pools its connections
+        self.client = client or boto3.client(
+            "s3", endpoint_url=endpoint_url, region_name=region,
+            config=BotoConfig(max_pool_connections=S3_MAX_CONNECTIONS, retries={"mode": "standard"}),
+        )
+        # Large files go up and down as parallel multipart / ranged transfers
+        self.transfer = TransferConfig(multipart_threshold=MULTIPART_THRESHOLD,
+                                       multipart_chunksize=MULTIPART_CHUNK_SIZE,
+                                       max_concurrency=4)
+        self._cache_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    def _cache_path(self, key: str) -> pathlib.Path:
+        return self.cache_dir / key
+
+    def put_file(self, key: str, src_path, content_type: Optional[str] = None) -> None:
+        """Upload ``src_path`` as ``key``; the file becomes the cached copy."""
+        extra = {"ContentType": content_type} if content_type else {}
+        # Objects are content-addressed, so they never change under their key
+        extra["CacheControl"] = "public, max-age=31536000, immutable"
+        self.client.upload_file(str(src_path), self.bucket, self._key(key),
+                                ExtraArgs=extra, Config=self.transfer)
+        path = self._cache_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(src_path, path)
+        self._cached(path)
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def discard_duplicate(self, key: str, src_path) -> None:
+        """``src_path`` has the same content as ``key``; keep it as the cached copy if there is none."""
+        path = self._cache_path(key)
+        if path.exists():
+            if not path.samefile(src_path):
+                os.remove(src_path)
+            os.utime(path)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(src_path, path)
+            self._cached(path)
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        self._cache_path(key).unlink(missing_ok=True)
+
+    def local_path(self, key: str) -> pathlib.Path:
+        path = self._cache_path(key)
+        if path.is_file():
+            # mtime is the LRU clock for eviction
+            os.utime(path)
+            return path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            self.client.download_file(self.bucket, self._key(key), str(tmp_path), Config=self.transfer)
+            os.replace(tmp_path, path)
+        except ClientError as e:
+            raise StorageError(f"No such object: {key} ({e})")
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        self._cached(path)
+        return path
+
+    def url(self, key: str) -> str:
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self._key(key)}, ExpiresIn=self.presign_seconds)
+
+    def list(self, prefix: str) -> Iterator[Tuple[str, int, float]]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            for obj in page.get("Contents", []):
+                yield obj["Key"][len(self.prefix):], obj["Size"], obj["LastModified"].timestamp()
+
+    # ---------- read-through cache ----------
+    def _cache_entries(self) -> list:
+        entries = []
+        for dirpath, _, filenames in os.walk(self.cache_dir / "blobs"):
+            for name in filenames:
+                if not name.endswith(".tmp"):
+                    path = pathlib.Path(dirpath) / name
+                    stat = path.stat()
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _cached(self, path: pathlib.Path) -> None:
+        """Account for a new cache file and evict least recently used ones over budget."""
+        with self._lock:
+            if self._cache_bytes is None:
+                self._cache_bytes = sum(size for _, size, _ in self._cache_entries())
+            else:
+                self._cache_bytes += path.stat().st_size
+            if self._cache_bytes <= self.cache_max_bytes:
+                return
+            # Full scan only when over budget; evict down to 90% so it doesn't rescan every write
+            entries = self._cache_entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in sorted(entries):
+                if total <= self.cache_max_bytes * 0.9:
+                    break
+                if entry == path:
+                    continue
+                entry.unlink(missing_ok=True)
+                total -= size
+            self._cache_bytes = total
+
+
+def storage_from_env():
+    """Storage backend selected by STORAGE_BACKEND (local or s3)."""
+    if STORAGE_BACKEND == "s3":
+        if not BOTO3_AVAILABLE:
+            raise StorageError("STORAGE_BACKEND=s3 needs boto3 installed")
+        print(f"✓ Media storage: s3://{S3_BUCKET}/{S3_PREFIX}" + (f" via {S3_ENDPOINT_URL}" if S3_ENDPOINT_URL else ""))
+        return S3Storage(S3_BUCKET)
+    return LocalStorage(UPLOAD_DIR)
@@ -0,0 +1,101 @@
+# Placeholder images for missing media. Each (width, height, text) variant is
+# rendered once and kept in an LRU cache, so broken image links cost a dict
+# lookup instead of a PIL render and PNG encode per request. Async callers
+# render cache misses in the image worker pool.
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from image_workers import image_pool
+
+MIN_SIZE = 8
+MAX_SIZE = 2000
+MAX_TEXT_LENGTH = 64
+DEFAULT_SIZE = 400
+DEFAULT_TEXT = "Image\nNot Found"
+CACHE_CONTROL = "public, max-age=86400"
+CACHE_SIZE = 256
+
+BACKGROUND = "#f0f0f0"
+FOREGROUND = "#666666"
+
+
+def _clamp(value: Optional[int], default: int) -> int:
+    if value is None:
+        return default
+    return max(MIN_SIZE, min(MAX_SIZE, int(value)))
+
+
+def _font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only ships the fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+_cache: "OrderedDict[tuple, Tuple[bytes, str]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def render_placeholder(width: int, height: int, text: str) -> Tuple[bytes, str]:
+    img = Image.new("RGB", (width, height), color=BACKGROUND)
+    draw = ImageDraw.Draw(img)
+    center = (width // 2, height // 2)
+    font_size = max(10, min(width, height) // 10)
+    font = _font(font_size)
+    # Shrink the text until it fits; this runs once per cached variant
+    while font_size > 6:
+        left, top, right, bottom = draw.textbbox(center, text, font=font, anchor="mm", align="center")
+        if right - left <= width * 0.9 and bottom - top <= height * 0.9:
+            break
+        font_size -= 2
+        font = _font(font_size)
+    draw.text(center, text, fill=FOREGROUND, font=font, anchor="mm", align="center")
+
+    img_io = io.BytesIO()
+    img.save(img_io, "PNG", optimize=True)
+    content = img_io.getvalue()
+    etag = f'"ph-{hashlib.sha1(content).hexdigest()[:20]}"'
+    return content, etag
+
+
+def _normalise(width: Optional[int], height: Optional[int], text: Optional[str]) -> tuple:
+    width = _clamp(width, DEFAULT_SIZE)
+    height = _clamp(height, width)
+    text = (text if text else DEFAULT_TEXT)[:MAX_TEXT_LENGTH]
+    return width, height, text
+
+
+def _cached(key: tuple) -> Optional[Tuple[bytes, str]]:
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+        return entry
+
+
+def _store(key: tuple, entry: Tuple[bytes, str]) -> Tuple[bytes, str]:
+    with _cache_lock:
+        _cache[key] = entry
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return entry
+
+
+def get_placeholder(width: Optional[int] = None, height: Optional[int] = None,
+                    text: Optional[str] = None) -> Tuple[bytes, str]:
+    """Return the PNG bytes and ETag for a placeholder, rendering it at most once."""
+    key = _normalise(width, height, text)
+    return _cached(key) or _store(key, render_placeholder(*key))
+
+
+async def get_placeholder_async(width: Optional[int] = None, height: Optional[int] = None,
+                                text: Optional[str] = None) -> Tuple[bytes, str]:
+    """:func:`get_placeholder` for async handlers; misses render off the event loop."""
+    key = _normalise(width, height, text)
+    return _cached(key) or _store(key, await image_pool.run(render_placeholder, *key))
@@ -0,0 +1,255 @@
+# Production diagnostics for a running worker:
+#   - sample_profile(): wall-clock stack sampling of every thread for N
+#     seconds, exported as collapsed stacks (flamegraph.pl / speedscope
+#     import) or speedscope's sampled-profile JSON
+#   - LoopLagMonitor: watchdog thread that notices when the event loop has
+#     not run its heartbeat for longer than a threshold and records the
+#     stack of whatever is blocking it
+#   - TracemallocSession: start tracemalloc and diff successive snapshots
+# Sampling reads sys._current_frames() from a helper thread, so the worker
+# keeps serving requests while it is profiled.
+import asyncio
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from typing import Dict, List, Optional, Tuple
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+MAX_PROFILE_SECONDS = 60
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "200"))
+LOOP_LAG_MONITOR = os.getenv("LOOP_LAG_MONITOR", "1").lower() not in ("0", "false", "no")
+
+Frame = Tuple[str, str, int]  # (function, filename, line)
+
+
+def _stack(frame, limit: int = 128) -> List[Frame]:
+    """Root-first list of frames."""
+    stack = []
+    while frame is not None and len(stack) < limit:
+        code = frame.f_code
+        stack.append((code.co_name, code.co_filename, frame.f_lineno))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _short_path(filename: str) -> str:
+    for marker in ("site-packages" + os.sep, "backend" + os.sep):
+        index = filename.rfind(marker)
+        if index != -1:
+            return filename[index + len(marker):]
+    return os.path.basename(filename)
+
+
+def format_stack(stack: List[Frame]) -> List[str]:
+    return [f"{_short_path(filename)}:{line} in {function}" for function, filename, line in stack]
+
+
+# ---------- sampling profiler ----------
+def sample_profile(seconds: float, interval: float = 0.005, idle: bool = False) -> Counter:
+    """Sample all other threads every ``interval`` seconds for ``seconds``.
+
+    Returns a Counter of root-first stacks (tuples of frames, prefixed with
+    the thread name). Idle worker threads parked in ``wait``/``select`` are
+    dropped unless ``idle`` is set.
+    """
+    seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+    own_id = threading.get_ident()
+    samples: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = _stack(frame)
+            if not idle and stack and stack[-1][0] in ("wait", "select", "_worker", "poll", "accept", "sleep"):
+                continue
+            thread = names.get(thread_id, str(thread_id))
+            samples[(("[" + thread + "]", "", 0),) + tuple(stack)] += 1
+        time.sleep(interval)
+    return samples
+
+
+def to_collapsed(samples: Counter) -> str:
+    """Brendan Gregg's folded format: ``frame;frame;frame count`` per line."""
+    lines = []
+    for stack, count in samples.most_common():
+        frames = [stack[0][0]] + [f"{function} ({_short_path(filename)}:{line})"
+                                  for function, filename, line in stack[1:]]
+        lines.append(";".join(f.replace(";", ",") for f in frames) + f" {count}")
+    return "\n".join(lines) + "\n"
+
+
+def to_speedscope(samples: Counter, interval: float, name: str = "kalakriti") -> dict:
+    """speedscope file-format JSON with one sampled profile."""
+    frame_index: Dict[Frame, int] = {}
+    frames = []
+    stacks, weights = [], []
+    for stack, count in samples.items():
+        indexes = []
+        for frame in stack:
+            if frame not in frame_index:
+                frame_index[frame] = len(frames)
+                function, filename, line = frame
+                entry = {"name": function}
+                if filename:
+                    entry.update({"file": filename, "line": line})
+                frames.append(entry)
+            indexes.append(frame_index[frame])
+        stacks.append(indexes)
+        weights.append(count * interval)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "kalakriti-profiler",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": stacks,
+            "weights": weights,
+        }],
+    }
+
+
+# ---------- event-loop lag ----------
+class LoopLagMonitor:
+    """Detects event-loop stalls and records the stack that caused them."""
+
+    def __init__(self, threshold_ms: float = LOOP_LAG_THRESHOLD_MS, max_events: int = 100):
+        self.threshold = threshold_ms / 1000.0
+        self.events = deque(maxlen=max_events)
+        self.max_lag_ms = 0.0
+        self.stalls = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        if self.running:
+            return
+        self._loop = loop or asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._loop.call_soon(self._beat)
+        self._thread = threading.Thread(target=self._watch, name="loop-lag-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _beat(self) -> None:
+        self._last_beat = time.monotonic()
+        if not self._stop.is_set():
+            self._loop.call_later(self.threshold / 4, self._beat)
+
+    def _watch(self) -> None:
+        reported_beat = None
+        while not self._stop.wait(self.threshold / 4):
+            beat = self._last_beat
+            lag = time.monotonic() - beat
+            if lag < self.threshold:
+                if reported_beat is not None and beat != reported_beat:
+                    reported_beat = None
+                continue
+            self.max_lag_ms = max(self.max_lag_ms, lag * 1000)
+            if reported_beat == beat:
+                # Same stall still in progress; only track its length
+                self.events[-1]["lag_ms"] = round(lag * 1000, 1)
+                continue
+            reported_beat = beat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = format_stack(_stack(frame)) if frame is not None else []
+            self.events.append({
+                "at": time.time(),
+                "lag_ms": round(lag * 1000, 1),
+                "stack": stack,
+            })
+            culprit = stack[-1] if stack else "unknown"
+            print(f"⚠ Event loop blocked for {lag * 1000:.0f} ms at {culprit}")
+
+    def report(self) -> dict:
+        return {
+            "running": self.running,
+            "threshold_ms": self.threshold * 1000,
+            "stalls": self.stalls,
+            "max_lag_ms": round(self.max_lag_ms, 1),
+            "current_lag_ms": round((time.monotonic() - self._last_beat) * 1000, 1) if self.running else None,
+            "recent": list(self.events),
+        }
+
+
+loop_lag_monitor = LoopLagMonitor()
+
+
+# ---------- tracemalloc ----------
+class TracemallocSession:
+    """Keeps the previous snapshot so each call returns growth since the last one."""
+
+    def __init__(self):
+        self._previous: Optional[tracemalloc.Snapshot] = None
+        self._lock = threading.Lock()
+
+    def start(self, frames: int = 10) -> dict:
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self._previous = tracemalloc.take_snapshot()
+        return self.status()
+
+    def stop(self) -> dict:
+        with self._lock:
+            tracemalloc.stop()
+            self._previous = None
+        return self.status()
+
+    def status(self) -> dict:
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        return {
+            "tracing": tracemalloc.is_tracing(),
+            "traced_mb": round(current / 2 ** 20, 2),
+            "peak_mb": round(peak / 2 ** 20, 2),
+        }
+
+    def diff(self, limit: int = 25, group_by: str = "lineno") -> dict:
+        """Top allocation sites by growth since the previous call (or start)."""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                raise RuntimeError("tracemalloc is not running; start it first")
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            ])
+            previous, self._previous = self._previous, snapshot
+        if previous is None:
+            stats = snapshot.statistics(group_by)
+            top = [{"site": str(s.traceback), "size_kb": round(s.size / 1024, 1), "count": s.count}
+                   for s in stats[:limit]]
+        else:
+            stats = snapshot.compare_to(previous, group_by)
+            top = [{
+                "site": str(s.traceback),
+                "size_kb": round(s.size / 1024, 1),
+                "size_diff_kb": round(s.size_diff / 1024, 1),
+                "count": s.count,
+                "count_diff": s.count_diff,
+            } for s in stats[:limit]]
+        return {**self.status(), "compared_to_previous": previous is not None, "top": top}
+
+
+tracemalloc_session = TracemallocSession()
@@ -0,0 +1,27 @@
+# In-process rate limiting shared by the modules that ration calls to
+# external services (e.g. the hourly caption LLM budget). State that must be
+# shared between worker processes, such as the Instagram posting budget,
+# lives in the database instead (see instagram_outbox.py).
+import time
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second, at most ``capacity`` banked."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
@@ -0,0 +1,259 @@
+# Precomputed related-products graph. For every product we keep a ranked
+# adjacency list of its top-K neighbours, scored by IDF-weighted tag overlap,
+# same artisan, same category and price band. Entries embed a small product
+# summary so a product page needs one indexed read. The graph is refreshed
+# incrementally whenever a product is written.
+import math
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+from pymongo import ReplaceOne, UpdateOne
+
+TOP_K = 12
+MAX_CANDIDATES = 500
+IDF_TTL_SECONDS = 600
+
+TAG_WEIGHT = 0.6
+ARTISAN_WEIGHT = 0.2
+CATEGORY_WEIGHT = 0.15
+PRICE_WEIGHT = 0.05
+
+SUMMARY_FIELDS = ["id", "title", "price", "images", "artisan_id", "category", "tags", "status"]
+SUMMARY_PROJECTION = {"_id": 0, **{field: 1 for field in SUMMARY_FIELDS}}
+
+
+def price_band(price) -> Optional[int]:
+    """Logarithmic price bucket; neighbouring bands are roughly 1.5x apart."""
+    try:
+        price = float(price)
+    except (TypeError, ValueError):
+        return None
+    if price <= 0:
+        return None
+    return int(math.log(price, 1.5))
+
+
+def summarise(product: dict) -> dict:
+    return {
+        "id": product.get("id"),
+        "title": product.get("title"),
+        "price": product.get("price"),
+        "images": (product.get("images") or [])[:1],
+        "artisan_id": product.get("artisan_id"),
+        "category": product.get("category"),
+    }
+
+
+class RelatedProductsEngine:
+    """Maintains the ``related_products`` adjacency collection."""
+
+    def __init__(self, products_collection, related_collection, top_k: int = TOP_K):
+        self.products = products_collection
+        self.related = related_collection
+        self.top_k = top_k
+        self._idf: Dict[str, float] = {}
+        self._default_idf = 1.0
+        self._idf_loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._indexes_ready = False
+
+    def _ensure_indexes(self) -> None:
+        if not self._indexes_ready:
+            self.related.create_index("product_id", unique=True)
+            self._indexes_ready = True
+
+    # ---------- scoring ----------
+    def _refresh_idf(self, force: bool = False) -> None:
+        with self._lock:
+            if not force and time.time() - self._idf_loaded_at < IDF_TTL_SECONDS:
+                return
+            total = self.products.count_documents({"status": "active"})
+            counts = self.products.aggregate([
+                {"$match": {"status": "active"}},
+                {"$unwind": "$tags"},
+                {"$group": {"_id": "$tags", "n": {"$sum": 1}}},
+            ])
+            self._idf = {row["_id"]: math.log((total + 1) / (row["n"] + 1)) + 1 for row in counts}
+            self._default_idf = math.log(total + 1) + 1
+            self._idf_loaded_at = time.time()
+
+    def _tag_weight(self, tag: str) -> float:
+        return self._idf.get(tag, self._default_idf)
+
+    def score(self, a: dict, b: dict) -> float:
+        tags_a, tags_b = set(a.get("tags") or []), set(b.get("tags") or [])
+        union = tags_a | tags_b
+        tag_score = 0.0
+        if union:
+            shared = sum(self._tag_weight(t) for t in tags_a & tags_b)
+            tag_score = shared / sum(self._tag_weight(t) for t in union)
+
+        score = TAG_WEIGHT * tag_score
+        if a.get("artisan_id") and a.get("artisan_id") == b.get("artisan_id"):
+            score += ARTISAN_WEIGHT
+        if a.get("category") and a.get("category") == b.get("category"):
+            score += CATEGORY_WEIGHT
+        band_a, band_b = price_band(a.get("price")), price_band(b.get("price"))
+        if band_a is not None and band_b is not None and abs(band_a - band_b) <= 1:
+            score += PRICE_WEIGHT
+        return round(score, 4)
+
+    # ---------- graph maintenance ----------
+    def _candidates(self, product: dict) -> List[dict]:
+        clauses = []
+        if product.get("tags"):
+            clauses.append({"tags": {"$in": product["tags"]}})
+        if product.get("artisan_id"):
+            clauses.append({"artisan_id": product["artisan_id"]})
+        if product.get("category"):
+            clauses.append({"category": product["category"]})
+        if not clauses:
+            return []
+        return list(self.products.find(
+            {"$or": clauses, "id": {"$ne": product.get("id")}, "status": "active"},
+            SUMMARY_PROJECTION
+        ).limit(MAX_CANDIDATES))
+
+    def _rank(self, product: dict, candidates: List[dict]) -> List[dict]:
+        scored = [(self.score(product, other), other) for other in candidates]
+        scored = [item for item in scored if item[0] > 0]
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [{**summarise(other), "score": score} for score, other in scored[:self.top_k]]
+
+    def compute(self, product: dict, candidates: Optional[List[dict]] = None) -> List[dict]:
+        """Rank and store the neighbours of one product."""
+        self._ensure_indexes()
+        self._refresh_idf()
+        if candidates is None:
+            candidates = self._candidates(product)
+        related = self._rank(product, candidates)
+        self.related.replace_one(
+            {"product_id": product["id"]},
+            {"product_id": product["id"], "related": related, "updated_at": datetime.now().isoformat()},
+            upsert=True
+        )
+        return related
+
+    def refresh(self, product: dict) -> None:
+        """Update the graph after ``product`` was created or changed."""
+        self._ensure_indexes()
+        self._refresh_idf()
+        product_id = product["id"]
+        if product.get("status", "active") != "active":
+            self.remove(product_id)
+            return
+
+        candidates = self._candidates(product)
+        self.compute(product, candidates)
+
+        # Drop the stale entry everywhere first: lists of products that are no
+        # longer candidates (changed tags, category or artisan) still hold it
+        holders = self._holders(product_id)
+        self.related.update_many({"related.id": product_id}, {"$pull": {"related": {"id": product_id}}})
+
+        # Splice the product back into each current neighbour's ranked list
+        entry = summarise(product)
+        existing = {
+            doc["product_id"]: doc.get("related", [])
+            for doc in self.related.find({"product_id": {"$in": [c["id"] for c in candidates]}}, {"_id": 0})
+        }
+        ops = []
+        spliced = set()
+        for other in candidates:
+            if other["id"] not in existing:
+                # Neighbour has no list yet; it is computed lazily on first read
+                continue
+            related = [r for r in existing[other["id"]] if r["id"] != product_id]
+            score = self.score(other, product)
+            if score > 0:
+                related.append({**entry, "score": score})
+                related.sort(key=lambda r: r["score"], reverse=True)
+                related = related[:self.top_k]
+                spliced.add(other["id"])
+            ops.append(UpdateOne({"product_id": other["id"]}, {"$set": {"related": related}}))
+        if ops:
+            self.related.bulk_write(ops, ordered=False)
+
+        # Lists that lost the entry without getting it back are one short
+        self._recompute(holders - spliced)
+
+    def remove(self, product_id: str) -> None:
+        """Drop a deleted or deactivated product from the graph."""
+        self._ensure_indexes()
+        holders = self._holders(product_id)
+        self.related.delete_one({"product_id": product_id})
+        self.related.update_many(
+            {"related.id": product_id},
+            {"$pull": {"related": {"id": product_id}}}
+        )
+        self._recompute(holders)
+
+    def _holders(self, product_id: str) -> Set[str]:
+        """Products whose stored list currently includes ``product_id``."""
+        return {
+            doc["product_id"]
+            for doc in self.related.find({"related.id": product_id}, {"_id": 0, "product_id": 1})
+        }
+
+    def _recompute(self, product_ids: Set[str]) -> None:
+        """Rank the given products again so lists that lost an entry are refilled."""
+        if not product_ids:
+            return
+        active = list(self.products.find(
+            {"id": {"$in": list(product_ids)}, "status": "active"}, SUMMARY_PROJECTION
+        ))
+        for product in active:
+            self.compute(product)
+        inactive = product_ids - {product["id"] for product in active}
+        if inactive:
+            self.related.delete_many({"product_id": {"$in": list(inactive)}})
+
+    def get(self, product_id: str, limit: int = 8) -> Optional[List[dict]]:
+        """Ranked neighbours with one indexed read, computing them on a miss."""
+        doc = self.related.find_one({"product_id": product_id}, {"_id": 0, "related": {"$slice": limit}})
+        if doc is not None:
+            return doc["related"]
+        product = self.products.find_one({"id": product_id}, SUMMARY_PROJECTION)
+        if product is None:
+            return None
+        if product.get("status", "active") != "active":
+            # Inactive products have no place in the graph; never store a list for them
+            return []
+        return self.compute(product)[:limit]
+
+    def rebuild(self) -> int:
+        """Recompute every adjacency list in memory; used to backfill a catalog."""
+        self._ensure_indexes()
+        self._refresh_idf(force=True)
+        products = list(self.products.find({"status": "active"}, SUMMARY_PROJECTION))
+
+        by_key: Dict[tuple, List[int]] = {}
+        for i, product in enumerate(products):
+            for tag in product.get("tags") or []:
+                by_key.setdefault(("tag", tag), []).append(i)
+            by_key.setdefault(("artisan", product.get("artisan_id")), []).append(i)
+            by_key.setdefault(("category", product.get("category")), []).append(i)
+
+        ops = []
+        now = datetime.now().isoformat()
+        for i, product in enumerate(products):
+            candidate_ids = set()
+            for tag in product.get("tags") or []:
+                candidate_ids.update(by_key.get(("tag", tag), [])[:MAX_CANDIDATES])
+            candidate_ids.update(by_key.get(("artisan", product.get("artisan_id")), [])[:MAX_CANDIDATES])
+            candidate_ids.update(by_key.get(("category", product.get("category")), [])[:MAX_CANDIDATES])
+            candidate_ids.discard(i)
+            related = self._rank(product, [products[j] for j in candidate_ids])
+            ops.append(ReplaceOne(
+                {"product_id": product["id"]},
+                {"product_id": product["id"], "related": related, "updated_at": now},
+                upsert=True
+            ))
+            if len(ops) >= 1000:
+                self.related.bulk_write(ops, ordered=False)
+                ops = []
+        if ops:
+            self.related.bulk_write(ops, ordered=False)
+        return len(products)
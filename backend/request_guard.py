@@ -0,0 +1,165 @@
+# Pure ASGI request guard. Rejects URLs that carry inline base64 image data
+# or are long enough to break file-system lookups, before any routing runs.
+# It reads scope["raw_path"] / scope["query_string"] as bytes once and never
+# builds a Request object, so valid requests pass straight through and
+# streaming responses are untouched (unlike BaseHTTPMiddleware).
+import json
+import os
+import time
+from typing import Iterable, Optional
+
+MAX_PATH_LENGTH = int(os.getenv("GUARD_MAX_PATH_LENGTH", "200"))
+MAX_QUERY_LENGTH = int(os.getenv("GUARD_MAX_QUERY_LENGTH", "1000"))
+# Inline data URLs, raw and percent-encoded (":" -> %3A)
+BLOCKED_MARKERS = (b"data:image", b"data%3aimage", b"data%3Aimage")
+
+UPLOAD_ENDPOINTS = {
+    "base64_upload": "/upload-base64-image",
+    "file_upload": "/upload",
+    "instagram_posting": "/instagram/post-from-url",
+}
+
+
+def _json_response(status: int, content: dict):
+    body = json.dumps(content).encode()
+    start = {
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+    }
+    return start, {"type": "http.response.body", "body": body}
+
+
+class RequestGuardMiddleware:
+    """Reject inline base64 images and oversized paths or query strings.
+
+    ``protected_prefixes`` get the static-file flavoured error message; every
+    other path gets the generic one pointing at the upload endpoints.
+    """
+
+    def __init__(self, app, max_path_length: int = MAX_PATH_LENGTH,
+                 max_query_length: int = MAX_QUERY_LENGTH,
+                 blocked_markers: Iterable[bytes] = BLOCKED_MARKERS,
+                 protected_prefixes: Iterable[str] = ("/uploads",)):
+        self.app = app
+        self.max_path_length = max_path_length
+        self.max_query_length = max_query_length
+        self.blocked_markers = tuple(blocked_markers)
+        self.protected_prefixes = tuple(protected_prefixes)
+
+    def rejection(self, scope) -> Optional[dict]:
+        """Return the error body for a request that must be refused, else None."""
+        path = scope.get("raw_path") or scope["path"].encode()
+        query = scope.get("query_string", b"")
+        too_long = len(path) > self.max_path_length or len(query) > self.max_query_length
+        inline_data = any(marker in path or marker in query for marker in self.blocked_markers)
+        if not (too_long or inline_data):
+            return None
+
+        if scope["path"].startswith(self.protected_prefixes):
+            return {
+                "error": "Invalid image URL format",
+                "message": "Base64 image data should not be passed in URLs. Use the upload endpoint instead.",
+                "suggestion": "Upload the image as a file or use the /upload-base64-image endpoint.",
+                "path_length": len(path) if len(path) <= 1000 else "too long to display"
+            }
+        return {
+            "error": "Base64 image data detected in URL",
+            "message": "Base64 data cannot be used in URLs due to length limitations",
+            "suggestion": "Use the /upload-base64-image endpoint for base64 data or upload files directly",
+            "endpoints": UPLOAD_ENDPOINTS
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            error = self.rejection(scope)
+            if error is not None:
+                start, body = _json_response(400, error)
+                await send(start)
+                await send(body)
+                return
+        await self.app(scope, receive, send)
+
+
+def benchmark(requests: int = 20000) -> dict:
+    """Compare per-request overhead of this guard with the old BaseHTTPMiddleware pair."""
+    import asyncio
+
+    from starlette.applications import Starlette
+    from starlette.middleware.base import BaseHTTPMiddleware
+    from starlette.responses import PlainTextResponse
+    from starlette.routing import Route
+
+    async def endpoint(request):
+        return PlainTextResponse("ok")
+
+    def build(kind: str):
+        app = Starlette(routes=[Route("/api/user/products", endpoint)])
+        if kind == "guard":
+            app.add_middleware(RequestGuardMiddleware)
+        elif kind == "base_http":
+            async def validate_url_and_handle_base64(request, call_next):
+                url_path, query = str(request.url.path), str(request.url.query)
+                if "data:image" in url_path or "data:image" in query or len(url_path) > 200 or len(query) > 1000:
+                    return PlainTextResponse("rejected", status_code=400)
+                return await call_next(request)
+
+            async def validate_url_length(request, call_next):
+                if request.url.path.startswith("/uploads"):
+                    if "data:image" in str(request.url) or len(request.url.path) > 250:
+                        return PlainTextResponse("rejected", status_code=400)
+                return await call_next(request)
+
+            app.add_middleware(BaseHTTPMiddleware, dispatch=validate_url_and_handle_base64)
+            app.add_middleware(BaseHTTPMiddleware, dispatch=validate_url_length)
+        return app
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/api/user/products", "raw_path": b"/api/user/products",
+        "root_path": "", "query_string": b"category=Pottery&page=2", "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 50000), "server": ("localhost", 8000),
+    }
+
+    def make_channel():
+        messages = [{"type": "http.request", "body": b"", "more_body": False}]
+        done = asyncio.Event()
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # The client disconnects once the whole response has arrived
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                done.set()
+
+        return receive, send
+
+    async def run(app) -> float:
+        for _ in range(200):  # warm-up
+            await app(dict(scope), *make_channel())
+        start = time.perf_counter()
+        for _ in range(requests):
+            await app(dict(scope), *make_channel())
+        return (time.perf_counter() - start) / requests * 1e6
+
+    async def main():
+        return {kind: await run(build(kind)) for kind in ("none", "base_http", "guard")}
+
+    timings = asyncio.run(main())
+    return {
+        "requests": requests,
+        "no_middleware_us": round(timings["none"], 2),
+        "base_http_middleware_us": round(timings["base_http"] - timings["none"], 2),
+        "request_guard_us": round(timings["guard"] - timings["none"], 2),
+    }
+
+
+if __name__ == "__main__":
+    print(benchmark())
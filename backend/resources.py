@@ -0,0 +1,122 @@
+# Per-worker clients for external services. Nothing here connects at import:
+# the app's lifespan opens the database in each worker process after
+# uvicorn/gunicorn has forked it, and closes it on shutdown, so workers never
+# share sockets or background threads inherited from a parent. DATABASE_BACKEND
+# picks the database: MongoDB (the default), an indexed in-memory store for
+# tests and load tests, or an SQLite file for single-node deployments (see
+# docstore.py); the app sees the same collection API either way. SDK clients
+# that are only needed on some requests (Gemini, Vertex AI) are ProcessLocal:
+# built on first use in the process that uses them.
+import os
+import threading
+from typing import Any, Callable, List, Optional
+
+from pymongo import MongoClient
+
+from docstore import MemoryDatabase, SQLiteDatabase
+
+DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "mongo").lower()
+DATABASE_PATH = os.getenv("DATABASE_PATH", "data/kalakriti.db")
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017/")
+MONGO_DB = os.getenv("MONGO_DB", "kalakriti")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_MS = int(os.getenv("MONGO_MAX_IDLE_MS", "60000"))
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", "5000"))
+
+
+class ProcessLocal:
+    """A value built by ``factory`` on first use in each process.
+
+    A forked child that inherited a built value discards it and builds its
+    own, so clients holding sockets or threads are never shared across fork.
+    """
+
+    def __init__(self, factory: Callable[[], Any], closer: Optional[Callable[[Any], None]] = None):
+        self.factory = factory
+        self.closer = closer
+        self._value = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._value = self.factory()
+                    self._pid = pid
+        return self._value
+
+    def close(self) -> None:
+        with self._lock:
+            value, built_here = self._value, self._pid == os.getpid()
+            self._value, self._pid = None, None
+        if built_here and value is not None and self.closer is not None:
+            self.closer(value)
+
+
+class Resources:
+    """The database (and its client) for one worker process."""
+
+    def __init__(self, backend: str = DATABASE_BACKEND, url: str = MONGO_URL, db_name: str = MONGO_DB,
+                 path: str = DATABASE_PATH,
+                 max_pool_size: int = MONGO_MAX_POOL_SIZE, min_pool_size: int = MONGO_MIN_POOL_SIZE,
+                 max_idle_ms: int = MONGO_MAX_IDLE_MS, timeout_ms: int = MONGO_TIMEOUT_MS,
+                 event_listeners: Optional[List] = None):
+        self.backend = backend
+        self.url = url
+        self.db_name = db_name
+        self.path = path
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.max_idle_ms = max_idle_ms
+        self.timeout_ms = timeout_ms
+        self.event_listeners = event_listeners or []
+        self.client: Optional[MongoClient] = None
+        self.db = None
+        self.pid: Optional[int] = None
+
+    def open(self):
+        """Open this process's database; returns it, or None when it is unusable."""
+        if self.db is not None and self.pid == os.getpid():
+            return self.db
+        if self.backend == "memory":
+            self.db, self.pid = MemoryDatabase(self.db_name), os.getpid()
+            print(f"✓ In-memory database ready (pid {self.pid})")
+            return self.db
+        if self.backend == "sqlite":
+            try:
+                self.db, self.pid = SQLiteDatabase(self.path, self.db_name), os.getpid()
+                print(f"✓ SQLite database ready at {self.path} (pid {self.pid})")
+            except Exception as e:
+                print(f"⚠ SQLite database not available: {e}")
+                self.db = None
+            return self.db
+        if self.backend != "mongo":
+            print(f"⚠ Unknown DATABASE_BACKEND {self.backend!r}, using MongoDB")
+        try:
+            self.client = MongoClient(
+                self.url,
+                maxPoolSize=self.max_pool_size,
+                minPoolSize=self.min_pool_size,
+                maxIdleTimeMS=self.max_idle_ms,
+                serverSelectionTimeoutMS=self.timeout_ms,
+                connectTimeoutMS=self.timeout_ms,
+                event_listeners=self.event_listeners,
+            )
+            self.db = self.client[self.db_name]
+            self.pid = os.getpid()
+            print(f"✓ MongoDB client ready (pid {self.pid}, pool {self.min_pool_size}-{self.max_pool_size})")
+        except Exception as e:
+            print(f"⚠ MongoDB not available: {e}")
+            self.client, self.db = None, None
+        return self.db
+
+    def close(self) -> None:
+        if self.pid == os.getpid():
+            if self.client is not None:
+                self.client.close()
+            elif self.db is not None:
+                self.db.close()
+        self.client, self.db, self.pid = None, None, None
@@ -0,0 +1,230 @@
+# Stateless HMAC-signed session tokens. A token carries the user id, user type,
+# expiry and a token id, so requests can be authenticated without a MongoDB
+# lookup. Revoked token ids live in the `revoked_tokens` collection (TTL
+# indexed on the token's expiry) and every worker mirrors them in memory,
+# pulling new revocations at most every REVOCATION_SYNC_SECONDS. Entries are
+# only dropped once the token has expired, never to make room.
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TOKEN_TTL_SECONDS = int(os.getenv("TOKEN_TTL_SECONDS", str(7 * 24 * 3600)))
+VERIFY_CACHE_SIZE = 4096
+REVOCATION_SYNC_SECONDS = float(os.getenv("REVOCATION_SYNC_SECONDS", "1"))
+# Revocations written by other nodes may carry a slightly skewed clock
+REVOCATION_SYNC_SLACK = 30
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+_secret = os.getenv("TOKEN_SECRET")
+if not _secret:
+    if WEB_CONCURRENCY > 1:
+        # Tokens signed by one worker would be rejected by all the others
+        raise RuntimeError("TOKEN_SECRET must be set when running more than one worker (WEB_CONCURRENCY > 1)")
+    print("⚠ TOKEN_SECRET not set, using a random per-process secret")
+    _secret = secrets.token_hex(32)
+_SECRET = _secret.encode()
+
+
+class InvalidToken(Exception):
+    """Raised when a token is malformed, forged, expired or revoked."""
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(payload: bytes) -> bytes:
+    # 16 bytes of HMAC-SHA256 is plenty for a session token and keeps it short
+    return hmac.new(_SECRET, payload, hashlib.sha256).digest()[:16]
+
+
+class _TTLCache:
+    """Bounded LRU mapping whose entries also expire at a given unix time."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at: float):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class _Denylist:
+    """Revoked token ids until their expiry, shared through a collection when bound."""
+
+    def __init__(self):
+        self.collection = None
+        self._expiry = {}  # jti -> unix expiry
+        self._lock = threading.Lock()
+        self._synced_at = 0.0
+        self._high_water = 0.0
+        self._pruned_size = 0
+
+    def bind(self, collection) -> None:
+        with self._lock:
+            self.collection = collection
+            self._synced_at = self._high_water = 0.0
+        if collection is not None:
+            collection.create_index("jti", unique=True)
+            collection.create_index("revoked_at")
+            # MongoDB drops each entry once its token has expired
+            collection.create_index("expires_at", expireAfterSeconds=0)
+
+    def _prune(self, now: float) -> None:
+        # Amortised: only sweep once the set has doubled since the last sweep
+        if len(self._expiry) > max(2 * self._pruned_size, 1024):
+            self._expiry = {jti: exp for jti, exp in self._expiry.items() if exp > now}
+            self._pruned_size = len(self._expiry)
+
+    def add(self, jti: str, expires_at: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._expiry[jti] = expires_at
+            self._prune(now)
+        if self.collection is not None:
+            self.collection.update_one({"jti": jti}, {"$setOnInsert": {
+                "jti": jti,
+                "revoked_at": now,
+                "expires_at": datetime.fromtimestamp(expires_at, timezone.utc).replace(tzinfo=None),
+            }}, upsert=True)
+
+    def _sync(self, now: float) -> None:
+        collection = self.collection
+        if collection is None or now - self._synced_at < REVOCATION_SYNC_SECONDS:
+            return
+        self._synced_at = now
+        since = self._high_water - REVOCATION_SYNC_SLACK
+        rows = list(collection.find({"revoked_at": {"$gt": since}}, {"_id": 0, "jti": 1, "revoked_at": 1,
+                                                                     "expires_at": 1}))
+        with self._lock:
+            for row in rows:
+                expires_at = row["expires_at"].replace(tzinfo=timezone.utc).timestamp()
+                self._expiry[row["jti"]] = expires_at
+                self._high_water = max(self._high_water, row["revoked_at"])
+            self._prune(now)
+
+    def __contains__(self, jti: str) -> bool:
+        now = time.time()
+        self._sync(now)
+        expires_at = self._expiry.get(jti)
+        return expires_at is not None and expires_at > now
+
+
+_verified = _TTLCache(VERIFY_CACHE_SIZE)
+_denylist = _Denylist()
+
+
+def bind_revocations(collection) -> None:
+    """Share revocations with the other workers through ``collection`` (None keeps them local)."""
+    _denylist.bind(collection)
+
+
+def issue_token(user_id: str, user_type: str, ttl: Optional[int] = None) -> str:
+    """Issue a signed token for the given account."""
+    expires_at = int(time.time()) + (ttl if ttl is not None else TOKEN_TTL_SECONDS)
+    token_id = secrets.token_hex(6)
+    payload = f"{user_id}|{user_type}|{expires_at}|{token_id}".encode()
+    return f"{_b64encode(payload)}.{_b64encode(_sign(payload))}"
+
+
+def verify_token(token: str) -> dict:
+    """Return the token claims, raising InvalidToken if it cannot be trusted."""
+    claims = _verified.get(token)
+    if claims is None:
+        try:
+            encoded_payload, encoded_sig = token.split(".", 1)
+            payload = _b64decode(encoded_payload)
+            signature = _b64decode(encoded_sig)
+        except Exception:
+            raise InvalidToken("Malformed token")
+        if not hmac.compare_digest(signature, _sign(payload)):
+            raise InvalidToken("Invalid token signature")
+        try:
+            user_id, user_type, expires_at, token_id = payload.decode().rsplit("|", 3)
+            expires_at = int(expires_at)
+        except ValueError:
+            raise InvalidToken("Malformed token")
+        claims = {"user_id": user_id, "user_type": user_type, "exp": expires_at, "jti": token_id}
+        if expires_at > time.time():
+            _verified.set(token, claims, expires_at)
+
+    if claims["exp"] <= time.time():
+        raise InvalidToken("Token expired")
+    if claims["jti"] in _denylist:
+        raise InvalidToken("Token revoked")
+    return claims
+
+
+def revoke_token(token: str) -> None:
+    """Deny a token until it would have expired anyway."""
+    claims = verify_token(token)
+    _denylist.add(claims["jti"], claims["exp"])
+    _verified.discard(token)
+
+
+def benchmark(iterations: int = 100000) -> dict:
+    """Measure the per-call cost of issuing and verifying tokens."""
+    start = time.perf_counter()
+    tokens = [issue_token(f"user-{i}", "user") for i in range(iterations)]
+    issue_us = (time.perf_counter() - start) / iterations * 1e6
+
+    start = time.perf_counter()
+    for token in tokens:
+        verify_token(token)
+    cold_verify_us = (time.perf_counter() - start) / iterations * 1e6
+
+    hot = tokens[-1]
+    start = time.perf_counter()
+    for _ in range(iterations):
+        verify_token(hot)
+    cached_verify_us = (time.perf_counter() - start) / iterations * 1e6
+
+    return {
+        "iterations": iterations,
+        "issue_us": round(issue_us, 2),
+        "verify_us": round(cold_verify_us, 2),
+        "cached_verify_us": round(cached_verify_us, 2),
+    }
+
+
+if __name__ == "__main__":
+    print(benchmark())
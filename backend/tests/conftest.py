@@ -0,0 +1,48 @@
+# Shared fixtures. The app runs on the in-memory document store, so the suite
+# needs no MongoDB; run it from backend/ with `python -m pytest tests`.
+import os
+import pathlib
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = pathlib.Path(__file__).resolve().parent.parent
+
+# Must be in place before main (and the modules it imports) read the environment
+os.environ["DATABASE_BACKEND"] = "memory"
+os.environ["STORAGE_BACKEND"] = "local"
+os.environ["TOKEN_SECRET"] = "test-secret"
+os.environ["IMAGE_WORKERS"] = "0"
+os.environ["VISUAL_INDEX_DIR"] = tempfile.mkdtemp(prefix="visual_index_")
+os.environ["DERIVATIVE_DIR"] = tempfile.mkdtemp(prefix="derivatives_")
+os.environ["FETCH_CACHE_DIR"] = tempfile.mkdtemp(prefix="fetch_cache_")
+os.environ.pop("WEB_CONCURRENCY", None)
+
+# main resolves uploads/ against the working directory
+os.chdir(BACKEND_DIR)
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+@pytest.fixture
+def app_main():
+    import main
+    return main
+
+
+@pytest.fixture
+def client(app_main):
+    """A client with a fresh in-memory database (the lifespan opens one per run)."""
+    from fastapi.testclient import TestClient
+
+    with TestClient(app_main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def memory_db():
+    from docstore import MemoryDatabase
+
+    db = MemoryDatabase("kalakriti_test")
+    yield db
+    db.close()
@@ -0,0 +1,109 @@
+import pytest
+
+
+def register(client, email, username, user_type="user"):
+    response = client.post("/api/user/auth/register", json={
+        "email": email, "username": username, "full_name": username.title(),
+        "password": "secret123", "user_type": user_type,
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["data"]["user_id"]
+
+
+def login(client, email):
+    return client.post("/api/user/auth/login", json={"email": email, "password": "secret123"})
+
+
+def test_registration_rejects_duplicates(client):
+    register(client, "asha@example.com", "asha")
+    taken_email = client.post("/api/user/auth/register", json={
+        "email": "asha@example.com", "username": "other", "full_name": "Other",
+        "password": "secret123", "user_type": "user",
+    })
+    taken_username = client.post("/api/user/auth/register", json={
+        "email": "other@example.com", "username": "asha", "full_name": "Other",
+        "password": "secret123", "user_type": "user",
+    })
+    assert taken_email.status_code == 400
+    assert taken_username.status_code == 400
+
+
+def test_profile_update_cannot_take_another_accounts_email(client):
+    asha = register(client, "asha@example.com", "asha")
+    ravi = register(client, "ravi@example.com", "ravi")
+
+    response = client.put(f"/api/user/profile/{ravi}", json={
+        "user_id": ravi, "email": "asha@example.com", "username": "ravi", "full_name": "Ravi"})
+
+    assert response.status_code == 409
+    assert login(client, "asha@example.com").json()["data"]["user_id"] == asha
+
+
+def test_profile_update_cannot_take_another_accounts_username(client):
+    register(client, "asha@example.com", "asha")
+    ravi = register(client, "ravi@example.com", "ravi")
+
+    response = client.put(f"/api/user/profile/{ravi}", json={
+        "user_id": ravi, "email": "ravi@example.com", "username": "asha", "full_name": "Ravi"})
+
+    assert response.status_code == 409
+
+
+def test_changed_email_is_the_new_login(client):
+    ravi = register(client, "ravi@example.com", "ravi")
+
+    response = client.put(f"/api/user/profile/{ravi}", json={
+        "user_id": ravi, "email": "ravi.new@example.com", "username": "ravi", "full_name": "Ravi"})
+
+    assert response.status_code == 200
+    assert login(client, "ravi.new@example.com").json()["data"]["user_id"] == ravi
+    # The old address is free for someone else
+    register(client, "ravi@example.com", "someone")
+
+
+def test_artisan_profile_update_checks_uniqueness(client):
+    register(client, "asha@example.com", "asha")
+    meera = register(client, "meera@example.com", "meera", user_type="artisan")
+
+    response = client.put(f"/api/artisan/profile/{meera}", json={
+        "artisan_id": meera, "email": "asha@example.com", "username": "meera", "full_name": "Meera"})
+
+    assert response.status_code == 409
+
+
+def test_unknown_profile_is_not_found(client):
+    response = client.put("/api/user/profile/nobody", json={
+        "user_id": "nobody", "email": "nobody@example.com", "username": "nobody", "full_name": "Nobody"})
+    assert response.status_code == 404
+
+
+def test_startup_backfill_indexes_legacy_profiles(memory_db):
+    from accounts import AccountExistsError, backfill_legacy_accounts, create_account
+
+    memory_db["users"].insert_one({"user_id": "legacy", "email": "old@example.com", "username": "oldtimer",
+                                   "password": "hash"})
+    assert backfill_legacy_accounts(memory_db["accounts"], memory_db["users"], memory_db["artisan_profiles"],
+                                    memory_db["migrations"]) == 1
+
+    with pytest.raises(AccountExistsError):
+        create_account(memory_db["accounts"], "new", "old@example.com", "newcomer", "hash", "user")
+    with pytest.raises(AccountExistsError):
+        create_account(memory_db["accounts"], "new", "new@example.com", "oldtimer", "hash", "user")
+    # Recorded once per database
+    assert backfill_legacy_accounts(memory_db["accounts"], memory_db["users"], memory_db["artisan_profiles"],
+                                    memory_db["migrations"]) == 0
+
+
+def test_failed_profile_write_gives_the_identity_back(client, app_main, monkeypatch):
+    ravi = register(client, "ravi@example.com", "ravi")
+
+    def broken_write(*args, **kwargs):
+        raise RuntimeError("write failed")
+
+    monkeypatch.setattr(app_main.users_collection, "find_one_and_update", broken_write)
+    response = client.put(f"/api/user/profile/{ravi}", json={
+        "user_id": ravi, "email": "ravi.new@example.com", "username": "ravi", "full_name": "Ravi"})
+
+    assert response.status_code == 500
+    assert app_main.accounts_collection.find_one({"account_id": ravi})["email"] == "ravi@example.com"
+    register(client, "ravi.new@example.com", "someone")
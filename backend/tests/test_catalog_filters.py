@@ -0,0 +1,61 @@
+from catalog_filters import build_filter_query, count_facets, facet_pipeline, filter_products
+
+
+def seed(collection):
+    products = [
+        {"id": "p1", "category": "Pottery", "tags": ["clay", "blue"], "price": 400, "stock": 1},
+        {"id": "p2", "category": "Pottery", "tags": ["clay"], "price": 1200, "stock": 0},
+        {"id": "p3", "category": "Textiles", "tags": ["silk", "blue"], "price": 3000, "stock": 2},
+        {"id": "p4", "category": "Textiles", "tags": ["silk"], "price": 30000, "stock": 5},
+        {"id": "p5", "category": "Jewelry", "tags": ["blue"], "price": "on request", "stock": 1},
+        {"id": "p6", "category": "Jewelry", "tags": ["blue"], "price": -5, "stock": 1},
+        {"id": "p7", "category": "Pottery", "tags": ["clay"], "price": 800, "stock": 1, "status": "draft"},
+    ]
+    for i, product in enumerate(products):
+        collection.insert_one({"status": "active", "title": product["id"], "created_at": str(i), **product})
+
+
+def values(facet):
+    return {row["value"]: row["count"] for row in facet}
+
+
+def test_selected_filters_are_in_the_leading_match():
+    query = build_filter_query("Pottery", ["clay"], 100, 2000, True)
+    pipeline = facet_pipeline(query, "newest", 0, 20)
+    assert pipeline[0] == {"$match": query}
+    # Own-dimension counts are not computed inside $facet
+    assert "category" not in pipeline[1]["$facet"]
+    assert "price_ranges" not in pipeline[1]["$facet"]
+
+
+def test_single_choice_facets_ignore_their_own_filter(memory_db):
+    products = memory_db["products"]
+    seed(products)
+
+    result = filter_products(products, build_filter_query(category="Pottery", min_price=0, max_price=5000))
+
+    assert [p["id"] for p in result["data"]] == ["p2", "p1"]
+    assert result["total"] == 2
+    # Every category within the price range, not just the selected one
+    assert values(result["facets"]["category"]) == {"Pottery": 2, "Textiles": 1}
+    # Every price range within the category
+    assert values(result["facets"]["price_ranges"]) == {"0-500": 1, "1000-2500": 1}
+    assert values(result["facets"]["tags"]) == {"clay": 2, "blue": 1}
+
+
+def test_invalid_prices_are_left_out_of_the_price_facet(memory_db):
+    products = memory_db["products"]
+    seed(products)
+
+    result = filter_products(products, build_filter_query(category="Jewelry"))
+
+    assert result["total"] == 2
+    assert result["facets"]["price_ranges"] == []
+    assert count_facets(list(products.find({"category": "Jewelry"})))["price_ranges"] == []
+
+
+def test_filter_endpoint_validates_paging(client):
+    assert client.get("/api/user/products/filter?limit=0").status_code == 422
+    assert client.get("/api/user/products/filter?limit=101").status_code == 422
+    assert client.get("/api/user/products/filter?page=0").status_code == 422
+    assert client.get("/api/user/products/filter?limit=5").status_code == 200
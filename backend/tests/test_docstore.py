@@ -0,0 +1,33 @@
+import pytest
+
+from docstore import Collection, SQLiteDatabase, UnsupportedOperation
+
+
+def test_unsupported_operators_name_what_is_missing(memory_db):
+    products = memory_db["products"]
+    products.insert_one({"id": "vase", "tags": ["clay"]})
+
+    with pytest.raises(UnsupportedOperation, match=r"query operator \$size"):
+        list(products.find({"tags": {"$size": 1}}))
+    with pytest.raises(UnsupportedOperation, match=r"update operator \$push"):
+        products.update_one({"id": "vase"}, {"$push": {"tags": "blue"}})
+    with pytest.raises(UnsupportedOperation, match=r"aggregation stage \$lookup"):
+        list(products.aggregate([{"$lookup": {"from": "artisans"}}]))
+
+
+def test_storage_hooks_are_abstract(memory_db):
+    with pytest.raises(TypeError):
+        Collection(memory_db, "products")
+
+
+def test_sqlite_indexes_are_built_outside_transactions(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / "store.db"))
+    products = db["products"]
+    products.insert_one({"id": "vase", "status": "active"})
+
+    # The first equality filter on a field builds its index before the read begins
+    assert products.find_one({"status": "active"})["id"] == "vase"
+    with products._transaction():
+        with pytest.raises(RuntimeError):
+            products._build_index("category", False)
+    db.close()
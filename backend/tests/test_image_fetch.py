@@ -0,0 +1,35 @@
+import base64
+import io
+import os
+import time
+
+from PIL import Image
+
+from image_fetch import ImageFetcher
+
+
+def data_url(colour):
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), colour).save(buffer, "PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def test_files_in_use_survive_eviction(tmp_path):
+    fetcher = ImageFetcher(upload_dir=tmp_path / "uploads", cache_dir=tmp_path / "cache",
+                           max_cache_bytes=1, grace_seconds=60)
+    first = fetcher.fetch(data_url("red"))
+    second = fetcher.fetch(data_url("blue"))
+    # Both were just handed out, so neither is evicted despite the tiny budget
+    assert os.path.exists(first) and os.path.exists(second)
+
+    old = time.time() - 120
+    os.utime(first, (old, old))
+    fetcher.fetch(data_url("green"))
+    assert not os.path.exists(first)
+    assert os.path.exists(second)
+
+
+def test_cache_is_outside_uploads():
+    fetcher = ImageFetcher()
+    uploads = os.path.realpath(fetcher.upload_dir)
+    assert os.path.commonpath([os.path.realpath(fetcher.cache_dir), uploads]) != uploads
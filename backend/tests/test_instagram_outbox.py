@@ -0,0 +1,158 @@
+from datetime import datetime, timedelta, timezone
+
+from instagram_outbox import DEAD, PENDING, POSTED, InstagramOutbox
+
+
+def make_outbox(db, publisher=None, **kwargs):
+    sent = []
+
+    def publish(image_path, caption, account):
+        sent.append((image_path, caption, account))
+        return {"status": "posted"}
+
+    return InstagramOutbox(db["instagram_outbox"], publisher or publish, **kwargs), sent
+
+
+def drain(outbox):
+    while outbox.process_one() is not None:
+        pass
+
+
+def test_scheduled_times_are_compared_in_utc(memory_db):
+    outbox, sent = make_outbox(memory_db)
+    past = datetime.now(timezone.utc) - timedelta(minutes=1)
+    # An hour ahead, written in a zone east of UTC
+    future = datetime.now(timezone(timedelta(hours=5, minutes=30))) + timedelta(hours=1)
+    outbox.enqueue("due.png", "shop", caption="due", scheduled_at=past)
+    held = outbox.enqueue("later.png", "shop", caption="later", scheduled_at=future)
+    outbox.enqueue("now.png", "shop", caption="now")
+
+    drain(outbox)
+
+    assert [image for image, _, _ in sent] == ["due.png", "now.png"]
+    stored = outbox.get(held["id"])
+    assert stored["status"] == PENDING
+    assert stored["scheduled_at"].tzinfo is None
+    assert stored["scheduled_at"] == future.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def test_enqueue_is_idempotent_per_key(memory_db):
+    outbox, _ = make_outbox(memory_db)
+    first = outbox.enqueue("a.png", "shop", caption="hi", idempotency_key="req-1")
+    again = outbox.enqueue("a.png", "shop", caption="hi", idempotency_key="req-1")
+    assert again["id"] == first["id"]
+    assert memory_db["instagram_outbox"].count_documents({}) == 1
+
+
+def test_same_poster_without_a_key_is_posted_again(memory_db):
+    outbox, sent = make_outbox(memory_db)
+    outbox.enqueue("poster.png", "shop", caption="hi")
+    drain(outbox)
+    outbox.enqueue("poster.png", "shop", caption="hi")
+    drain(outbox)
+    assert [image for image, _, _ in sent] == ["poster.png", "poster.png"]
+
+
+def test_retrying_a_dead_post_reopens_it(memory_db):
+    def failing(image_path, caption, account):
+        raise RuntimeError("instagram is down")
+
+    outbox, _ = make_outbox(memory_db, publisher=failing, max_attempts=1)
+    post = outbox.enqueue("a.png", "shop", caption="hi", idempotency_key="req-1")
+    assert outbox.process_one()["status"] == DEAD
+
+    again = outbox.enqueue("a.png", "shop", caption="hi", idempotency_key="req-1")
+
+    assert again["id"] == post["id"]
+    assert again["status"] == PENDING
+    assert again["attempts"] == 0
+
+
+def test_rate_limit_is_shared_by_every_worker(memory_db):
+    # Two outboxes on one database stand in for two worker processes
+    first, sent = make_outbox(memory_db, burst=2, posts_per_hour=0.001)
+    second = InstagramOutbox(memory_db["instagram_outbox"], first.publisher, burst=2, posts_per_hour=0.001)
+    for i in range(5):
+        first.enqueue(f"{i}.png", "shop", caption=str(i))
+
+    drain(first)
+    drain(second)
+
+    assert len(sent) == 2
+    # A restarted worker reads the spent bucket instead of starting a fresh burst
+    restarted = InstagramOutbox(memory_db["instagram_outbox"], first.publisher, burst=2, posts_per_hour=0.001)
+    assert restarted.process_one() is None
+
+
+def test_refunded_tokens_never_exceed_the_burst(memory_db):
+    outbox, _ = make_outbox(memory_db, burst=2)
+    outbox._ensure_indexes()
+    assert outbox._adjust_tokens("shop", -1)
+    for _ in range(3):
+        outbox._adjust_tokens("shop", 1)
+    assert memory_db["instagram_outbox_rate_limits"].find_one({"account": "shop"})["tokens"] <= 2
+
+
+def test_failures_back_off_then_give_up(memory_db):
+    def failing(image_path, caption, account):
+        raise RuntimeError("instagram is down")
+
+    outbox, _ = make_outbox(memory_db, publisher=failing, max_attempts=2, burst=10)
+    post = outbox.enqueue("a.png", "shop", caption="hi")
+
+    after_first = outbox.process_one()
+    assert after_first["status"] == PENDING
+    assert after_first["last_error"] == "instagram is down"
+    assert after_first["next_attempt_at"] > datetime.now(timezone.utc).replace(tzinfo=None)
+
+    # Make the retry due now rather than after the backoff
+    memory_db["instagram_outbox"].update_one(
+        {"id": post["id"]}, {"$set": {"next_attempt_at": datetime(2000, 1, 1)}})
+    assert outbox.process_one()["status"] == DEAD
+
+
+def test_missing_captions_are_built_when_publishing(memory_db):
+    sent = []
+    outbox = InstagramOutbox(
+        memory_db["instagram_outbox"],
+        lambda image_path, caption, account: sent.append(caption) or {"status": "posted"},
+        caption_builder=lambda image_path, product_data: f"{product_data['title']} #handmade",
+    )
+    post = outbox.enqueue("a.png", "shop", product_data={"title": "Blue vase"})
+
+    assert outbox.process_one()["status"] == POSTED
+    assert sent == ["Blue vase #handmade"]
+    assert outbox.get(post["id"])["caption"] == "Blue vase #handmade"
+
+
+def test_uncaptioned_posts_are_captioned_in_batches(memory_db):
+    calls = []
+
+    def caption_batch(items):
+        calls.append([image_path for image_path, _ in items])
+        return [f"caption for {image_path}" for image_path, _ in items]
+
+    outbox, sent = make_outbox(memory_db, batch_caption_builder=caption_batch, caption_batch_size=3, burst=10)
+    for i in range(5):
+        outbox.enqueue(f"{i}.png", "shop")
+
+    drain(outbox)
+
+    assert calls == [["0.png", "1.png", "2.png"], ["3.png", "4.png"]]
+    assert [caption for _, caption, _ in sent] == [f"caption for {i}.png" for i in range(5)]
+
+
+def test_batched_captions_share_one_llm_call():
+    from captions import CaptionGenerator
+
+    prompts = []
+
+    def llm(prompt):
+        prompts.append(prompt)
+        return '["one #a", "two #b", "three #c"]'
+
+    generator = CaptionGenerator(llm, batch_size=10)
+    captions = generator.generate_batch(["a red pot", "a blue scarf", "a silver ring", "A red pot."])
+
+    assert len(prompts) == 1
+    assert captions == ["one #a", "two #b", "three #c", "one #a"]
@@ -0,0 +1,69 @@
+from related_products import RelatedProductsEngine
+
+
+def product(product_id, **fields):
+    doc = {"id": product_id, "title": product_id, "tags": ["clay"], "category": "Pottery",
+           "artisan_id": "a1", "price": 1000, "status": "active"}
+    doc.update(fields)
+    return doc
+
+
+def related_ids(engine, product_id):
+    return [entry["id"] for entry in engine.get(product_id)]
+
+
+def test_similar_products_are_related_both_ways(memory_db):
+    products = memory_db["products"]
+    engine = RelatedProductsEngine(products, memory_db["related_products"])
+    for doc in (product("vase"), product("bowl"), product("scarf", tags=["silk"], category="Textiles",
+                                                          artisan_id="a2", price=9000)):
+        products.insert_one(dict(doc))
+        engine.refresh(doc)
+
+    assert "bowl" in related_ids(engine, "vase")
+    assert "vase" in related_ids(engine, "bowl")
+    assert "scarf" not in related_ids(engine, "vase")
+
+
+def test_refresh_drops_stale_entries_from_other_lists(memory_db):
+    products = memory_db["products"]
+    engine = RelatedProductsEngine(products, memory_db["related_products"])
+    for doc in (product("vase"), product("bowl")):
+        products.insert_one(dict(doc))
+        engine.refresh(doc)
+    assert "vase" in related_ids(engine, "bowl")
+
+    # The vase is relisted as something unrelated to the bowl
+    changed = product("vase", tags=["silk"], category="Textiles", artisan_id="a2", price=9000)
+    products.replace_one({"id": "vase"}, changed)
+    engine.refresh(changed)
+
+    assert "vase" not in related_ids(engine, "bowl")
+
+
+def test_removed_neighbours_are_refilled(memory_db):
+    products = memory_db["products"]
+    engine = RelatedProductsEngine(products, memory_db["related_products"], top_k=2)
+    for name in ("vase", "bowl", "jug", "cup"):
+        doc = product(name)
+        products.insert_one(dict(doc))
+        engine.refresh(doc)
+    assert len(related_ids(engine, "vase")) == 2
+    removed = related_ids(engine, "vase")[0]
+
+    products.update_one({"id": removed}, {"$set": {"status": "inactive"}})
+    engine.remove(removed)
+
+    assert removed not in related_ids(engine, "vase")
+    assert len(related_ids(engine, "vase")) == 2
+
+
+def test_inactive_products_get_no_stored_list(memory_db):
+    products = memory_db["products"]
+    engine = RelatedProductsEngine(products, memory_db["related_products"])
+    products.insert_one(product("vase"))
+    products.insert_one(product("bowl", status="inactive"))
+
+    assert engine.get("bowl") == []
+    assert memory_db["related_products"].find_one({"product_id": "bowl"}) is None
+    assert engine.get("missing") is None
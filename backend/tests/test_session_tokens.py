@@ -0,0 +1,42 @@
+import pytest
+
+import session_tokens
+from session_tokens import InvalidToken, issue_token, revoke_token, verify_token
+
+
+def test_revoked_token_stays_revoked_under_many_revocations():
+    token = issue_token("u1", "user")
+    revoke_token(token)
+    for i in range(10001):
+        revoke_token(issue_token(f"other-{i}", "user"))
+
+    with pytest.raises(InvalidToken):
+        verify_token(token)
+
+
+def test_revocations_reach_other_workers(memory_db, monkeypatch):
+    monkeypatch.setattr(session_tokens, "REVOCATION_SYNC_SECONDS", 0)
+    # Two denylists on one collection stand in for two worker processes
+    first, second = session_tokens._Denylist(), session_tokens._Denylist()
+    first.bind(memory_db["revoked_tokens"])
+    second.bind(memory_db["revoked_tokens"])
+    claims = verify_token(issue_token("u1", "user"))
+
+    first.add(claims["jti"], claims["exp"])
+
+    assert claims["jti"] in second
+    assert "someone-else" not in second
+
+
+def test_logout_revokes_the_session(client):
+    client.post("/api/user/auth/register", json={
+        "email": "asha@example.com", "username": "asha", "full_name": "Asha",
+        "password": "secret123", "user_type": "user",
+    })
+    token = client.post("/api/user/auth/login", json={
+        "email": "asha@example.com", "password": "secret123"}).json()["data"]["token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/api/user/auth/me", headers=headers).status_code == 200
+
+    assert client.post("/api/user/auth/logout", headers=headers).status_code == 200
+    assert client.get("/api/user/auth/me", headers=headers).status_code == 401
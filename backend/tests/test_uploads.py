@@ -0,0 +1,122 @@
+import os
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def upload(app_main):
+    """A throwaway file under uploads/, removed afterwards."""
+    name = f"test_{uuid.uuid4().hex[:8]}.bin"
+    path = app_main.UPLOAD_DIR / name
+    path.write_bytes(bytes(range(256)) * 4)
+    yield name, path.read_bytes()
+    os.remove(path)
+
+
+def test_full_download_has_validators(client, upload):
+    name, data = upload
+    response = client.get(f"/uploads/{name}")
+    assert response.status_code == 200
+    assert response.content == data
+    assert response.headers["etag"]
+    assert response.headers["last-modified"]
+    assert response.headers["accept-ranges"] == "bytes"
+
+
+def test_if_none_match_returns_not_modified(client, upload):
+    name, _ = upload
+    etag = client.get(f"/uploads/{name}").headers["etag"]
+
+    response = client.get(f"/uploads/{name}", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+
+def test_stale_etag_gets_the_full_body(client, upload):
+    name, data = upload
+    response = client.get(f"/uploads/{name}", headers={"If-None-Match": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == data
+
+
+def test_range_request_returns_partial_content(client, upload):
+    name, data = upload
+    response = client.get(f"/uploads/{name}", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == data[10:20]
+    assert response.headers["content-range"] == f"bytes 10-19/{len(data)}"
+
+
+def test_suffix_range(client, upload):
+    name, data = upload
+    response = client.get(f"/uploads/{name}", headers={"Range": "bytes=-16"})
+    assert response.status_code == 206
+    assert response.content == data[-16:]
+
+
+def test_unsatisfiable_range(client, upload):
+    name, data = upload
+    response = client.get(f"/uploads/{name}", headers={"Range": f"bytes={len(data) + 10}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(data)}"
+
+
+def test_if_range_mismatch_ignores_the_range(client, upload):
+    name, data = upload
+    response = client.get(f"/uploads/{name}", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == data
+
+
+def test_missing_upload_is_not_found(client):
+    assert client.get("/uploads/does-not-exist.bin").status_code == 404
+
+
+def test_derivatives_are_only_served_through_img(client, app_main):
+    import io
+
+    from PIL import Image
+
+    from derivatives import derivative_cache
+
+    name = f"test_{uuid.uuid4().hex[:8]}.png"
+    path = app_main.UPLOAD_DIR / name
+    buffer = io.BytesIO()
+    Image.new("RGB", (400, 300), (10, 120, 200)).save(buffer, "PNG")
+    path.write_bytes(buffer.getvalue())
+    try:
+        response = client.get(f"/img/{name}?w=64&fmt=png")
+        assert response.status_code == 200
+        assert Image.open(io.BytesIO(response.content)).width == 64
+    finally:
+        os.remove(path)
+
+    uploads = os.path.realpath(app_main.UPLOAD_DIR)
+    assert os.path.commonpath([os.path.realpath(derivative_cache.directory), uploads]) != uploads
+
+
+def test_only_blob_store_paths_are_immutable(client, app_main):
+    import hashlib
+
+    data = b"poster bytes"
+    digest = hashlib.sha256(data).hexdigest()
+    # A client-chosen name that merely looks like a digest
+    named = app_main.UPLOAD_DIR / f"{uuid.uuid4().hex}.png"
+    blob = app_main.UPLOAD_DIR / "blobs" / digest[:2] / digest[2:4] / f"{digest}.png"
+    blob.parent.mkdir(parents=True, exist_ok=True)
+    named.write_bytes(data)
+    blob.write_bytes(data)
+    try:
+        named_response = client.get(f"/uploads/{named.name}")
+        blob_response = client.get(f"/uploads/blobs/{digest[:2]}/{digest[2:4]}/{digest}.png")
+    finally:
+        os.remove(named)
+        os.remove(blob)
+
+    assert "immutable" not in named_response.headers["cache-control"]
+    assert named_response.headers["etag"] != f'"{named.stem}"'
+    assert "immutable" in blob_response.headers["cache-control"]
+    assert blob_response.headers["etag"] == f'"{digest}"'
@@ -0,0 +1,23 @@
+import io
+
+from PIL import Image
+
+
+def test_inactive_matches_do_not_shrink_the_results(client, app_main):
+    import visual_search
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), (200, 40, 40)).save(buffer, "PNG")
+    query = visual_search.compute_embedding(io.BytesIO(buffer.getvalue()))
+
+    # The closest matches are all delisted; the active ones rank below them
+    for i in range(6):
+        status = "inactive" if i < 4 else "active"
+        app_main.products_collection.insert_one({"id": f"p{i}", "title": f"p{i}", "status": status, "tags": []})
+        visual_search.visual_index.upsert(f"p{i}", query * (1 - i / 100))
+
+    response = client.post("/api/user/search/visual?limit=2",
+                           files={"file": ("query.png", buffer.getvalue(), "image/png")})
+
+    assert response.status_code == 200, response.text
+    assert [product["id"] for product in response.json()["data"]] == ["p4", "p5"]
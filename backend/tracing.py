@@ -0,0 +1,268 @@
+# Request tracing for the upload -> vision -> LLM -> poster -> Instagram flow.
+# Spans follow the OpenTelemetry data model (128-bit trace id, 64-bit span id,
+# parent links, attributes, status) and propagate with the W3C `traceparent`
+# header, so traces can be stitched with other OTel services. Finished spans
+# go to pluggable exporters: an in-memory ring for tests and a JSON-lines
+# file using OTLP/JSON field names for offline analysis.
+#
+#   TRACING_ENABLED=1               turn tracing on (off by default)
+#   TRACE_EXPORT_FILE=traces.jsonl  also append finished spans to a file
+#   TRACE_SAMPLE_RATIO=0.1          keep this fraction of new root traces
+import contextvars
+import functools
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from pymongo import monitoring
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "0").lower() in ("1", "true", "yes")
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE")
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", "1.0"))
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "sampled", "kind",
+                 "start_ns", "end_ns", "attributes", "status", "events")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool,
+                 kind: str = "internal", attributes: Optional[dict] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = dict(attributes or {})
+        self.status = "unset"
+        self.events: List[dict] = []
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def record_exception(self, exc: BaseException) -> None:
+        self.status = "error"
+        self.events.append({
+            "name": "exception",
+            "timeUnixNano": time.time_ns(),
+            "attributes": {"exception.type": type(exc).__name__, "exception.message": str(exc)},
+        })
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self) -> dict:
+        """OTLP/JSON-style representation."""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": self.attributes,
+            "status": self.status,
+            "events": self.events,
+        }
+
+
+class InMemorySpanExporter:
+    """Keeps the most recent finished spans; meant for tests and debugging."""
+
+    def __init__(self, max_spans: int = 2048):
+        self._spans = deque(maxlen=max_spans)
+
+    def export(self, span: Span) -> None:
+        self._spans.append(span)
+
+    def get_finished_spans(self, trace_id: Optional[str] = None) -> List[Span]:
+        spans = list(self._spans)
+        return [s for s in spans if s.trace_id == trace_id] if trace_id else spans
+
+    def clear(self) -> None:
+        self._spans.clear()
+
+
+class FileSpanExporter:
+    """Appends one JSON object per finished span."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+class Tracer:
+    def __init__(self, enabled: bool = TRACING_ENABLED, sample_ratio: float = TRACE_SAMPLE_RATIO):
+        self.enabled = enabled
+        self.sample_ratio = sample_ratio
+        self.exporters = []
+
+    def add_exporter(self, exporter) -> None:
+        self.exporters.append(exporter)
+
+    def _new_span(self, name: str, parent: Optional[Span], kind: str, attributes: Optional[dict]) -> Span:
+        if parent is None:
+            trace_id = f"{random.getrandbits(128):032x}"
+            sampled = random.random() < self.sample_ratio
+            return Span(name, trace_id, None, sampled, kind, attributes)
+        return Span(name, parent.trace_id, parent.span_id, parent.sampled, kind, attributes)
+
+    def _finish(self, span: Span) -> None:
+        span.end_ns = time.time_ns()
+        if span.status == "unset":
+            span.status = "ok"
+        if span.sampled:
+            for exporter in self.exporters:
+                try:
+                    exporter.export(span)
+                except Exception as e:
+                    print(f"⚠ Span export failed: {e}")
+
+    @contextmanager
+    def start_span(self, name: str, attributes: Optional[dict] = None, kind: str = "internal",
+                   parent: Optional[Span] = None):
+        """Open a span as a child of ``parent`` (default: the current span)."""
+        if not self.enabled:
+            yield None
+            return
+        span = self._new_span(name, parent or _current_span.get(), kind, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self._finish(span)
+
+
+tracer = Tracer()
+memory_exporter = InMemorySpanExporter()
+tracer.add_exporter(memory_exporter)
+if TRACE_EXPORT_FILE:
+    tracer.add_exporter(FileSpanExporter(TRACE_EXPORT_FILE))
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def start_span(name: str, attributes: Optional[dict] = None, kind: str = "internal"):
+    return tracer.start_span(name, attributes, kind)
+
+
+def bind_context(func, name: Optional[str] = None):
+    """Carry the caller's trace into a background task or executor thread.
+
+    Thread pools and BackgroundTasks run after (or outside) the request's
+    context, so the current span is captured now and the wrapped call runs
+    as its child.
+    """
+    parent = _current_span.get()
+    if not tracer.enabled or parent is None:
+        return func
+    span_name = name or f"background.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with tracer.start_span(span_name, parent=parent):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Span]:
+    """Build a remote parent from a W3C ``traceparent`` header."""
+    match = TRACEPARENT.match((value or "").strip().lower())
+    if not match or match.group(1) == "0" * 32:
+        return None
+    remote = Span("remote", match.group(1), None, bool(int(match.group(3), 16) & 1), "server")
+    remote.span_id = match.group(2)
+    return remote
+
+
+class TracingMiddleware:
+    """Pure ASGI middleware opening a server span per HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        parent = parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        attributes = {"http.method": scope["method"], "http.target": scope["path"]}
+        with tracer.start_span(f"{scope['method']} {scope['path']}", attributes, "server", parent) as span:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.status_code", message["status"])
+                    if message["status"] >= 500:
+                        span.status = "error"
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [
+                        (b"traceparent", span.traceparent.encode())
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+            # Rename to the route handler once the router has matched it
+            endpoint = scope.get("endpoint")
+            if endpoint is not None:
+                span.name = f"{scope['method']} {getattr(endpoint, '__name__', type(endpoint).__name__)}"
+
+
+class MongoCommandTracer(monitoring.CommandListener):
+    """pymongo listener recording each command as a client span."""
+
+    def __init__(self):
+        self._spans: Dict[int, Span] = {}
+
+    def started(self, event):
+        parent = _current_span.get()
+        if not tracer.enabled or parent is None:
+            return
+        collection = event.command.get(event.command_name)
+        self._spans[event.request_id] = tracer._new_span(
+            f"mongodb.{event.command_name}", parent, "client",
+            {"db.system": "mongodb", "db.name": event.database_name,
+             "db.operation": event.command_name,
+             "db.mongodb.collection": collection if isinstance(collection, str) else ""})
+
+    def succeeded(self, event):
+        span = self._spans.pop(event.request_id, None)
+        if span is not None:
+            tracer._finish(span)
+
+    def failed(self, event):
+        span = self._spans.pop(event.request_id, None)
+        if span is not None:
+            span.status = "error"
+            span.set_attribute("error.message", str(event.failure))
+            tracer._finish(span)
@@ -0,0 +1,343 @@
+# Visual search over product images. Every product image gets a small
+# CPU-friendly embedding (colour histogram, colour layout and edge texture)
+# stored as float16 rows in a memory-mapped file, so the index opens
+# instantly at startup. Queries are a single matrix-vector product, which is
+# fast enough for catalogs up to a few hundred thousand images.
+import contextlib
+import json
+import os
+import pathlib
+import threading
+from typing import IO, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from image_loader import load_image
+
+# Kept outside uploads/, which is served publicly as static files
+INDEX_DIR = pathlib.Path(os.getenv("VISUAL_INDEX_DIR", str(pathlib.Path("data") / "visual_index")))
+EMBEDDING_SIZE = 128  # working resolution for feature extraction
+HUE_BINS, SAT_BINS, VAL_BINS = 8, 3, 3
+LAYOUT_GRID = 4
+GRADIENT_BINS = 8
+EMBEDDING_DIM = HUE_BINS * SAT_BINS * VAL_BINS + LAYOUT_GRID * LAYOUT_GRID * 3 + 4 * GRADIENT_BINS
+INITIAL_CAPACITY = 1024
+SEARCH_CHUNK_ROWS = 16384
+
+
+def _load_for_embedding(source: Union[str, IO[bytes]]) -> Image.Image:
+    # Transparency is flattened onto white, as posters and product shots are shown
+    im = load_image(source, "RGB", size_hint=(EMBEDDING_SIZE * 2, EMBEDDING_SIZE * 2))
+    return im.resize((EMBEDDING_SIZE, EMBEDDING_SIZE), Image.BILINEAR)
+
+
+def compute_embedding(source: Union[str, IO[bytes]]) -> np.ndarray:
+    """Return an L2-normalised float32 embedding for an image path or file object."""
+    im = _load_for_embedding(source)
+
+    # Global colour distribution in HSV
+    hsv = np.asarray(im.convert("HSV"), dtype=np.uint16)
+    h = hsv[..., 0] * HUE_BINS // 256
+    s = hsv[..., 1] * SAT_BINS // 256
+    v = hsv[..., 2] * VAL_BINS // 256
+    bins = (h * SAT_BINS + s) * VAL_BINS + v
+    colour_hist = np.bincount(bins.ravel(), minlength=HUE_BINS * SAT_BINS * VAL_BINS).astype(np.float32)
+    colour_hist /= colour_hist.sum()
+
+    # Coarse spatial layout: mean RGB per grid cell
+    rgb = np.asarray(im, dtype=np.float32) / 255.0
+    cell = EMBEDDING_SIZE // LAYOUT_GRID
+    layout = rgb.reshape(LAYOUT_GRID, cell, LAYOUT_GRID, cell, 3).mean(axis=(1, 3)).ravel()
+    layout = layout - layout.mean()
+
+    # Texture: gradient orientation histograms per image quadrant
+    gray = rgb.mean(axis=2)
+    gx = np.zeros_like(gray)
+    gy = np.zeros_like(gray)
+    gx[:, 1:-1] = gray[:, 2:] - gray[:, :-2]
+    gy[1:-1, :] = gray[2:, :] - gray[:-2, :]
+    magnitude = np.hypot(gx, gy)
+    orientation = ((np.arctan2(gy, gx) % np.pi) / np.pi * GRADIENT_BINS).astype(np.int64) % GRADIENT_BINS
+    half = EMBEDDING_SIZE // 2
+    texture = []
+    for qy in (0, half):
+        for qx in (0, half):
+            o = orientation[qy:qy + half, qx:qx + half].ravel()
+            m = magnitude[qy:qy + half, qx:qx + half].ravel()
+            texture.append(np.bincount(o, weights=m, minlength=GRADIENT_BINS))
+    texture = np.concatenate(texture).astype(np.float32)
+    texture /= texture.sum() or 1.0
+
+    # Hellinger (sqrt) scaling makes histogram dot products behave like similarity
+    vector = np.concatenate([
+        np.sqrt(colour_hist) * 1.0,
+        layout * 0.6,
+        np.sqrt(texture) * 0.7,
+    ]).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class _FileLock:
+    """Exclusive advisory lock on a file, held across the index's worker processes."""
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self._file = None
+        self._depth = 0
+
+    def __enter__(self) -> "_FileLock":
+        # Re-entrant within the holder; callers serialise threads with their own lock first
+        if self._depth == 0:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            f = open(self.path, "a+b")
+            try:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            except Exception:
+                f.close()
+                raise
+            self._file = f
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            f, self._file = self._file, None
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            f.close()
+
+
+class VisualIndex:
+    """Incrementally updated float16 embedding store with brute-force search.
+
+    The memmap and ids.json are shared by every worker process, so writers
+    take a file lock and reload ids.json before allocating rows; readers pick
+    up other workers' changes whenever ids.json has been replaced.
+    """
+
+    def __init__(self, directory: Union[str, pathlib.Path] = INDEX_DIR, dim: int = EMBEDDING_DIM):
+        self.directory = pathlib.Path(directory)
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._file_lock = _FileLock(self.directory / "index.lock")
+        self._vectors = None  # np.memmap (capacity, dim) float16
+        self._ids: List[Optional[str]] = []
+        self._rows: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._signature = None  # (inode, mtime, size) of the ids.json last read or written
+        self._batch = 0
+        self._loaded = False
+
+    @property
+    def _vectors_path(self) -> pathlib.Path:
+        return self.directory / "embeddings.f16"
+
+    @property
+    def _ids_path(self) -> pathlib.Path:
+        return self.directory / "ids.json"
+
+    def _open(self, capacity: int, mode: str) -> np.memmap:
+        return np.memmap(self._vectors_path, dtype=np.float16, mode=mode, shape=(capacity, self.dim))
+
+    def _stat_ids(self):
+        try:
+            st = os.stat(self._ids_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _sync(self) -> None:
+        """Reload ids.json if another process has replaced it since we last looked."""
+        signature = self._stat_ids()
+        if signature is None or signature == self._signature or not self._vectors_path.exists():
+            return
+        meta = json.loads(self._ids_path.read_text())
+        if meta.get("dim") != self.dim:
+            return
+        self._signature = signature
+        if self._vectors is None or self._vectors.shape[0] != meta["capacity"]:
+            # Another worker grew the file; rows keep their offsets so just remap
+            self._vectors = self._open(meta["capacity"], "r+")
+        self._ids = meta["ids"]
+        self._rows = {pid: row for row, pid in enumerate(self._ids) if pid is not None}
+        self._free = [row for row, pid in enumerate(self._ids) if pid is None]
+
+    def load(self) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+            with self._file_lock:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                self._sync()
+                if self._vectors is None:
+                    self._ids = []
+                    self._vectors = self._open(INITIAL_CAPACITY, "w+")
+                    self._save_ids()
+            self._loaded = True
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Hold the write lock across many updates and write ids.json once at the end."""
+        self.load()
+        with self._lock, self._file_lock:
+            self._sync()
+            self._batch += 1
+            try:
+                yield self
+            finally:
+                self._batch -= 1
+                if not self._batch:
+                    self._save_ids()
+
+    def _grow(self) -> None:
+        old = self._vectors
+        capacity = old.shape[0] * 2
+        old.flush()
+        del self._vectors
+        # Extending the file keeps the existing rows in place
+        with open(self._vectors_path, "r+b") as f:
+            f.truncate(capacity * self.dim * 2)
+        self._vectors = self._open(capacity, "r+")
+
+    def _save_ids(self) -> None:
+        self._vectors.flush()
+        tmp_path = self._ids_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps({"dim": self.dim, "capacity": self._vectors.shape[0], "ids": self._ids}))
+        os.replace(tmp_path, self._ids_path)
+        self._signature = self._stat_ids()
+
+    def __len__(self) -> int:
+        self.load()
+        with self._lock:
+            self._sync()
+            return len(self._rows)
+
+    def upsert(self, product_id: str, vector: np.ndarray) -> None:
+        """Insert or replace the embedding for a product."""
+        with self.batch():
+            row = self._rows.get(product_id)
+            if row is None:
+                if self._free:
+                    row = self._free.pop()
+                    self._ids[row] = product_id
+                else:
+                    row = len(self._ids)
+                    if row >= self._vectors.shape[0]:
+                        self._grow()
+                    self._ids.append(product_id)
+                self._rows[product_id] = row
+            self._vectors[row] = vector.astype(np.float16)
+
+    def remove(self, product_id: str) -> None:
+        with self.batch():
+            row = self._rows.pop(product_id, None)
+            if row is None:
+                return
+            self._vectors[row] = 0
+            self._ids[row] = None
+            self._free.append(row)
+
+    def save(self) -> None:
+        with self.batch():
+            pass
+
+    def search(self, vector: np.ndarray, k: int = 20) -> List[Tuple[str, float]]:
+        """Return the ``k`` most similar products as (product_id, cosine score)."""
+        self.load()
+        with self._lock:
+            self._sync()
+            count = len(self._ids)
+            if not self._rows:
+                return []
+            query = vector.astype(np.float32)
+            scores = np.empty(count, dtype=np.float32)
+            # float16 has no BLAS path, so widen the rows chunk by chunk
+            for start in range(0, count, SEARCH_CHUNK_ROWS):
+                end = min(start + SEARCH_CHUNK_ROWS, count)
+                scores[start:end] = self._vectors[start:end].astype(np.float32) @ query
+            for row in self._free:
+                scores[row] = -np.inf
+            k = min(k, len(self._rows))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._ids[row], float(scores[row])) for row in top]
+
+
+visual_index = VisualIndex()
+
+
+def resolve_upload_path(image_ref: str, upload_dir: Union[str, pathlib.Path] = "uploads") -> Optional[str]:
+    """Map a stored product image reference to a local file under uploads."""
+    if not image_ref or image_ref.startswith("data:"):
+        return None
+    path = image_ref
+    if "://" in path:
+        path = path.split("://", 1)[1]
+        path = path[path.find("/"):] if "/" in path else ""
+    path = path.split("?", 1)[0].lstrip("./")
+    if path.startswith("uploads/"):
+        path = path[len("uploads/"):]
+    upload_dir = os.path.realpath(upload_dir)
+    full_path = os.path.realpath(os.path.join(upload_dir, path))
+    if os.path.commonpath([full_path, upload_dir]) != upload_dir or not os.path.isfile(full_path):
+        return None
+    return full_path
+
+
+def index_product(product: dict, upload_dir: Union[str, pathlib.Path] = "uploads") -> bool:
+    """(Re)compute the embedding of a product's first local image."""
+    product_id = product.get("id")
+    if not product_id:
+        return False
+    for image_ref in product.get("images") or []:
+        path = resolve_upload_path(image_ref, upload_dir)
+        if path:
+            try:
+                visual_index.upsert(product_id, compute_embedding(path))
+                return True
+            except Exception as e:
+                print(f"⚠ Could not embed {path}: {e}")
+    visual_index.remove(product_id)
+    return False
+
+
+def rebuild_index(products_collection, upload_dir: Union[str, pathlib.Path] = "uploads") -> int:
+    """Embed every product in the collection; used to backfill existing catalogs."""
+    indexed = 0
+    with visual_index.batch():
+        for product in products_collection.find({}, {"_id": 0, "id": 1, "images": 1}):
+            indexed += index_product(product, upload_dir)
+    return indexed
+
+
+if __name__ == "__main__":
+    import sys
+
+    from resources import Resources
+
+    # Same DATABASE_BACKEND / MONGO_* / DATABASE_PATH settings as the app
+    resources = Resources()
+    db = resources.open()
+    if db is None:
+        sys.exit("Database not available")
+    try:
+        count = rebuild_index(db["products"])
+    finally:
+        resources.close()
+    print(f"✓ Indexed {count} product images into {INDEX_DIR}")
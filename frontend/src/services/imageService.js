@@ -33,6 +33,22 @@ export const imageService = {
     return `${API_BASE_URL}/uploads/${imagePath}`
   },
 
+  // Resized copy of an upload for thumbnails (served by the backend /img route)
+  getThumbnailUrl: (imagePath, width = 320, format = 'webp') => {
+    if (!imagePath) return null
+
+    // Only local uploads can be resized by the backend
+    if (imagePath.startsWith('http') || imagePath.startsWith('data:')) {
+      return imageService.getImageUrl(imagePath)
+    }
+
+    const cleanPath = imagePath
+      .replace(/^\.\//, '')
+      .replace(/^\//, '')
+      .replace(/^uploads\//, '')
+    return `${API_BASE_URL}/img/${cleanPath}?w=${width}&fmt=${format}`
+  },
+
   // Get fallback image for different product categories
   getFallbackImage: (category = 'other') => {
     const fallbackImages = {